@@ -0,0 +1,203 @@
+"""
+Command acknowledgment support for rvc2mqtt
+
+Commands sent to the RV-C bus are tracked until the device responds
+with an ACKNOWLEDGMENT (0E8xx) frame.  Commands that are not acknowledged
+in time are resent with backoff.  Round trip latency is kept in histograms.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+from typing import Callable
+from rvc2mqtt.metrics_support import LatencyHistogram
+from rvc2mqtt.timer_support import TimerSupport
+
+
+class _InFlightCommand(object):
+    __slots__ = ("key", "name", "rvc_msg", "attempts", "first_sent", "last_sent", "deadline")
+
+    def __init__(self, key: tuple, name: str, rvc_msg: dict):
+        self.key = key
+        self.name = name
+        self.rvc_msg = rvc_msg
+        self.attempts = 0
+        self.first_sent = None
+        self.last_sent = None
+        self.deadline = None
+
+
+class CommandAckTracker(object):
+    """ Table of commands waiting for an ACKNOWLEDGMENT.
+
+    Commands are matched to acknowledgments by the acknowledged DGN, the instance
+    (byte 0 of the command) and the source address of the bridge (the ACK destination).
+    If the command has an "ack_callback" it is called with True when acknowledged
+    and False when not acknowledged or, if retries are enabled, timed out.
+    Many devices never send acknowledgments so with no retries (the default)
+    a timeout is only counted and logged.
+
+    All functions must be called from the main loop.
+    """
+
+    # command dgns that are acknowledged by devices.  Byte 0 is the instance.
+    DEFAULT_TRACKED_DGNS = {"1FFBC": "DC_LOAD_COMMAND",
+                            "1FEF9": "THERMOSTAT_COMMAND_1",
+                            "1FFF6": "WATERHEATER_COMMAND"}
+
+    RVC_DECODE_FIELDS = {"ACKNOWLEDGMENT": ("acknowledgment_code", "acknowledgment_code_definition",
+                                            "instance", "dgn_acknowledged")}
+
+    ACK = 0
+    ACK_NEEDS_MORE_TIME = 7
+
+    ALL_INSTANCES = 0xFF
+
+    def __init__(self, timer_support: TimerSupport, send_func: Callable[[dict], None],
+                 default_source_id: str = "82", timeout: float = 1.0, retries: int = 0,
+                 backoff: float = 2.0, tracked_dgns: dict = DEFAULT_TRACKED_DGNS):
+        """
+        send_func - queues a rvc message for resending
+        timeout - seconds to wait for the first acknowledgment
+        retries - number of times to resend a command.  0 to only observe
+        backoff - multiplier applied to the timeout after each resend
+        """
+        self.Logger = logging.getLogger(__name__)
+        self.timer_support = timer_support
+        self.send_func = send_func
+        self.default_source_id = int(default_source_id, 16)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.tracked_dgns = {self._normalize_dgn(k): v for k, v in tracked_dgns.items()}
+
+        self._in_flight = {}
+        self.latency = {name: LatencyHistogram() for name in self.tracked_dgns.values()}
+        self.counters = {"sent": 0, "acked": 0, "nacked": 0, "resent": 0, "timed_out": 0, "superseded": 0}
+
+    @staticmethod
+    def _normalize_dgn(dgn: str) -> str:
+        return "{0:05X}".format(int(dgn, 16))
+
+    def command_sent(self, rvc_msg: dict) -> None:
+        """ Called when a rvc message is put on the canbus.  Start tracking it if
+        it is a command that gets acknowledged. """
+        dgn = self._normalize_dgn(rvc_msg["dgn"])
+        name = self.tracked_dgns.get(dgn)
+        if name is None or rvc_msg["data"][0] == CommandAckTracker.ALL_INSTANCES:
+            # group commands to all instances are acknowledged by many devices (or none)
+            return
+
+        source = int(rvc_msg["source_id"], 16) if "source_id" in rvc_msg else self.default_source_id
+        key = (dgn, rvc_msg["data"][0], source)
+        now = self.timer_support.time()
+
+        entry = self._in_flight.get(key)
+        if entry is None or entry.rvc_msg is not rvc_msg:
+            if entry is not None:
+                # newer command for the same device replaces the old one
+                self.counters["superseded"] += 1
+            entry = _InFlightCommand(key, name, rvc_msg)
+            entry.first_sent = now
+            self._in_flight[key] = entry
+            self.counters["sent"] += 1
+        else:
+            self.counters["resent"] += 1
+
+        entry.attempts += 1
+        entry.last_sent = now
+        self._start_wait(entry, now)
+
+    def process_rvc_msg(self, new_message: dict) -> bool:
+        """ Process an ACKNOWLEDGMENT.  Returns True if the message was an
+        acknowledgment for a tracked command """
+        if new_message["name"] != "ACKNOWLEDGMENT":
+            return False
+
+        try:
+            key = (self._normalize_dgn(new_message["dgn_acknowledged"]), new_message["instance"],
+                   int(new_message["dgn_l"], 16))
+        except (KeyError, TypeError, ValueError):
+            return False
+
+        entry = self._in_flight.get(key)
+        if entry is None:
+            return False
+
+        code = new_message["acknowledgment_code"]
+        now = self.timer_support.time()
+
+        if code == CommandAckTracker.ACK_NEEDS_MORE_TIME:
+            # device is working on it.  Restart the wait without resending
+            entry.last_sent = now
+            self._start_wait(entry, now)
+            return True
+
+        del self._in_flight[key]
+        self.latency[entry.name].record(now - entry.last_sent)
+        if code == CommandAckTracker.ACK:
+            self.counters["acked"] += 1
+            self.Logger.debug(f"{entry.name} instance {key[1]} acknowledged in {(now - entry.first_sent) * 1000:.1f}ms "
+                              f"after {entry.attempts} attempt(s)")
+        else:
+            self.counters["nacked"] += 1
+            self.Logger.warning(f"{entry.name} instance {key[1]} not acknowledged by source {new_message['source_id']}: "
+                                f"{new_message.get('acknowledgment_code_definition', code)}")
+        self._notify(entry, code == CommandAckTracker.ACK)
+        return True
+
+    def _notify(self, entry: _InFlightCommand, acked: bool) -> None:
+        """ call the ack_callback(acked: bool) of the command if it has one """
+        callback = entry.rvc_msg.get("ack_callback")
+        if callback is not None:
+            try:
+                callback(acked)
+            except Exception as e:
+                self.Logger.error(f"Exception in ack callback for {entry.name}: {e}")
+
+    def _start_wait(self, entry: _InFlightCommand, now: float) -> None:
+        """ wait for an acknowledgment.  The wait grows by backoff with each attempt """
+        entry.deadline = now + self.timeout * (self.backoff ** (entry.attempts - 1))
+        self.timer_support.call_at(entry.deadline, self._on_timeout, entry)
+
+    def _on_timeout(self, entry: _InFlightCommand) -> None:
+        if self._in_flight.get(entry.key) is not entry or self.timer_support.time() < entry.deadline:
+            # acknowledged, replaced, or a later wait was started
+            return
+
+        if entry.attempts > self.retries:
+            del self._in_flight[entry.key]
+            self.counters["timed_out"] += 1
+            if self.retries == 0:
+                # the device may just not send acknowledgments.  Not a failure
+                self.Logger.info(f"{entry.name} instance {entry.key[1]} not acknowledged")
+                return
+            self.Logger.warning(f"{entry.name} instance {entry.key[1]} not acknowledged after {entry.attempts} attempt(s)")
+            self._notify(entry, False)
+            return
+
+        self.Logger.debug(f"{entry.name} instance {entry.key[1]} not acknowledged.  Resending")
+        self.send_func(entry.rvc_msg)
+
+    def get_in_flight_count(self) -> int:
+        return len(self._in_flight)
+
+    def get_stats(self) -> dict:
+        """ counters and round trip latency per command suitable for json """
+        stats = dict(self.counters)
+        stats["in_flight"] = len(self._in_flight)
+        stats["latency"] = {name: h.as_dict() for name, h in self.latency.items()}
+        return stats
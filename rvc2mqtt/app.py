@@ -24,6 +24,7 @@ limitations under the License.
 """
 
 import argparse
+import concurrent.futures
 import logging
 import logging.config
 import queue
@@ -31,38 +32,67 @@ import signal
 import time
 import os
 import sys
-import ruyaml as YAML
 from os import PathLike
 import datetime
 from typing import Optional
 from rvc2mqtt.rvc import RVC_Decoder
 from rvc2mqtt.can_support import CAN_Watcher
-from rvc2mqtt.mqtt import MQTT_Support
+from rvc2mqtt.mqtt import MQTT_Support, MqttInitalize
 from rvc2mqtt.plugin_support import PluginSupport
-from rvc2mqtt.mqtt import *
-from rvc2mqtt.entity_factory_support import entity_factory
+from rvc2mqtt.timer_support import TimerSupport
+from rvc2mqtt.ack_support import CommandAckTracker
+from rvc2mqtt.request_support import DgnRequestScheduler
+from rvc2mqtt.tx_support import TxScheduler
+from rvc2mqtt.bulk_support import BulkCommandSupport
+from rvc2mqtt.metrics_support import StartupTimer, FrameLatencyTracer
+from rvc2mqtt.snapshot_support import StateSnapshot
+from rvc2mqtt.watchdog_support import LoopWatchdog
+from rvc2mqtt.profile_support import ProfileSupport
+from rvc2mqtt.memory_support import MemoryReport
+from rvc2mqtt.traffic_support import BusTrafficAnalyzer
+from rvc2mqtt.capture_support import CaptureRecorder
+from rvc2mqtt.entity_factory_support import entity_factory, resolve_entity_links, EntityFactoryRegistry, collect_rvc_decode_fields
 
 PATH_TO_FOLDER = os.path.abspath(os.path.dirname(__file__))
 
 
 def signal_handler(signal, frame):
     global MyApp
-    logging.critical("shutting down.")
-    MyApp.close()
-    logging.shutdown()
-    exit(0)
+    # The main loop may hold entity, timer or queue locks when the signal arrives.
+    # Only set a flag here.  The main loop stops and closes the app.
+    MyApp.stop_requested = True
 
 
 class app(object):
+
+    METRICS_PUBLISH_INTERVAL = 60  # seconds
+    RX_BATCH_SIZE = 100  # max received messages processed before checking for commands again
+
+    # set by the signal handler.  The main loop exits and closes the app when it sees it
+    stop_requested = False
+
     def main(self, argsns: argparse.Namespace):
         """main function.  Sets up the app services, creates
         the receive thread, and processes messages.
 
-        Runs until kill/term signal is sent
+        Runs until kill/term signal is sent.  Then closes the app
         """
 
         self.Logger = logging.getLogger("app")
         self.mqtt_client: MQTT_Support = None
+        self.state_snapshot: StateSnapshot = None
+        self.watchdog: LoopWatchdog = None
+        self.memory_report: MemoryReport = None
+        self.frame_tracer: FrameLatencyTracer = None
+        self.capture_recorder: CaptureRecorder = None
+        self.startup_timer = StartupTimer()
+
+        # Loading the rvc spec and the plugins don't depend on anything else.
+        # Run them while the can bus and mqtt are set up.
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+        decoder_future = executor.submit(self._load_rvc_decoder)
+        plugins_future = executor.submit(self._load_plugins, argsns.plugin_paths)
+        executor.shutdown(wait=False)
 
         # make an receive queue of receive can bus messages
         self.rxQueue = queue.Queue()
@@ -73,103 +103,298 @@ class app(object):
         # this is a little hacky...so need to revisit
         self.tx_RVC_Buffer = queue.Queue()
 
-        # make a transmit queue to send can bus messages
-        self.txQueue = queue.Queue()
+        # mqtt commands are processed on the main loop ahead of received can bus messages
+        self.mqtt_command_queue = queue.Queue()
+
+        # make a transmit queue to send can bus messages.
+        # Ordered by traffic class and priority.  Limited to a share of the bus
+        self.txQueue = TxScheduler(float(argsns.tx_max_bus_share))
+
+        # timed callbacks for entities and services.  Run from the main loop
+        self.timer_support = TimerSupport()
+
+        # match commands sent to acknowledgments from devices
+        self.ack_tracker = CommandAckTracker(
+            self.timer_support, self.tx_RVC_Buffer.put, RVC_Decoder.DEFAULT_SOURCE_ID,
+            timeout=float(argsns.ack_timeout), retries=int(argsns.ack_retries))
+
+        # thread to receive can bus messages.  Received frames queue up until the main loop runs
+        with self.startup_timer.phase("can_bus"):
+            # optional binary capture of the raw frames the can bus thread receives and sends
+            if argsns.capture_dir is not None:
+                self.capture_recorder = CaptureRecorder(
+                    argsns.capture_dir, max_bytes=int(float(argsns.capture_rotate_mb) * 1024 * 1024),
+                    max_seconds=float(argsns.capture_rotate_minutes) * 60, keep_files=int(argsns.capture_keep_files),
+                    compress=argsns.capture_compress)
+                self.capture_recorder.start()
+            self.receiver = CAN_Watcher(
+                argsns.can_interface, self.rxQueue, self.txQueue, self.capture_recorder)
+            self.receiver.start()
+
+        # setup the mqtt broker connection.  Doesn't wait for the broker.
+        # Publishes are buffered until connected
+        if argsns.mqtt_host is not None:
+            with self.startup_timer.phase("mqtt"):
+                self.mqtt_client = MqttInitalize(
+                    argsns.mqtt_host, argsns.mqtt_port, argsns.mqtt_user, argsns.mqtt_pass, argsns.mqtt_client_id)
+                self.mqtt_client.set_command_queue(self.mqtt_command_queue)
+                self.mqtt_client.set_timer_support(self.timer_support)
+                self.mqtt_client.client.loop_start()
 
-        # thread to receive can bus messages
-        self.receiver = CAN_Watcher(
-            argsns.can_interface, self.rxQueue, self.txQueue)
-        self.receiver.start()
+        # entities need the plugins
+        (self.PluginSupport, self.entity_factory_registry) = plugins_future.result()
 
-        # setup decoder
-        self.rvc_decoder = RVC_Decoder()
-        self.rvc_decoder.load_rvc_spec(os.path.join(
-            PATH_TO_FOLDER, 'rvc-spec.yml'))  # load the RVC spec yaml
+        with self.startup_timer.phase("entities"):
+            # setup entity list using
+            self.entity_list = []
 
-        # setup the mqtt broker connection
-        if argsns.mqtt_host is not None:
-            self.mqtt_client = MqttInitalize(
-                argsns.mqtt_host, argsns.mqtt_port, argsns.mqtt_user, argsns.mqtt_pass, argsns.mqtt_client_id)
-            if self.mqtt_client:
-                self.mqtt_client.client.loop_start()
+            # initialize objects from the floorplan
+            for item in argsns.fp:
+                obj = entity_factory(
+                    item, self.mqtt_client, self.entity_factory_registry)
+                if obj is not None:
+                    self.entity_list.append(obj)
+
+            # add entity links if defined.  This allows one entity to reference another entity
+            # Done after all entities are created so links can be in any order in the floorplan
+            resolve_entity_links(self.entity_list)
+
+        # the request scheduler needs the decoder
+        self.rvc_decoder = decoder_future.result()
 
-        # Enable plugins
-        self.PluginSupport: PluginSupport = PluginSupport(os.path.join(
-            PATH_TO_FOLDER, "entity"), argsns.plugin_paths)
-
-        # Use plugins to dynamically prepare the entity factory
-        entity_factory_list = []
-        self.PluginSupport.register_with_factory_the_entity_plugins(
-            entity_factory_list)
-
-        # setup entity list using
-        self.entity_list = []
-
-        # initialize objects from the floorplan
-        for item in argsns.fp:
-            obj = entity_factory(
-                item, self.mqtt_client, entity_factory_list)
-            if obj is not None:
-                # add entity links if defined.  This allows one entity to reference another entity
-                for link in obj.entity_links:
-                    requested_entity = next(filter(lambda entry: entry.link_id == link, self.entity_list), None)
-                    if requested_entity is not None:
-                        obj.add_entity_link(requested_entity)
-                    
+        with self.startup_timer.phase("entity_initialize"):
+            # entity requests for dgns are merged and paced out after all entities are initialized
+            self.dgn_request_scheduler = DgnRequestScheduler(
+                self.timer_support, self.tx_RVC_Buffer.put, wildcard_dgns=self.rvc_decoder.get_instanced_dgns())
+
+            for obj in self.entity_list:
                 obj.set_rvc_send_queue(self.tx_RVC_Buffer)
+                obj.set_timer_support(self.timer_support)
+                obj.set_dgn_request_scheduler(self.dgn_request_scheduler)
                 obj.initialize()
-                self.entity_list.append(obj)
+            self.dgn_request_scheduler.start()
+
+            # json scene commands for many entities at once
+            if self.mqtt_client is not None:
+                self.bulk_command_support = BulkCommandSupport(self.mqtt_client, self.entity_list, self.tx_RVC_Buffer)
+
+        # publish the last known states (marked stale) while waiting for devices to report
+        if argsns.state_snapshot_file is not None:
+            with self.startup_timer.phase("snapshot_restore"):
+                self.state_snapshot = StateSnapshot(argsns.state_snapshot_file, self.entity_list, self.timer_support)
+                self.state_snapshot.restore()
+                self.state_snapshot.start()
+
+        # Only decode the fields the entities and ack tracker consume.
+        self.rvc_decoder.set_field_projection(collect_rvc_decode_fields(self.entity_list + [self.ack_tracker]))
+        self.bus_trace_logger = logging.getLogger("rvc_bus_trace")
+        self.unhandled_logger = logging.getLogger("unhandled_rvc")
+
+        # frame counts and rates per DGN and source to see what is on the bus
+        self.traffic_analyzer = BusTrafficAnalyzer(self.rvc_decoder.get_dgn_name, tx_bits=lambda: self.txQueue.bits_sent)
+
+        # optional latency of each stage of processing received frames
+        if argsns.frame_latency_tracing:
+            self.frame_tracer = FrameLatencyTracer()
+            if self.mqtt_client is not None:
+                self.mqtt_client.frame_tracer = self.frame_tracer
+
+        if self.mqtt_client is not None:
+            self.timer_support.call_later(app.METRICS_PUBLISH_INTERVAL, self._publish_metrics)
+
+        # profile the main loop on SIGUSR1 or a mqtt command
+        self.profile_support = ProfileSupport(argsns.profile_dir, self.timer_support, self.mqtt_client)
+        self.profile_support.install_signal_handler()
+
+        # memory growth reports on demand and every MEMORY_REPORT_INTERVAL seconds
+        self.memory_report = MemoryReport(self.timer_support, self.mqtt_client, self._get_queue_depths,
+                                          float(argsns.memory_report_interval))
+        self.memory_report.start()
+
+        self.startup_timer.mark("main_loop")
+        self.Logger.info(f"Startup {self.startup_timer}")
+        if self.mqtt_client is not None:
+            self.mqtt_client.publish_metrics("startup", self.startup_timer.as_dict())
+
+        # report the stack of the main loop if it stops running.  Started after startup so it isn't a stall
+        if float(argsns.loop_stall_threshold) > 0:
+            self.watchdog = LoopWatchdog(float(argsns.loop_stall_threshold), self._report_stall, self._get_queue_depths)
+            self.watchdog.start()
 
         # Our RVC message loop here
-        while True:
-            # process any received messages
-            self.message_rx_loop()
-            self.message_tx_loop()
-            time.sleep(0.001)
+        # Commands first so they don't wait behind a backlog of received messages
+        while not self.stop_requested:
+            if self.watchdog is not None:
+                self.watchdog.beat()
+            if self.profile_support.start_requested:
+                self.profile_support.start()
+            busy = self.message_mqtt_loop()
+            busy |= self.timer_support.service() > 0
+            busy |= self.message_tx_loop()
+            busy |= self.message_rx_loop()
+            if not busy:
+                time.sleep(0.001)
+
+        self.Logger.critical("shutting down.")
+        self.close()
+
+    def _load_rvc_decoder(self) -> RVC_Decoder:
+        """ startup thread.  Load and compile the RVC spec yaml """
+        with self.startup_timer.phase("rvc_spec"):
+            rvc_decoder = RVC_Decoder()
+            rvc_decoder.load_rvc_spec(os.path.join(
+                PATH_TO_FOLDER, 'rvc-spec.yml'))  # load the RVC spec yaml
+        return rvc_decoder
+
+    def _load_plugins(self, plugin_paths: list) -> tuple:
+        """ startup thread.  Find the entity plugins and prepare the entity factory """
+        with self.startup_timer.phase("plugins"):
+            # Enable plugins
+            plugin_support = PluginSupport(os.path.join(
+                PATH_TO_FOLDER, "entity"), plugin_paths)
+
+            # Use plugins to dynamically prepare the entity factory
+            registry = EntityFactoryRegistry()
+            plugin_support.register_with_factory_the_entity_plugins(registry)
+        return (plugin_support, registry)
 
     def close(self):
         """Shutdown the app and any threads"""
         if self.receiver:
             self.receiver.kill_received = True
+        if self.watchdog is not None:
+            self.watchdog.kill_received = True
+        if self.state_snapshot is not None:
+            self.state_snapshot.close()
+        if self.memory_report is not None:
+            self.memory_report.close()
+        if self.capture_recorder is not None:
+            self.capture_recorder.close()
         if self.mqtt_client is not None:
             self.mqtt_client.shutdown()
             self.mqtt_client.client.loop_stop()
 
-    def message_tx_loop(self):
-        """ hacky - translate RVC formatted dict from rvc_tx to canbus msg formatted tx"""
-        if self.tx_RVC_Buffer.empty():
-            return
-
-        rvc_dict = self.tx_RVC_Buffer.get()
-
-        # translate
-        rvc_dict["arbitration_id"] = self.rvc_decoder._rvc_to_can_frame(
-            rvc_dict)
+    def _publish_metrics(self):
+        """ periodic timer callback to publish bridge metrics """
+        self.timer_support.call_later(app.METRICS_PUBLISH_INTERVAL, self._publish_metrics)
+        self.mqtt_client.publish_metrics("command_ack", self.ack_tracker.get_stats())
+        self.mqtt_client.publish_metrics("dgn_request", self.dgn_request_scheduler.get_stats())
+        self.mqtt_client.publish_metrics("tx", self.txQueue.get_stats())
+        self.mqtt_client.publish_metrics("mqtt_offline", self.mqtt_client.get_offline_stats())
+        if self.watchdog is not None:
+            self.mqtt_client.publish_metrics("loop_watchdog", self.watchdog.get_stats())
+        if self.frame_tracer is not None:
+            self.mqtt_client.publish_metrics("frame_latency", self.frame_tracer.get_stats())
+        self.mqtt_client.publish_metrics("bus_traffic", self.traffic_analyzer.get_summary())
+        self.mqtt_client.publish_metrics("unknown_dgns", self.rvc_decoder.get_unknown_dgn_counts())
+        if self.capture_recorder is not None:
+            self.mqtt_client.publish_metrics("capture", self.capture_recorder.get_stats())
+
+    def _get_queue_depths(self) -> dict:
+        """ sizes of the queues feeding the main loop.  Called from the watchdog thread """
+        depths = {"rx": self.rxQueue.qsize(), "mqtt_command": self.mqtt_command_queue.qsize(),
+                  "rvc_tx": self.tx_RVC_Buffer.qsize(), "can_tx": self.txQueue.qsize()}
+        if self.mqtt_client is not None:
+            depths["mqtt_offline"] = self.mqtt_client.get_offline_buffer_count()
+            depths["mqtt_out"] = self.mqtt_client.get_outgoing_count()
+        return depths
 
-        self.Logger.debug(f"Sending Msg: {str(rvc_dict)}")
-        logging.getLogger("rvc_bus_trace").debug(str(rvc_dict))
+    def _report_stall(self, report: dict):
+        """ watchdog thread callback.  Publish the stack of the stalled main loop """
+        if self.mqtt_client is not None:
+            self.mqtt_client.publish_metrics("loop_stall", report)
 
-        # put into canbus watcher
-        self.txQueue.put(rvc_dict)
+    def _on_first_frame(self):
+        """ report startup timing once the first can bus frame is decoded """
+        self.startup_timer.mark("first_frame")
+        self.Logger.info(f"First frame decoded.  Startup {self.startup_timer}")
+        if self.mqtt_client is not None:
+            self.mqtt_client.publish_metrics("startup", self.startup_timer.as_dict())
 
-    def message_rx_loop(self):
-        """Process any RVC received messages"""
-        if self.rxQueue.empty():  # Check if there is a message in queue
-            return
+    def message_mqtt_loop(self) -> bool:
+        """ Run all received mqtt commands.  Returns True if any were run """
+        ran = False
+        while True:
+            try:
+                (func, topic, payload) = self.mqtt_command_queue.get_nowait()
+            except queue.Empty:
+                return ran
+            ran = True
+            try:
+                func(topic, payload)
+            except Exception as e:
+                self.Logger.error(f"Exception processing mqtt message on topic {topic}: {e}")
 
-        message = self.rxQueue.get()
+    def message_tx_loop(self) -> bool:
+        """ hacky - translate RVC formatted dicts from rvc_tx to canbus msg formatted tx.
+        Returns True if any were sent """
+        sent = False
+        while True:
+            try:
+                rvc_dict = self.tx_RVC_Buffer.get_nowait()
+            except queue.Empty:
+                return sent
+            sent = True
+
+            # translate
+            rvc_dict["arbitration_id"] = self.rvc_decoder._rvc_to_can_frame(
+                rvc_dict)
+
+            self.Logger.debug(f"Sending Msg: {str(rvc_dict)}")
+            self.bus_trace_logger.debug(str(rvc_dict))
+
+            # put into canbus watcher
+            self.txQueue.put(rvc_dict)
+            self.ack_tracker.command_sent(rvc_dict)
+
+    def message_rx_loop(self) -> bool:
+        """ Process a batch of received RVC messages.  Stops early if a mqtt
+        command is waiting.  Returns True if any were processed """
+        processed = False
+        for _ in range(app.RX_BATCH_SIZE):
+            if not self.mqtt_command_queue.empty():
+                break
+            try:
+                message = self.rxQueue.get_nowait()
+            except queue.Empty:
+                break
+            processed = True
+            if self.frame_tracer is not None:
+                self.frame_tracer.begin(message.timestamp)
+                handled = self._process_rx_message(message)
+                self.frame_tracer.end()
+            else:
+                handled = self._process_rx_message(message)
+            self.traffic_analyzer.frame_received(message.arbitration_id, len(message.data), handled)
+        return processed
+
+    def _process_rx_message(self, message) -> bool:
+        """ decode a received can message and pass it to the entities.
+        Returns True if the ack tracker or an entity handled it """
+        # The trace loggers need every field.  Otherwise only decode what entities use
+        full = self.bus_trace_logger.isEnabledFor(logging.DEBUG) or self.unhandled_logger.isEnabledFor(logging.DEBUG)
 
         try:
             MsgDict = self.rvc_decoder.rvc_decode(
                 message.arbitration_id,
                 "".join("{0:02X}".format(x) for x in message.data),
+                full
             )
         except Exception as e:
             self.Logger.warning(f"Failed to decode msg. {message}: {e}")
-            return
+            return False
+
+        if self.frame_tracer is not None:
+            self.frame_tracer.decoded(MsgDict.get("name", MsgDict.get("dgn")))
 
         # Log all rvc bus messages to custom logger so it can be routed or ignored
-        logging.getLogger("rvc_bus_trace").debug(str(MsgDict))
+        self.bus_trace_logger.debug(MsgDict)
+
+        if not self.startup_timer.has_mark("first_frame"):
+            self._on_first_frame()
+
+        if self.ack_tracker.process_rvc_msg(MsgDict):
+            return True
 
         # Find if this is a device entity in our list
         # Pass to object
@@ -178,10 +403,11 @@ class app(object):
             if item.process_rvc_msg(MsgDict):
                 # Should we allow processing by more than one obj.
                 ##
-                return
+                return True
 
         # Use a custom logger so it can be routed easily or ignored
-        logging.getLogger("unhandled_rvc").debug(f"Msg {str(MsgDict)}")
+        self.unhandled_logger.debug("Msg %s", MsgDict)
+        return False
 
 
 def configure_logging(verbosity: int, config_file: Optional[os.PathLike]):
@@ -206,6 +432,7 @@ def load_the_config(config_file_path: Optional[os.PathLike]):
     """ if config_file_path is a valid file load a yaml/json config file """
     if os.path.isfile(config_file_path):
         with open(config_file_path, "r") as content:
+            import ruyaml as YAML  # only needed to load config files
             yaml = YAML.YAML(typ='safe')
             return yaml.load(content.read())
 
@@ -242,6 +469,40 @@ def main():
     parser.add_argument("--MQTT_KEY", "--mqtt_key", dest="mqtt_key",
                         help="key for mqtt", default=os.environ.get("MQTT_KEY"))
 
+    parser.add_argument("--ACK_TIMEOUT", "--ack_timeout", dest="ack_timeout",
+                        help="seconds to wait for a device to acknowledge a command", default=os.environ.get("ACK_TIMEOUT", "1.0"))
+    parser.add_argument("--ACK_RETRIES", "--ack_retries", dest="ack_retries",
+                        help="times to resend a command that is not acknowledged.  0 to only log it", default=os.environ.get("ACK_RETRIES", "0"))
+
+    parser.add_argument("--TX_MAX_BUS_SHARE", "--tx_max_bus_share", dest="tx_max_bus_share",
+                        help="fraction of the can bus bandwidth the bridge can use", default=os.environ.get("TX_MAX_BUS_SHARE", "0.3"))
+
+    parser.add_argument("--STATE_SNAPSHOT_FILE", "--state_snapshot_file", dest="state_snapshot_file",
+                        help="file to save device states to so they can be restored at start", default=os.environ.get("STATE_SNAPSHOT_FILE"))
+
+    parser.add_argument("--LOOP_STALL_THRESHOLD", "--loop_stall_threshold", dest="loop_stall_threshold",
+                        help="seconds the main loop can stall before its stack is reported.  0 to disable", default=os.environ.get("LOOP_STALL_THRESHOLD", "2.0"))
+
+    parser.add_argument("--PROFILE_DIR", "--profile_dir", dest="profile_dir",
+                        help="directory for profile session stats files", default=os.environ.get("PROFILE_DIR", "profiles"))
+
+    parser.add_argument("--MEMORY_REPORT_INTERVAL", "--memory_report_interval", dest="memory_report_interval",
+                        help="seconds between memory growth reports.  0 for on demand only", default=os.environ.get("MEMORY_REPORT_INTERVAL", "0"))
+
+    parser.add_argument("--FRAME_LATENCY_TRACING", "--frame_latency_tracing", dest="frame_latency_tracing", action="store_true",
+                        help="measure the latency of each stage of processing received frames", default=os.environ.get("FRAME_LATENCY_TRACING", "").lower() in ("1", "true", "yes"))
+
+    parser.add_argument("--CAPTURE_DIR", "--capture_dir", dest="capture_dir",
+                        help="directory to record raw can bus frames to", default=os.environ.get("CAPTURE_DIR"))
+    parser.add_argument("--CAPTURE_ROTATE_MB", "--capture_rotate_mb", dest="capture_rotate_mb",
+                        help="start a new capture file after this many MB", default=os.environ.get("CAPTURE_ROTATE_MB", "10"))
+    parser.add_argument("--CAPTURE_ROTATE_MINUTES", "--capture_rotate_minutes", dest="capture_rotate_minutes",
+                        help="start a new capture file after this many minutes", default=os.environ.get("CAPTURE_ROTATE_MINUTES", "60"))
+    parser.add_argument("--CAPTURE_KEEP_FILES", "--capture_keep_files", dest="capture_keep_files",
+                        help="number of capture files to keep", default=os.environ.get("CAPTURE_KEEP_FILES", "24"))
+    parser.add_argument("--CAPTURE_COMPRESS", "--capture_compress", dest="capture_compress", action="store_true",
+                        help="gzip the capture files", default=os.environ.get("CAPTURE_COMPRESS", "").lower() in ("1", "true", "yes"))
+
     parser.add_argument("-v", "--verbose", "--VERBOSE", dest="verbose", action="count",
                         help="Increase verbosity of stdout logger. Add multiple times to increase",
                         default=0)
@@ -278,6 +539,7 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     MyApp.main(args)
+    logging.shutdown()
 
 
 if __name__ == "__main__":
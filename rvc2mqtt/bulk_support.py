@@ -0,0 +1,109 @@
+"""
+Bulk command support for rvc2mqtt
+
+A scene changes many entities at once.  Instead of one mqtt message per
+entity a json object mapping entity id to state can be published to the
+bridge bulk topic.  The rvc messages for all entities are queued together
+so they go on the canbus back to back.  When every entity of a RV-C group
+is set to the same state one group command is sent in place of one
+command per entity.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import logging
+import queue
+from rvc2mqtt.mqtt import MQTT_Support
+from rvc2mqtt.entity import publish_optimistic_states
+
+
+class BulkCommandSupport(object):
+    """ Handle json bulk commands like {"light_bedroom": "on", "water_pump": "off"}
+
+    Entities take part by implementing make_rvc_commands.  Entities that also
+    implement get_rvc_group and make_rvc_group_command can be merged into a
+    group command.
+    """
+
+    def __init__(self, mqtt_support: MQTT_Support, entity_list: list, send_queue: queue.Queue):
+        self.Logger = logging.getLogger(__name__)
+        self.mqtt_support = mqtt_support
+        self.send_queue = send_queue
+        self.bulk_command_topic = mqtt_support.root_topic + "/bulk/set"
+
+        self.entities = {}  # id -> entity
+        self.groups = {}    # (class, group bitmask) -> list of entities in the floorplan
+        for entity in entity_list:
+            self.entities[entity.id] = entity
+            group = entity.get_rvc_group()
+            if group != 0:
+                self.groups.setdefault((type(entity), group), []).append(entity)
+
+        self.mqtt_support.register(self.bulk_command_topic, self.process_mqtt_msg)
+
+    def process_mqtt_msg(self, topic, payload):
+        self.Logger.debug(f"MQTT Msg Received on topic {topic} with payload {payload}")
+        try:
+            commands = json.loads(payload)
+        except ValueError:
+            commands = None
+        if not isinstance(commands, dict):
+            self.Logger.warning(f"Invalid payload {payload} for topic {topic}.  Expected a json object")
+            return
+
+        msgs = self.make_rvc_commands(commands)
+        self.Logger.debug(f"Bulk command of {len(commands)} entities sent as {len(msgs)} rvc messages")
+        for msg in msgs:
+            publish_optimistic_states(msg)
+            self.send_queue.put(msg)
+
+    def make_rvc_commands(self, commands: dict) -> list:
+        """ return the rvc messages for a dictionary of entity id -> state.
+        Nothing is published until the messages are sent """
+        requested = {}  # entity -> state
+        for entity_id, state in commands.items():
+            entity = self.entities.get(entity_id)
+            if entity is None:
+                self.Logger.warning(f"Bulk command for unknown entity {entity_id}")
+                continue
+            requested[entity] = str(state)
+
+        msgs = []
+        for (entity_type, group), members in self.groups.items():
+            msg = self._make_group_command(members, requested)
+            if msg is not None:
+                msgs.append(msg)
+                for entity in members:
+                    del requested[entity]
+
+        for entity, state in requested.items():
+            entity_msgs = entity.make_rvc_commands(state)
+            if entity_msgs is None:
+                self.Logger.warning(f"Invalid bulk command state {state} for entity {entity.id}")
+                continue
+            msgs.extend(entity_msgs)
+        return msgs
+
+    def _make_group_command(self, members: list, requested: dict):
+        """ A group command is only safe when every member of the group known to the
+        floorplan is set to the same state.  Otherwise None """
+        if len(members) < 2 or any(m not in requested for m in members):
+            return None
+        states = {requested[m].lower() for m in members}
+        if len(states) != 1:
+            return None
+        return members[0].make_rvc_group_command(requested[members[0]], members)
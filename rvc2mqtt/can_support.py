@@ -24,32 +24,46 @@ limitations under the License.
 """
 
 import threading
-import can
 import logging
 import queue
+import time
+from rvc2mqtt.tx_support import TxScheduler
+from rvc2mqtt.capture_support import CaptureRecorder
 
 class CAN_Watcher(threading.Thread):
-    def __init__(self, interface, rx_queue: queue.Queue, tx_queue: queue.Queue):
+
+    MAX_RECV_WAIT = 0.25  # seconds to wait for a received message when nothing can be sent
+
+    def __init__(self, interface, rx_queue: queue.Queue, tx_queue: TxScheduler, recorder: CaptureRecorder = None):
         threading.Thread.__init__(self)
         # A flag to notify the thread that it should finish up and exit
         self.kill_received = False
         self.Logger = logging.getLogger(__name__)
         self.Logger.info(f"Starting can bus on interface {interface}")
+        # python-can is slow to import.  Only load it when the bus is used
+        import can
         self.bus = can.interface.Bus(channel=interface, bustype="socketcan_native", bitrate=250000)
         self.rx = rx_queue
         self.tx = tx_queue
+        self.recorder = recorder  # optional capture of the raw frames
 
     def run(self):
+        import can
         while not self.kill_received:
-            message = self.bus.recv(.25)  # read messages from a canbus
+            # don't wait longer than until the next message can be sent
+            message = self.bus.recv(self.tx.get_wait_time(CAN_Watcher.MAX_RECV_WAIT))  # read messages from a canbus
             if message is not None:
                 self.rx.put(message)  # Put message into queue
+                if self.recorder is not None:
+                    self.recorder.record(message.timestamp, message.arbitration_id, message.data)
 
-            if not self.tx.empty():   # pending message to send
-                msg_dict = self.tx.get() # pull from queue
+            msg_dict = self.tx.get_next()  # highest priority message if the bus share allows
+            if msg_dict is not None:
                 try:
                     tx_message = can.Message(arbitration_id=msg_dict["arbitration_id"], data=msg_dict["data"], is_extended_id=True)
                     self.bus.send(tx_message, 1)  # send on canbus
+                    if self.recorder is not None:
+                        self.recorder.record(time.time(), tx_message.arbitration_id, tx_message.data, tx=True)
                 except Exception as e:
                     self.Logger.error(f"Exception trying to send {e}")
                     self.Logger.debug(f"Failed Msg: {str(tx_message)}")
@@ -0,0 +1,361 @@
+"""
+Binary can bus capture for rvc2mqtt
+
+Records the raw frames received and sent by the can bus thread so traffic
+can be replayed or decoded later.  The can bus thread only appends a tuple to
+a deque.  A writer thread packs the frames into fixed size binary records and
+writes them in batches.  Files are rotated by size and age, optionally gzip
+compressed, and only the newest keep_files are kept.  It is cheap enough to
+leave on.
+
+File format: the 8 byte FILE_MAGIC then RECORD.size byte records
+    timestamp (double, seconds since epoch), arbitration id (uint32),
+    data length (uint8), flags (uint8, FLAG_TX for sent frames),
+    data (8 bytes zero padded), 2 bytes padding.  Little endian.
+
+When a capture file is closed a json side index is written next to it
+(<capture file>.idx).  It splits the records into time buckets and lists the
+buckets each DGN is in.  CaptureReader memory maps a capture file and uses the
+index to read only the buckets that can match a query by time and DGN.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import datetime
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional
+
+FILE_MAGIC = b"RVCCAP\x00\x01"
+RECORD = struct.Struct("<dIBB8s2x")
+FLAG_TX = 0x01
+FILE_EXTENSION = ".rvccap"
+INDEX_EXTENSION = ".idx"
+INDEX_VERSION = 1
+
+CaptureFrame = collections.namedtuple("CaptureFrame", ["timestamp", "arbitration_id", "data", "tx"])
+
+
+def _dgn_of(arbitration_id: int) -> int:
+    return (arbitration_id >> 8) & 0x1FFFF
+
+
+class CaptureIndex(object):
+    """ Time buckets of a capture file and the buckets each DGN is in.
+
+    A bucket starts at the first record with a timestamp in a later
+    bucket_seconds period than the current bucket.  Records are in the order
+    written so a timestamp a little out of order stays in the current bucket.
+    """
+
+    BUCKET_SECONDS = 60
+
+    def __init__(self, bucket_seconds: float = BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.records = 0
+        self.buckets = []       # [first record, min timestamp, max timestamp]
+        self.dgn_buckets = {}   # dgn (int) -> sorted list of bucket numbers
+        self._bucket_key = None
+
+    def add(self, timestamp: float, arbitration_id: int) -> None:
+        """ add the next record """
+        key = int(timestamp // self.bucket_seconds)
+        if self._bucket_key is None or key > self._bucket_key:
+            self._bucket_key = key
+            self.buckets.append([self.records, timestamp, timestamp])
+        else:
+            bucket = self.buckets[-1]
+            if timestamp < bucket[1]:
+                bucket[1] = timestamp
+            elif timestamp > bucket[2]:
+                bucket[2] = timestamp
+
+        number = len(self.buckets) - 1
+        dgn_list = self.dgn_buckets.get(_dgn_of(arbitration_id))
+        if dgn_list is None:
+            self.dgn_buckets[_dgn_of(arbitration_id)] = [number]
+        elif dgn_list[-1] != number:
+            dgn_list.append(number)
+        self.records += 1
+
+    def find_records(self, start: Optional[float] = None, end: Optional[float] = None,
+                     dgns: Optional[Iterable[int]] = None) -> Iterator[range]:
+        """ ranges of record numbers that can hold frames in the time window [start, end] of the dgns """
+        if dgns is None:
+            numbers = range(len(self.buckets))
+        else:
+            numbers = sorted(set().union(*(self.dgn_buckets.get(d, ()) for d in dgns)))
+        for number in numbers:
+            (first, min_ts, max_ts) = self.buckets[number]
+            if (start is not None and max_ts < start) or (end is not None and min_ts > end):
+                continue
+            last = self.buckets[number + 1][0] if number + 1 < len(self.buckets) else self.records
+            yield range(first, last)
+
+    def as_dict(self) -> dict:
+        return {"version": INDEX_VERSION, "record_size": RECORD.size, "records": self.records,
+                "bucket_seconds": self.bucket_seconds, "buckets": self.buckets,
+                "dgns": {f"{d:05X}": b for d, b in self.dgn_buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "CaptureIndex":
+        if d["version"] != INDEX_VERSION or d["record_size"] != RECORD.size:
+            raise ValueError(f"Unsupported capture index version {d['version']}")
+        index = cls(d["bucket_seconds"])
+        index.records = d["records"]
+        index.buckets = d["buckets"]
+        index.dgn_buckets = {int(k, 16): v for k, v in d["dgns"].items()}
+        if len(index.buckets) > 0:
+            index._bucket_key = int(index.buckets[-1][1] // index.bucket_seconds)
+        return index
+
+    def save(self, path: os.PathLike) -> None:
+        tmp_path = str(path) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.as_dict(), f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+
+class CaptureRecorder(threading.Thread):
+    """ Thread that writes frames given to record() to rotating capture files """
+
+    FLUSH_INTERVAL = 0.5      # seconds between writes
+    MAX_PENDING = 100000      # frames waiting to be written before new frames are dropped
+
+    def __init__(self, directory: os.PathLike, max_bytes: int = 10 * 1024 * 1024,
+                 max_seconds: float = 3600, keep_files: int = 24, compress: bool = False,
+                 clock: Callable[[], float] = time.monotonic):
+        threading.Thread.__init__(self, name="capture_recorder", daemon=True)
+        # A flag to notify the thread that it should finish up and exit
+        self.kill_received = False
+        self.Logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.keep_files = keep_files
+        self.compress = compress
+        self.clock = clock
+        self._pending = collections.deque()
+        self._file = None
+        self._file_path = None
+        self._index = None   # CaptureIndex of the open file.  None if a write failed
+        self._file_bytes = 0
+        self._file_opened = 0.0
+        self._file_index = 0
+        # dropped is only changed by the can bus thread.  The rest by the writer thread
+        self.counters = {"frames": 0, "dropped": 0, "write_failed": 0, "bytes": 0, "files": 0}
+
+    def record(self, timestamp: float, arbitration_id: int, data, tx: bool = False) -> None:
+        """ called from the can bus thread.  Must be cheap """
+        if len(self._pending) >= CaptureRecorder.MAX_PENDING:
+            self.counters["dropped"] += 1
+            return
+        self._pending.append((timestamp, arbitration_id, bytes(data), FLAG_TX if tx else 0))
+
+    def run(self):
+        while not self.kill_received:
+            time.sleep(CaptureRecorder.FLUSH_INTERVAL)
+            self.write_pending()
+        self.write_pending()
+        self._close_file()
+
+    def close(self, timeout: float = 2.0) -> None:
+        """ stop the thread after it writes the pending frames """
+        self.kill_received = True
+        if self.is_alive():
+            self.join(timeout)
+
+    def write_pending(self) -> int:
+        """ write the frames waiting.  Returns the number written """
+        count = len(self._pending)
+        if count == 0:
+            if self._file is not None and self._rotate_due():
+                self._close_file()
+            return 0
+
+        frames = [self._pending.popleft() for _ in range(count)]
+        chunk = bytearray(count * RECORD.size)
+        try:
+            if self._file is None or self._rotate_due():
+                self._open_next_file()
+            for (offset, (timestamp, arbitration_id, data, flags)) in zip(range(0, len(chunk), RECORD.size), frames):
+                RECORD.pack_into(chunk, offset, timestamp, arbitration_id, len(data), flags, data)
+                self._index.add(timestamp, arbitration_id)
+            self._file.write(chunk)
+            if not self.compress:
+                self._file.flush()
+        except OSError as e:
+            self.Logger.error(f"Failed to write can bus capture: {e}")
+            self.counters["write_failed"] += count
+            # the index may not match the file.  Readers rebuild it
+            self._index = None
+            self._close_file()
+            return 0
+        self._file_bytes += len(chunk)
+        self.counters["frames"] += count
+        self.counters["bytes"] += len(chunk)
+        return count
+
+    def get_stats(self) -> dict:
+        stats = dict(self.counters)
+        stats["pending"] = len(self._pending)
+        return stats
+
+    def _rotate_due(self) -> bool:
+        return (self._file_bytes >= self.max_bytes) or (self.clock() - self._file_opened >= self.max_seconds)
+
+    def _open_next_file(self) -> None:
+        self._close_file()
+        os.makedirs(self.directory, exist_ok=True)
+        # index keeps names unique when rotating more than once a second
+        self._file_index += 1
+        name = datetime.datetime.now().strftime("capture-%Y%m%d-%H%M%S") + f"-{self._file_index:04d}" + FILE_EXTENSION
+        path = os.path.join(self.directory, name)
+        if self.compress:
+            import gzip  # only needed when compressing
+            path += ".gz"
+            self._file = gzip.open(path, "wb", compresslevel=1)
+        else:
+            self._file = open(path, "wb")
+        self._file_path = path
+        self._index = CaptureIndex()
+        self._file.write(FILE_MAGIC)
+        self._file_bytes = len(FILE_MAGIC)
+        self._file_opened = self.clock()
+        self.counters["files"] += 1
+        self.Logger.info(f"Capturing can bus to {path}")
+        self._remove_old_files()
+
+    def _close_file(self) -> None:
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+            if self._index is not None:
+                self._index.save(self._file_path + INDEX_EXTENSION)
+        except OSError as e:
+            self.Logger.error(f"Failed to close can bus capture {self._file_path}: {e}")
+        self._file = None
+        self._index = None
+
+    def _remove_old_files(self) -> None:
+        """ remove the oldest capture files and their index """
+        pattern = os.path.join(self.directory, "capture-*" + FILE_EXTENSION)
+        files = sorted(glob.glob(pattern) + glob.glob(pattern + ".gz"))
+        for path in files[:max(len(files) - self.keep_files, 0)]:
+            for p in (path, path + INDEX_EXTENSION):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    self.Logger.warning(f"Failed to remove old can bus capture {p}: {e}")
+
+
+class CaptureReader(object):
+    """ Query and replay a capture file.
+
+    Uncompressed files are memory mapped so only the records read are loaded.
+    Compressed files are read into memory.  The side index is used when it
+    matches the file.  Otherwise (the file is still being written or the
+    bridge was stopped) the index is built by scanning the file once.
+    """
+
+    def __init__(self, path: os.PathLike):
+        self.Logger = logging.getLogger(__name__)
+        self.path = str(path)
+        self._file = None
+        self._mmap = None
+        if self.path.endswith(".gz"):
+            import gzip  # only needed for compressed captures
+            with gzip.open(self.path, "rb") as f:
+                self._data = f.read()
+        else:
+            self._file = open(self.path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._data = self._mmap
+        if self._data[:len(FILE_MAGIC)] != FILE_MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} is not a can bus capture file")
+        self.record_count = (len(self._data) - len(FILE_MAGIC)) // RECORD.size
+        self.index = self._load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.record_count
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._data = b""
+
+    def _load_index(self) -> CaptureIndex:
+        try:
+            with open(self.path + INDEX_EXTENSION, "r") as f:
+                index = CaptureIndex.from_dict(json.load(f))
+            if index.records == self.record_count:
+                return index
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.Logger.warning(f"Ignoring bad capture index for {self.path}: {e}")
+        return self.build_index()
+
+    def build_index(self, bucket_seconds: float = CaptureIndex.BUCKET_SECONDS) -> CaptureIndex:
+        """ make the index by reading every record """
+        index = CaptureIndex(bucket_seconds)
+        for number in range(self.record_count):
+            (timestamp, arbitration_id) = struct.unpack_from("<dI", self._data, len(FILE_MAGIC) + number * RECORD.size)
+            index.add(timestamp, arbitration_id)
+        return index
+
+    def frames(self, start: Optional[float] = None, end: Optional[float] = None,
+               dgns: Optional[Iterable] = None) -> Iterator[CaptureFrame]:
+        """ frames in the time window [start, end] (seconds since epoch) for the dgns
+        (ints or hex strings like 1FFF7) in the order recorded.  None matches all """
+        if dgns is not None:
+            dgns = {int(d, 16) if isinstance(d, str) else d for d in dgns}
+        for records in self.index.find_records(start, end, dgns):
+            for number in records:
+                (timestamp, arbitration_id, length, flags, data) = RECORD.unpack_from(
+                    self._data, len(FILE_MAGIC) + number * RECORD.size)
+                if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                    continue
+                if dgns is not None and _dgn_of(arbitration_id) not in dgns:
+                    continue
+                yield CaptureFrame(timestamp, arbitration_id, data[:length], bool(flags & FLAG_TX))
+
+    def decode(self, decoder, start: Optional[float] = None, end: Optional[float] = None,
+               dgns: Optional[Iterable] = None, full: bool = True) -> Iterator[tuple]:
+        """ replay the matching frames through a RVC_Decoder.  Yields (frame, decoded message) """
+        for frame in self.frames(start, end, dgns):
+            yield (frame, decoder.rvc_decode(frame.arbitration_id, frame.data.hex().upper(), full))
@@ -0,0 +1,108 @@
+"""
+Decoder only command line tool for rvc2mqtt
+
+Decode can frames offline without a can bus or mqtt broker.  Only the RV-C
+spec is loaded.  python-can and paho-mqtt are not imported.
+
+Frames are given as arguments or one per line on stdin using the
+candump/cansend format <arbitration id hex>#<data hex>
+    python -m rvc2mqtt.decode 19FFF780#0100000000000000
+
+Capture files from the bridge can be replayed, optionally only some DGNs or
+a time window (seconds since epoch)
+    python -m rvc2mqtt.decode --capture capture-20220101-120000-0001.rvccap --dgn 1FFF7
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Iterable, TextIO
+from rvc2mqtt.rvc import RVC_Decoder
+from rvc2mqtt.capture_support import CaptureReader
+
+PATH_TO_FOLDER = os.path.abspath(os.path.dirname(__file__))
+
+
+def parse_frame(text: str) -> tuple:
+    """ parse <arbitration id hex>#<data hex> into (arbitration id, data hex string).
+    candump log lines (with timestamp and interface) are accepted too """
+    frame = text.split()[-1]
+    (can_id, data) = frame.split("#", 1)
+    return (int(can_id, 16), data.replace(".", "").upper())
+
+
+def decode_frames(decoder: RVC_Decoder, frames: Iterable[str], output: TextIO) -> int:
+    """ decode each frame and write it as a line of json.  Returns the number that failed """
+    failed = 0
+    for text in frames:
+        if len(text.strip()) == 0:
+            continue
+        try:
+            (can_id, data) = parse_frame(text)
+            msg = decoder.rvc_decode(can_id, data, True)
+            output.write(json.dumps(msg.as_dict(), default=str) + "\n")
+        except Exception as e:
+            failed += 1
+            output.write(json.dumps({"frame": text.strip(), "error": str(e)}) + "\n")
+    return failed
+
+
+def decode_capture(decoder: RVC_Decoder, reader: CaptureReader, output: TextIO, **query) -> int:
+    """ decode the frames of a capture file matching the query (start, end, dgns) and write each
+    as a line of json.  Returns the number that failed """
+    failed = 0
+    for frame in reader.frames(**query):
+        try:
+            msg = decoder.rvc_decode(frame.arbitration_id, frame.data.hex().upper(), True).as_dict()
+        except Exception as e:
+            failed += 1
+            msg = {"arbitration_id": hex(frame.arbitration_id), "data": frame.data.hex().upper(), "error": str(e)}
+        msg["timestamp"] = frame.timestamp
+        msg["tx"] = frame.tx
+        output.write(json.dumps(msg, default=str) + "\n")
+    return failed
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Decode RV-C can frames to json")
+    parser.add_argument("frames", nargs="*", help="frames as <arbitration id hex>#<data hex>.  Read from stdin if none")
+    parser.add_argument("--spec", dest="spec", default=os.path.join(PATH_TO_FOLDER, "rvc-spec.yml"),
+                        help="path to the RV-C spec yaml")
+    parser.add_argument("--capture", dest="captures", action="append", default=[],
+                        help="capture file recorded by the bridge to decode instead of frames")
+    parser.add_argument("--dgn", dest="dgns", action="append", help="only decode this DGN (hex) from captures")
+    parser.add_argument("--start", type=float, help="only decode captured frames at or after this time (seconds since epoch)")
+    parser.add_argument("--end", type=float, help="only decode captured frames at or before this time (seconds since epoch)")
+    args = parser.parse_args(argv)
+
+    decoder = RVC_Decoder()
+    decoder.load_rvc_spec(args.spec)
+    if len(args.captures) > 0:
+        failed = 0
+        for path in args.captures:
+            with CaptureReader(path) as reader:
+                failed += decode_capture(decoder, reader, sys.stdout, start=args.start, end=args.end, dgns=args.dgns)
+        return 1 if failed > 0 else 0
+
+    frames = args.frames if len(args.frames) > 0 else sys.stdin
+    return 1 if decode_frames(decoder, frames, sys.stdout) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,9 +18,24 @@ See the License for the specific language governing permissions and
 limitations under the License.
 
 """
+import contextlib
+import json
 import logging
 import queue
+import threading
+from functools import partial
+from typing import Callable
 from rvc2mqtt.mqtt import MQTT_Support
+from rvc2mqtt.request_support import DgnRequestScheduler
+
+_NOT_FOUND = object()  # sentinel for missing fields in a rvc message
+
+
+def publish_optimistic_states(rvc_msg: dict) -> None:
+    """ publish the optimistic states recorded in rvc_msg with
+    _expect_optimistic_state.  Call when the message is queued for sending """
+    for (entity, states, track_ack) in rvc_msg.pop("optimistic_states", ()):
+        entity._publish_optimistic_state(rvc_msg, states, track_ack)
 
 class EntityPluginBaseClass(object):
     """ Baseclass for all device entities
@@ -29,6 +44,33 @@ class EntityPluginBaseClass(object):
     and define 
 
     """  
+
+    # Fields read from rvc messages for each DGN name this entity processes.
+    # The fields used in match dictionaries must be included.  Header fields
+    # (name, dgn, source_id, etc) are always available.
+    # { "<DGN name>": ("<field>", ...) }  Use None as the value to get every field of a DGN.
+    # If None the entity needs every field of every DGN.
+    RVC_DECODE_FIELDS: dict = None
+
+    # Seconds of quiet required before a coalesced command is sent.  Only the
+    # latest command for each key is sent.  0 sends every command immediately.
+    # Floorplan can override with command_coalesce_window
+    COMMAND_COALESCE_WINDOW: float = 0
+
+    # Publish the commanded state before the device reports it.  The state is
+    # rolled back if the device doesn't report it within OPTIMISTIC_TIMEOUT seconds
+    # or the command is not acknowledged.  Floorplan can override with optimistic
+    OPTIMISTIC_STATE: bool = False
+    OPTIMISTIC_TIMEOUT: float = 3.0
+
+    # Publish all states of the entity as one json document on the status topic
+    # instead of one topic per state.  Floorplan can override with json_state
+    JSON_STATE: bool = False
+
+    # Seconds without a status message before the entity is reported offline on
+    # its availability topic.  0 disables.  Floorplan can override with availability_timeout
+    AVAILABILITY_TIMEOUT: float = 0
+
     def __init__(self, data:dict, mqtt_support: MQTT_Support):
 
         if not hasattr(self, "id"):
@@ -50,6 +92,33 @@ class EntityPluginBaseClass(object):
         if "entity_links" in data:
             self.entity_links.extend(data["entity_links"])
 
+        self.command_coalesce_window: float = float(data.get("command_coalesce_window", self.COMMAND_COALESCE_WINDOW))
+        self.timer_support = None
+        self.dgn_request_scheduler = None
+        self._coalesced_commands = {}  # key -> [deadline, rvc msg, commanded state]
+        # reentrant so a snapshot save on the thread holding it doesn't deadlock
+        self._command_lock = threading.RLock()
+
+        self.optimistic: bool = bool(data.get("optimistic", self.OPTIMISTIC_STATE))
+        self._device_state = {}        # topic -> last state reported by the device
+        self._optimistic_pending = {}  # topic -> [deadline, commanded state]
+
+        self.json_state: bool = bool(data.get("json_state", self.JSON_STATE))
+        self._state_fields = {self.status_topic: "state"}  # state topic -> json field name
+        self._json_state = {}
+        self._json_state_changed = False
+        self._json_state_batch_depth = 0
+
+        # True while showing states restored from a snapshot that the device hasn't confirmed
+        self.stale: bool = False
+        self.stale_topic: str = self._make_state_topic("stale")
+
+        self.availability_timeout: float = float(data.get("availability_timeout", self.AVAILABILITY_TIMEOUT))
+        self.availability_topic: str = mqtt_support.make_device_topic_string(self.id, "availability", True)
+        self._available = None
+        self._availability_deadline = 0.0
+        self._availability_timer_running = False
+
 
     def process_rvc_msg(self, new_message: dict) -> bool:
         """ Process an incoming rvc message and determine if it
@@ -76,6 +145,27 @@ class EntityPluginBaseClass(object):
         will get called with each entity"""
         pass
 
+    def make_rvc_commands(self, payload: str) -> list:
+        """ optional function
+        Return the rvc messages that would set this entity to the state in payload
+        without sending them.  Record optimistic states with _expect_optimistic_state
+        so they are only published if the messages are sent.  Return an empty list if already in that state and
+        None if the payload is not valid (or the entity can't be commanded).
+        Used to send bulk (scene) commands."""
+        return None
+
+    def get_rvc_group(self) -> int:
+        """ optional function
+        Return the RV-C group bitmask of this entity or 0 if it is not in a group"""
+        return 0
+
+    def make_rvc_group_command(self, payload: str, members: list) -> dict:
+        """ optional function
+        Return one rvc message that sets every entity in members (entities of this
+        type with the same group) to the state in payload without sending it.
+        None if not supported"""
+        return None
+
     ########
     # HELPER FUNCTIONS 
     # NOT EXPECTING TO NEED TO BE OVERRIDDEN
@@ -84,18 +174,16 @@ class EntityPluginBaseClass(object):
         '''
         Determine if a RVC message matches the map_entries.  
         All fields in match_entries must match the same fields in rvc_msg.
+        rvc_msg can be a decoded RVC_Message or a dictionary.
 
         ret True if match
         ret False if no match
         
         '''
         for k,v in match_entries.items():
-            if k not in rvc_msg:
-                return False
-            
-            if rvc_msg[k] != v:
+            if rvc_msg.get(k, _NOT_FOUND) != v:
                 return False
-        
+
         return True
 
     def set_rvc_send_queue(self, send_queue: queue):
@@ -103,7 +191,267 @@ class EntityPluginBaseClass(object):
         items be formatted as python-can messages"""
         self.send_queue: queue = send_queue
 
+    def set_timer_support(self, timer_support):
+        """ Provide the shared TimerSupport serviced by the main loop """
+        self.timer_support = timer_support
+        # give the device one timeout to report before it is marked offline
+        self._status_received()
+
+    def _status_received(self):
+        """ Call when a status message from the device is processed.
+        Restarts the availability timeout """
+        if self.availability_timeout <= 0 or self.timer_support is None:
+            return
+        self._availability_deadline = self.timer_support.time() + self.availability_timeout
+        if not self._available:
+            self._available = True
+            self.mqtt_support.publish(self.availability_topic, "online", retain=True)
+        if not self._availability_timer_running:
+            # one timer per entity.  It moves itself to the latest deadline when it runs
+            self._availability_timer_running = True
+            self.timer_support.call_at(self._availability_deadline, self._check_availability)
+
+    def _check_availability(self):
+        """ timer callback.  Mark offline if no status arrived before the deadline """
+        if self._availability_deadline > self.timer_support.time():
+            self.timer_support.call_at(self._availability_deadline, self._check_availability)
+            return
+        self._availability_timer_running = False
+        self._available = False
+        self.Logger.warning(f"No status from {self.id} for {self.availability_timeout} seconds.  Marking offline")
+        self.mqtt_support.publish(self.availability_topic, "offline", retain=True)
+
+    def set_dgn_request_scheduler(self, scheduler: DgnRequestScheduler):
+        """ Provide the shared scheduler for REQUEST_FOR_DGN messages """
+        self.dgn_request_scheduler = scheduler
+
+    def _request_dgn(self, dgn: str, instance: int, is_satisfied: Callable[[], bool] = None):
+        """ Ask devices to report dgn for instance.
+
+        Uses the shared scheduler when available so requests are deduplicated,
+        merged, paced and repeated until is_satisfied returns True.
+        """
+        if self.dgn_request_scheduler is not None:
+            self.dgn_request_scheduler.request(dgn, instance, is_satisfied)
+        else:
+            self.send_queue.put({"dgn": DgnRequestScheduler.REQUEST_DGN,
+                                 "data": DgnRequestScheduler.make_request_data(dgn, instance)})
+
+    def _send_rvc_command(self, rvc_msg: dict, coalesce_key=None, commanded: dict = None):
+        """ Queue a rvc message for sending.
+
+        If coalesce_key is given and coalescing is enabled the message is held
+        until no new message for the same key has arrived for
+        command_coalesce_window seconds.  A newer message replaces the held one.
+        Use one key per command DGN and build the newer message from
+        _get_pending_command_state so changes in the window are not lost.
+
+        commanded: the states (name: value) the message sets.  Saved with the
+        held message for _get_pending_command_state
+        """
+        publish_optimistic_states(rvc_msg)
+        if coalesce_key is None or self.command_coalesce_window <= 0 or self.timer_support is None:
+            self.send_queue.put(rvc_msg)
+            return
+
+        deadline = self.timer_support.time() + self.command_coalesce_window
+        commanded = dict(commanded) if commanded is not None else {}
+        with self._command_lock:
+            pending = self._coalesced_commands.get(coalesce_key)
+            if pending is not None:
+                # timer already scheduled.  It will reschedule itself to the new deadline
+                pending[0] = deadline
+                pending[1] = rvc_msg
+                pending[2] = commanded
+                return
+            self._coalesced_commands[coalesce_key] = [deadline, rvc_msg, commanded]
+        self.timer_support.call_at(deadline, self._send_coalesced_command, coalesce_key)
+
+    def _get_pending_command_state(self, coalesce_key) -> dict:
+        """ return a copy of the commanded states of the message held for
+        coalesce_key.  Empty if no message is held """
+        with self._command_lock:
+            pending = self._coalesced_commands.get(coalesce_key)
+            return dict(pending[2]) if pending is not None else {}
+
+    def _send_coalesced_command(self, coalesce_key):
+        """ timer callback.  Send the held command if its quiet period is over """
+        with self._command_lock:
+            pending = self._coalesced_commands.get(coalesce_key)
+            if pending is None:
+                return
+            if pending[0] > self.timer_support.time():
+                self.timer_support.call_at(pending[0], self._send_coalesced_command, coalesce_key)
+                return
+            del self._coalesced_commands[coalesce_key]
+        self.Logger.debug(f"Sending coalesced command {coalesce_key}")
+        self.send_queue.put(pending[1])
+
+    def _publish_state(self, topic: str, value):
+        """ Publish a state reported by the device.
+
+        While an optimistic state is pending for the topic a different value
+        is held back as the device may not have acted yet.  It is published
+        if the optimistic state times out.
+        """
+        with self._command_lock:
+            self._device_state[topic] = value
+            pending = self._optimistic_pending.get(topic)
+            if pending is not None:
+                if pending[1] != value:
+                    return
+                del self._optimistic_pending[topic]
+        with self._json_state_batch():
+            self._publish_field(topic, value)
+            if self.stale:
+                self._set_stale(False)
+
+    def _expect_optimistic_state(self, rvc_msg: dict, states: dict, track_ack: bool = True):
+        """ record the states (topic: value) the command in rvc_msg should cause.
+        In optimistic mode they are published when the message is sent with
+        _send_rvc_command (or publish_optimistic_states) not when it is made.
+        track_ack: roll back if the command is not acknowledged.  False for
+        group commands which are not acknowledged per entity """
+        rvc_msg.setdefault("optimistic_states", []).append((self, states, track_ack))
+
+    def _publish_optimistic_state(self, rvc_msg: dict, states: dict, track_ack: bool = True):
+        """ In optimistic mode publish the states (topic: value) expected from the
+        command in rvc_msg now.  Call when the command is sent. """
+        if not self.optimistic or self.timer_support is None:
+            return
+
+        deadline = self.timer_support.time() + self.OPTIMISTIC_TIMEOUT
+        if track_ack:
+            rvc_msg["ack_callback"] = partial(self._on_command_ack, states)
+        for topic, value in states.items():
+            with self._command_lock:
+                timer_running = topic in self._optimistic_pending
+                self._optimistic_pending[topic] = [deadline, value]
+            self._publish_field(topic, value)
+            if not timer_running:
+                self.timer_support.call_at(deadline, self._optimistic_state_timeout, topic)
+        self._flush_json_state()
+
+    def _optimistic_state_timeout(self, topic: str):
+        """ timer callback.  Roll back if the device hasn't confirmed the state """
+        with self._command_lock:
+            pending = self._optimistic_pending.get(topic)
+            if pending is None:
+                return
+            if pending[0] > self.timer_support.time():
+                self.timer_support.call_at(pending[0], self._optimistic_state_timeout, topic)
+                return
+        self._rollback_optimistic_state(topic, pending[1])
+
+    def _on_command_ack(self, states: dict, acked: bool):
+        """ called by the ack tracker.  Roll back if the command failed """
+        if not acked:
+            for topic, value in states.items():
+                self._rollback_optimistic_state(topic, value)
+
+    def _rollback_optimistic_state(self, topic: str, value):
+        with self._command_lock:
+            pending = self._optimistic_pending.get(topic)
+            if pending is None or pending[1] != value:
+                return
+            del self._optimistic_pending[topic]
+            actual = self._device_state.get(topic)
+        self.Logger.info(f"Device did not confirm {value} for {topic}.  Rolling back to {actual}")
+        if actual is not None:
+            self._publish_field(topic, actual)
+            self._flush_json_state()
+
+    def get_snapshot(self) -> dict:
+        """ return the states (topic: value) reported by the device.  Saved to
+        the state snapshot so they can be restored at the next start """
+        with self._command_lock:
+            return {t: v for t, v in self._device_state.items() if v != "unknown"}
+
+    def restore_snapshot(self, states: dict) -> int:
+        """ publish states (topic: value) saved in a snapshot.  They are marked
+        stale until the device reports a state.  Returns the number restored """
+        topic_root = self.status_topic.rsplit("/", 1)[0] + "/"
+        restored = 0
+        for topic, value in states.items():
+            if not topic.startswith(topic_root) or topic == self.stale_topic:
+                continue
+            with self._command_lock:
+                if self._device_state.get(topic, "unknown") != "unknown":
+                    continue  # device already reported it
+            self._publish_field(topic, value)
+            restored += 1
+        if restored > 0:
+            self._set_stale(True)
+        self._flush_json_state()
+        return restored
+
+    def _set_stale(self, stale: bool):
+        self.stale = stale
+        self._publish_field(self.stale_topic, "true" if stale else "false")
+        self._flush_json_state()
+
+    def _make_state_topic(self, field: str) -> str:
+        """ make a status topic for a state of this entity.  In json state
+        mode field is the name of the state in the json document """
+        topic = self.mqtt_support.make_device_topic_string(self.id, field, True)
+        self._state_fields[topic] = field
+        return topic
+
+    def _publish_field(self, topic: str, value):
+        """ publish one state.  In json state mode it is added to the json
+        document which is published by _flush_json_state """
+        field = self._state_fields.get(topic)
+        if self.json_state and field is not None:
+            if self._json_state.get(field, _NOT_FOUND) != value:
+                self._json_state[field] = value
+                self._json_state_changed = True
+            return
+        if isinstance(value, dict):
+            value = json.dumps(value)
+        self.mqtt_support.publish(topic, value, retain=True)
+
+    def _flush_json_state(self):
+        """ In json state mode publish the json document if a state changed.
+        Waits for the end of a _json_state_batch """
+        if self.json_state and self._json_state_changed and self._json_state_batch_depth == 0:
+            self._json_state_changed = False
+            self.mqtt_support.publish(self.status_topic, json.dumps(self._json_state), retain=True)
+
+    @contextlib.contextmanager
+    def _json_state_batch(self):
+        """ In json state mode publish the json document once for all the
+        states published in the block instead of once per state """
+        self._json_state_batch_depth += 1
+        try:
+            yield
+        finally:
+            self._json_state_batch_depth -= 1
+            self._flush_json_state()
+
+    def _get_state_discovery_info_for_ha(self, topic: str, key: str = "state") -> dict:
+        """ return the HA discovery fields to read the state published on topic.
+        key is the HA field prefix.  state gives state_topic/value_template.
+        Others (like mode_state for climate) give <key>_topic/<key>_template """
+        template_key = "value_template" if key == "state" else key + "_template"
+        field = self._state_fields.get(topic)
+        if self.json_state and field is not None:
+            return {key + "_topic": self.status_topic, template_key: "{{ value_json." + field + " }}"}
+        return {key + "_topic": topic}
+
+    def _get_attributes_discovery_info_for_ha(self, topic: str) -> dict:
+        """ return the HA discovery fields to read json attributes published on topic """
+        field = self._state_fields.get(topic)
+        if self.json_state and field is not None:
+            return {"json_attributes_topic": self.status_topic,
+                    "json_attributes_template": "{{ value_json." + field + " | tojson }}"}
+        return {"json_attributes_topic": topic}
+
     def get_availability_discovery_info_for_ha(self) -> dict:
         """ return the availability fields in dict format"""
+        if self.availability_timeout > 0:
+            # available only while the bridge is online and the device is reporting
+            return {"availability": [{"topic": self.mqtt_support.bridge_state_topic},
+                                     {"topic": self.availability_topic}],
+                    "availability_mode": "all"}
         return { "availability_topic": self.mqtt_support.bridge_state_topic }
 
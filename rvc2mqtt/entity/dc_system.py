@@ -19,7 +19,6 @@ limitations under the License.
 
 """
 
-import queue
 import logging
 import json
 from rvc2mqtt.mqtt import MQTT_Support
@@ -28,6 +27,7 @@ from rvc2mqtt.entity import EntityPluginBaseClass
 
 class DcSystemSensor_DC_SOURCE_STATUS_1(EntityPluginBaseClass):
     FACTORY_MATCH_ATTRIBUTES = {"type": "dc_system", "name": "DC_SOURCE_STATUS_1"}
+    RVC_DECODE_FIELDS = {"DC_SOURCE_STATUS_1": ("instance", "dc_voltage")}
 
     """ Provide basic DC system information using DC_SOURCE_STATUS_1 
 
@@ -84,6 +84,7 @@ class DcSystemSensor_DC_SOURCE_STATUS_1(EntityPluginBaseClass):
 
         if self._is_entry_match(self.rvc_match_status, new_message):
             self.Logger.debug(f"Msg Match Status: {str(new_message)}")
+            self._status_received()
             self.dc_voltage = new_message["dc_voltage"]
             self._update_mqtt_topics_with_changed_values()
             return True
@@ -91,8 +92,7 @@ class DcSystemSensor_DC_SOURCE_STATUS_1(EntityPluginBaseClass):
 
     def _update_mqtt_topics_with_changed_values(self):
         if self._changed:            
-            self.mqtt_support.client.publish(
-                self.status_topic, self.dc_voltage, retain=True)
+            self._publish_state(self.status_topic, self.dc_voltage)
             self._changed = False
 
 
@@ -114,6 +114,7 @@ class DcSystemSensor_DC_SOURCE_STATUS_1(EntityPluginBaseClass):
                   "value_template": '{{value}}',
                   "unique_id": self.unique_device_id,
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -122,5 +123,5 @@ class DcSystemSensor_DC_SOURCE_STATUS_1(EntityPluginBaseClass):
             self.unique_device_id, "sensor")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
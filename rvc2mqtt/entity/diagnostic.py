@@ -20,16 +20,15 @@ limitations under the License.
 
 """
 
-import queue
 import logging
 import json
-import copy
 from rvc2mqtt.mqtt import MQTT_Support
 from rvc2mqtt.entity import EntityPluginBaseClass
 
 
 class Diagnostic(EntityPluginBaseClass):
     FACTORY_MATCH_ATTRIBUTES = {"type": "diagnostic", "name": "DM_RV"}
+    RVC_DECODE_FIELDS = {"DM_RV": None}  # full message is published as attributes
     ON = "True"
     OFF = "False"
 
@@ -64,18 +63,12 @@ class Diagnostic(EntityPluginBaseClass):
         self.Logger.debug(f"Must match: {str(self.rvc_match_status)}")
 
         # make additional topics
-        self.warning_status_topic = mqtt_support.make_device_topic_string(
-            self.id, "warning", True)
-        self.warning_attributes_topic = mqtt_support.make_device_topic_string(
-            self.id, "warning_attributes", True)
-        self.warning_msg_topic = mqtt_support.make_device_topic_string(
-            self.id, "warning_message", True)
-        self.fault_status_topic = mqtt_support.make_device_topic_string(
-            self.id, "fault", True)
-        self.fault_attributes_topic = mqtt_support.make_device_topic_string(
-            self.id, "fault_attributes", True)
-        self.fault_msg_topic = mqtt_support.make_device_topic_string(
-            self.id, "fault_message", True)
+        self.warning_status_topic = self._make_state_topic("warning")
+        self.warning_attributes_topic = self._make_state_topic("warning_attributes")
+        self.warning_msg_topic = self._make_state_topic("warning_message")
+        self.fault_status_topic = self._make_state_topic("fault")
+        self.fault_attributes_topic = self._make_state_topic("fault_attributes")
+        self.fault_msg_topic = self._make_state_topic("fault_message")
         
 
         # init members of the class
@@ -139,14 +132,15 @@ class Diagnostic(EntityPluginBaseClass):
         """
         if self._is_entry_match(self.rvc_match_status, new_message):
             self.Logger.debug(f"Msg Match Status: {str(new_message)}")
+            self._status_received()
 
             self.fault = new_message["red_lamp_status"] != '00'
             self.fault_msg = f"Failure Mode Identifier: {new_message['fmi']} - {new_message['fmi_definition']}" 
-            self.fault_attributes = new_message
+            self.fault_attributes = dict(new_message)
 
             self.warning = new_message["yellow_lamp_status"] != '00'
             self.warning_msg = f"Failure Mode Identifier: {new_message['fmi']} - {new_message['fmi_definition']}" 
-            self.warning_attributes = new_message
+            self.warning_attributes = dict(new_message)
             
             self.state = new_message["operating_status_definition"]
 
@@ -157,27 +151,21 @@ class Diagnostic(EntityPluginBaseClass):
 
     def _update_mqtt_topics_with_changed_values(self):
         if self._changed:            
-            self.mqtt_support.client.publish(
-                self.status_topic, self.state, retain=True)
+            with self._json_state_batch():
+                self._publish_state(self.status_topic, self.state)
 
-            self.mqtt_support.client.publish(
-                self.warning_status_topic, self.warning, retain=True)
+                self._publish_state(self.warning_status_topic, self.warning)
 
-            self.mqtt_support.client.publish(
-                self.warning_msg_topic, self.warning_msg, retain=True)
+                self._publish_state(self.warning_msg_topic, self.warning_msg)
 
-            self.mqtt_support.client.publish(
-                self.warning_attributes_topic, json.dumps(self.warning_attributes), retain=True)
+                self._publish_state(self.warning_attributes_topic, self.warning_attributes)
 
-            self.mqtt_support.client.publish(
-                self.fault_status_topic, self.fault, retain=True)
+                self._publish_state(self.fault_status_topic, self.fault)
 
-            self.mqtt_support.client.publish(
-                self.fault_msg_topic, self.fault_msg, retain=True)
+                self._publish_state(self.fault_msg_topic, self.fault_msg)
+
+                self._publish_state(self.fault_attributes_topic, self.fault_attributes)
 
-            self.mqtt_support.client.publish(
-                self.fault_attributes_topic, json.dumps(self.fault_attributes), retain=True)
-            
             self._changed = False
 
 
@@ -196,10 +184,11 @@ class Diagnostic(EntityPluginBaseClass):
                   "qos": 1, "retain": False,
                   "unique_id": self.unique_device_id + "_power_state",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_topic))
         config.update(self.get_availability_discovery_info_for_ha())
         config_json = json.dumps(config)
         ha_config_topic = self.mqtt_support.make_ha_auto_discovery_config_topic(self.unique_device_id, "sensor", "power_state")
-        self.mqtt_support.client.publish(ha_config_topic, config_json, retain=True)
+        self.mqtt_support.publish(ha_config_topic, config_json, retain=True)
 
         # produce the HA MQTT discovery config json for binary sensor fault
         config = {"name": self.name + " fault state",
@@ -210,10 +199,12 @@ class Diagnostic(EntityPluginBaseClass):
                   "json_attributes_topic": self.fault_attributes_topic,
                   "unique_id": self.unique_device_id + "_fault_state",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.fault_status_topic))
+        config.update(self._get_attributes_discovery_info_for_ha(self.fault_attributes_topic))
         config.update(self.get_availability_discovery_info_for_ha())
         config_json = json.dumps(config)
         ha_config_topic = self.mqtt_support.make_ha_auto_discovery_config_topic(self.unique_device_id, "binary_sensor", "fault_state")
-        self.mqtt_support.client.publish(ha_config_topic, config_json, retain=True)
+        self.mqtt_support.publish(ha_config_topic, config_json, retain=True)
 
         # produce the HA MQTT discovery config json for text sensor fault msg
         config = {"name": self.name + " fault message",
@@ -221,10 +212,11 @@ class Diagnostic(EntityPluginBaseClass):
                   "qos": 1, "retain": False,
                   "unique_id": self.unique_device_id + "_fault_message",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.fault_msg_topic))
         config.update(self.get_availability_discovery_info_for_ha())
         config_json = json.dumps(config)
         ha_config_topic = self.mqtt_support.make_ha_auto_discovery_config_topic(self.unique_device_id, "sensor", "fault_message")
-        self.mqtt_support.client.publish(ha_config_topic, config_json, retain=True)
+        self.mqtt_support.publish(ha_config_topic, config_json, retain=True)
 
         # produce the HA MQTT discovery config json for binary sensor warning
         config = {"name": self.name + " warning state",
@@ -235,10 +227,12 @@ class Diagnostic(EntityPluginBaseClass):
                   "json_attributes_topic": self.warning_attributes_topic,
                   "unique_id": self.unique_device_id + "_warning_state",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.warning_status_topic))
+        config.update(self._get_attributes_discovery_info_for_ha(self.warning_attributes_topic))
         config.update(self.get_availability_discovery_info_for_ha())
         config_json = json.dumps(config)
         ha_config_topic = self.mqtt_support.make_ha_auto_discovery_config_topic(self.unique_device_id, "binary_sensor", "warning_state")
-        self.mqtt_support.client.publish(ha_config_topic, config_json, retain=True)
+        self.mqtt_support.publish(ha_config_topic, config_json, retain=True)
 
         # produce the HA MQTT discovery config json for text sensor warning msg
         config = {"name": self.name + " warning message",
@@ -246,7 +240,8 @@ class Diagnostic(EntityPluginBaseClass):
                   "qos": 1, "retain": False,
                   "unique_id": self.unique_device_id + "_warning_message",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.warning_msg_topic))
         config.update(self.get_availability_discovery_info_for_ha())
         config_json = json.dumps(config)
         ha_config_topic = self.mqtt_support.make_ha_auto_discovery_config_topic(self.unique_device_id, "sensor", "warning_message")
-        self.mqtt_support.client.publish(ha_config_topic, config_json, retain=True)
\ No newline at end of file
+        self.mqtt_support.publish(ha_config_topic, config_json, retain=True)
\ No newline at end of file
@@ -20,7 +20,6 @@ limitations under the License.
 """
 
 
-import queue
 import logging
 import struct
 import json
@@ -162,6 +161,9 @@ class HvacClass(EntityPluginBaseClass):
     ''' 
 
     FACTORY_MATCH_ATTRIBUTES = {"name": "THERMOSTAT_STATUS_1", "type": "hvac"}
+    RVC_DECODE_FIELDS = {"THERMOSTAT_STATUS_1": ("instance", "fan_speed", "fan_mode_definition", "operating_mode_definition",
+                                                 "setpoint_temp_cool", "setpoint_temp_heat"),
+                         "THERMOSTAT_COMMAND_1": ("instance",)}
 
     # HA MQTT HVAC supported modes - must be a subset of default
     MQTT_SUPPORTED_MODES = [e.value for e in HvacMode]
@@ -176,6 +178,9 @@ class HvacClass(EntityPluginBaseClass):
     # convert rvc friendly name to rvc value
     RVC_SCHEDULE_MODE_TO_RVC_SCHEDULE_MODE_VALUE = {"disabled": 0, "enabled": 1}
 
+    # sliders in HA send many set point updates.  Only send the last one.
+    COMMAND_COALESCE_WINDOW = 0.5
+
 
     def __init__(self, data: dict, mqtt_support: MQTT_Support):
         self.id = f"thermostat-i" + str(data["instance"])
@@ -210,17 +215,17 @@ class HvacClass(EntityPluginBaseClass):
                        }
 
         # Allow MQTT to control mode
-        self.status_mode_topic = mqtt_support.make_device_topic_string(self.id, "mode", True)
+        self.status_mode_topic = self._make_state_topic("mode")
         self.command_mode_topic = mqtt_support.make_device_topic_string(self.id, "mode", False)
         self.mqtt_support.register(self.command_mode_topic, self.process_mqtt_msg)
 
         # Allow MQTT to control fan mode
-        self.status_fan_mode_topic = mqtt_support.make_device_topic_string(self.id, "fan_mode", True)
+        self.status_fan_mode_topic = self._make_state_topic("fan_mode")
         self.command_fan_mode_topic = mqtt_support.make_device_topic_string(self.id, "fan_mode", False)
         self.mqtt_support.register(self.command_fan_mode_topic, self.process_mqtt_msg)
 
         # Allow MQTT to control the target temperature
-        self.status_set_point_temp_topic = mqtt_support.make_device_topic_string(self.id, "set_point_temperature", True)
+        self.status_set_point_temp_topic = self._make_state_topic("set_point_temperature")
         self.command_set_point_temp_topic = mqtt_support.make_device_topic_string(self.id, "set_point_temperature", False)
         self.mqtt_support.register(self.command_set_point_temp_topic, self.process_mqtt_msg)
 
@@ -290,6 +295,7 @@ class HvacClass(EntityPluginBaseClass):
 
         if self._is_entry_match(self.rvc_match_status, new_message):
             self.Logger.debug(f"Msg Match Status: {str(new_message)}")
+            self._status_received()
 
             self.fan_mode = FanMode.get_fan_mode_from_rvc(int(new_message["fan_speed"]), new_message["fan_mode_definition"] )
             # use cool because for this implementation we will update cool and heat to the same value
@@ -309,12 +315,11 @@ class HvacClass(EntityPluginBaseClass):
 
         if self._changed: 
 
-            self.mqtt_support.client.publish(
-                self.status_mode_topic, self.mode.value, retain=True
-            )
+            with self._json_state_batch():
+                self._publish_state(self.status_mode_topic, self.mode.value)
 
-            self.mqtt_support.client.publish(self.status_fan_mode_topic, self.fan_mode.value, retain=True)
-            self.mqtt_support.client.publish(self.status_set_point_temp_topic, self.set_point_temperature, retain=True)
+                self._publish_state(self.status_fan_mode_topic, self.fan_mode.value)
+                self._publish_state(self.status_set_point_temp_topic, self.set_point_temperature)
             self._changed = False
         return False
 
@@ -348,6 +353,20 @@ class HvacClass(EntityPluginBaseClass):
         return msg_bytes
         
 
+    def _send_thermostat_command(self, **changes):
+        ''' send THERMOSTAT_COMMAND_1 with changes (mode, fan_mode and/or set_point_temperature).
+        Values not changed are kept from the command waiting to be sent or else
+        from the state the thermostat reported '''
+        key = ("1FEF9", self.rvc_instance)
+        commanded = self._get_pending_command_state(key)
+        commanded.update(changes)
+        pl = self._make_rvc_payload(self.rvc_instance,
+                                    commanded.get("mode", self.mode),
+                                    commanded.get("fan_mode", self.fan_mode),
+                                    self.scheduled_mode,
+                                    commanded.get("set_point_temperature", self.set_point_temperature))
+        self._send_rvc_command({"dgn": "1FEF9", "data": pl}, key, commanded)
+
     def process_mqtt_msg(self, topic, payload):
         """ Read mqtt incoming command message
 
@@ -360,25 +379,19 @@ class HvacClass(EntityPluginBaseClass):
 
         if topic == self.command_mode_topic:
             try:
-                mode = HvacMode(payload.lower())
-                pl = self._make_rvc_payload(self.rvc_instance, mode, self.fan_mode, self.scheduled_mode, self.set_point_temperature)
-                self.send_queue.put({"dgn": "1FEF9", "data": pl})
+                self._send_thermostat_command(mode=HvacMode(payload.lower()))
             except Exception as e:
                 self.Logger.error(f"Exception trying to respond to topic {topic} + {str(e)}")
 
         elif topic == self.command_fan_mode_topic:
             try: 
-                fan_mode = FanMode(payload)
-                pl = self._make_rvc_payload(self.rvc_instance, self.mode, fan_mode, self.scheduled_mode, self.set_point_temperature)
-                self.send_queue.put({"dgn": "1FEF9", "data": pl})
+                self._send_thermostat_command(fan_mode=FanMode(payload))
             except Exception as e:
                 self.Logger.error(f"Exception trying to respond to topic {topic} + {str(e)}")
 
         elif topic == self.command_set_point_temp_topic:
             try: 
-                temp = float(payload)
-                pl = self._make_rvc_payload(self.rvc_instance, self.mode, self.fan_mode, self.scheduled_mode, temp)
-                self.send_queue.put({"dgn": "1FEF9", "data": pl})
+                self._send_thermostat_command(set_point_temperature=float(payload))
             except Exception as e:
                 self.Logger.error(f"Exception trying to respond to topic {topic} + {str(e)}")
                
@@ -421,9 +434,13 @@ class HvacClass(EntityPluginBaseClass):
                   "device": self.device}
 
         if self.temperature_entity_link is not None:
-            config["current_temperature_topic"] = self.temperature_entity_link.status_topic
             config["current_temperature_template"] = '{{value}}'
+            link = self.temperature_entity_link
+            config.update(link._get_state_discovery_info_for_ha(link.status_topic, "current_temperature"))
 
+        config.update(self._get_state_discovery_info_for_ha(self.status_mode_topic, "mode_state"))
+        config.update(self._get_state_discovery_info_for_ha(self.status_fan_mode_topic, "fan_mode_state"))
+        config.update(self._get_state_discovery_info_for_ha(self.status_set_point_temp_topic, "temperature_state"))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -432,7 +449,7 @@ class HvacClass(EntityPluginBaseClass):
             self.unique_device_id, "climate")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
 
 
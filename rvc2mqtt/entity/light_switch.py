@@ -19,7 +19,6 @@ limitations under the License.
 """
 
 
-import queue
 import logging
 import struct
 import json
@@ -29,6 +28,7 @@ from rvc2mqtt.entity import EntityPluginBaseClass
 
 class LightSwitch_DC_LOAD_STATUS(EntityPluginBaseClass):
     FACTORY_MATCH_ATTRIBUTES = {"name": "DC_LOAD_STATUS", "type": "light_switch"}
+    RVC_DECODE_FIELDS = {"DC_LOAD_STATUS": ("instance", "operating_status"), "DC_LOAD_COMMAND": ("instance",)}
     """
     Light switch that is tied to RVC DGN of DC_LOAD_STATUS and DC_LOAD_COMMAND
     Supports ON/OFF 
@@ -39,6 +39,7 @@ class LightSwitch_DC_LOAD_STATUS(EntityPluginBaseClass):
     """
     LIGHT_ON = "on"
     LIGHT_OFF = "off"
+    ALL_INSTANCES = 0xFF  # instance for a command to every load in the group
 
     def __init__(self, data: dict, mqtt_support: MQTT_Support):
         self.id = "light-1FFBD-i" + str(data["instance"])
@@ -81,6 +82,7 @@ class LightSwitch_DC_LOAD_STATUS(EntityPluginBaseClass):
 
         if self._is_entry_match(self.rvc_match_status, new_message):
             self.Logger.debug(f"Msg Match Status: {str(new_message)}")
+            self._status_received()
             if new_message["operating_status"] == 100.0:
                 self.state = LightSwitch_DC_LOAD_STATUS.LIGHT_ON
             elif new_message["operating_status"] == 0.0:
@@ -91,8 +93,7 @@ class LightSwitch_DC_LOAD_STATUS(EntityPluginBaseClass):
                 self.Logger.error(
                     f"Unexpected RVC value {str(new_message['operating_status'])}")
 
-            self.mqtt_support.client.publish(
-                self.status_topic, self.state, retain=True)
+            self._publish_state(self.status_topic, self.state)
             return True
 
         elif self._is_entry_match(self.rvc_match_command, new_message):
@@ -107,30 +108,59 @@ class LightSwitch_DC_LOAD_STATUS(EntityPluginBaseClass):
             f"MQTT Msg Received on topic {topic} with payload {payload}")
 
         if topic == self.command_topic:
-            if payload.lower() == LightSwitch_DC_LOAD_STATUS.LIGHT_OFF:
-                if self.state != LightSwitch_DC_LOAD_STATUS.LIGHT_OFF:
-                    self._rvc_light_off()
-            elif payload.lower() == LightSwitch_DC_LOAD_STATUS.LIGHT_ON:
-                if self.state != LightSwitch_DC_LOAD_STATUS.LIGHT_ON:
-                    self._rvc_light_on()
-            else:
+            msgs = self.make_rvc_commands(payload)
+            if msgs is None:
                 self.Logger.warning(
                     f"Invalid payload {payload} for topic {topic}")
-
-    def _rvc_light_off(self):
+                return
+            for msg in msgs:
+                self._send_rvc_command(msg)
+
+    def make_rvc_commands(self, payload: str) -> list:
+        """ rvc messages to turn the light on or off """
+        if payload.lower() == LightSwitch_DC_LOAD_STATUS.LIGHT_OFF:
+            if self.state != LightSwitch_DC_LOAD_STATUS.LIGHT_OFF:
+                return [self._rvc_light_off()]
+        elif payload.lower() == LightSwitch_DC_LOAD_STATUS.LIGHT_ON:
+            if self.state != LightSwitch_DC_LOAD_STATUS.LIGHT_ON:
+                return [self._rvc_light_on()]
+        else:
+            return None
+        return []
+
+    def get_rvc_group(self) -> int:
+        return int(self.rvc_group, 2)
+
+    def make_rvc_group_command(self, payload: str, members: list) -> dict:
+        """ one rvc message to turn every light in the group on or off """
+        if payload.lower() == LightSwitch_DC_LOAD_STATUS.LIGHT_OFF:
+            msg = self._make_rvc_command(LightSwitch_DC_LOAD_STATUS.ALL_INSTANCES, 3)
+        elif payload.lower() == LightSwitch_DC_LOAD_STATUS.LIGHT_ON:
+            msg = self._make_rvc_command(LightSwitch_DC_LOAD_STATUS.ALL_INSTANCES, 1)
+        else:
+            return None
+        # a group command isn't acknowledged per light.  Optimistic state times out instead
+        for light in members:
+            light._expect_optimistic_state(msg, {light.status_topic: payload.lower()}, track_ack=False)
+        return msg
+
+    def _make_rvc_command(self, instance: int, command: int) -> dict:
         # 01 00 FA 00 03 FF 0000
         msg_bytes = bytearray(8)
-        struct.pack_into("<BBBBBBH", msg_bytes, 0, self.rvc_instance, int(
-            self.rvc_group, 2), 250, 0, 3, 0xFF, 0)
-        self.send_queue.put({"dgn": "1FFBC", "data": msg_bytes})
+        struct.pack_into("<BBBBBBH", msg_bytes, 0, instance, int(
+            self.rvc_group, 2), 250, 0, command, 0xFF, 0)
+        return {"dgn": "1FFBC", "data": msg_bytes}
 
-    def _rvc_light_on(self):
+    def _rvc_light_off(self) -> dict:
+        msg = self._make_rvc_command(self.rvc_instance, 3)
+        self._expect_optimistic_state(msg, {self.status_topic: LightSwitch_DC_LOAD_STATUS.LIGHT_OFF})
+        return msg
 
+    def _rvc_light_on(self) -> dict:
         # 01 00 FA 00 01 FF 0000
-        msg_bytes = bytearray(8)
-        struct.pack_into("<BBBBBBH", msg_bytes, 0, self.rvc_instance, int(
-            self.rvc_group, 2), 250, 0, 1, 0xFF, 0)
-        self.send_queue.put({"dgn": "1FFBC", "data": msg_bytes})
+        msg = self._make_rvc_command(self.rvc_instance, 1)
+        self._expect_optimistic_state(msg, {self.status_topic: LightSwitch_DC_LOAD_STATUS.LIGHT_ON})
+        return msg
 
     def initialize(self):
         """ Optional function 
@@ -152,6 +182,7 @@ class LightSwitch_DC_LOAD_STATUS(EntityPluginBaseClass):
                   "unique_id": self.unique_device_id,
                   "device": self.device}
 
+        config.update(self._get_state_discovery_info_for_ha(self.status_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -160,14 +191,10 @@ class LightSwitch_DC_LOAD_STATUS(EntityPluginBaseClass):
             self.unique_device_id, "switch")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_topic, self.state, retain=True)
+        self._publish_state(self.status_topic, self.state)
 
         # request dgn report - this should trigger that light to report
         # dgn = 1FFBD which is actually  BD FF 01 <instance> FF 00 00 00
-        self.Logger.debug("Sending Request for DGN")
-        data = struct.pack("<BBBBBBBB", int("0xBD", 0), int(
-            "0xFF", 0), 1, self.rvc_instance, 0, 0, 0, 0)
-        self.send_queue.put({"dgn": "EAFF", "data": data})
+        self._request_dgn("1FFBD", self.rvc_instance, lambda: self.state != "unknown")
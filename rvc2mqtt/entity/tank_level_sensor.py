@@ -18,15 +18,14 @@ limitations under the License.
 
 """
 
-import queue
 import logging
 import json
-import struct
 from rvc2mqtt.mqtt import MQTT_Support
 from rvc2mqtt.entity import EntityPluginBaseClass
 
 class TankLevelSensor_TANK_STATUS(EntityPluginBaseClass):
     FACTORY_MATCH_ATTRIBUTES = {"type": "tank_level", "name": "TANK_STATUS"}
+    RVC_DECODE_FIELDS = {"TANK_STATUS": ("instance", "relative_level", "resolution")}
 
     """ Provide basic tank level values using DGN TANK_STATUS
 
@@ -68,6 +67,7 @@ class TankLevelSensor_TANK_STATUS(EntityPluginBaseClass):
 
         if self._is_entry_match(self.rvc_match_status, new_message):
             self.Logger.debug(f"Msg Match Status: {str(new_message)}")
+            self._status_received()
 
             if(self.waiting_for_first_msg):
                 # because we don't have all info until first message we need to wait
@@ -83,8 +83,7 @@ class TankLevelSensor_TANK_STATUS(EntityPluginBaseClass):
             new_level = round(new_level)  # round it..partial precentage isn't important here
             if new_level != self.level:
                 self.level = new_level
-                self.mqtt_support.client.publish(
-                    self.status_topic, self.level, retain=True)
+                self._publish_state(self.status_topic, self.level)
             return True
         return False
 
@@ -98,10 +97,7 @@ class TankLevelSensor_TANK_STATUS(EntityPluginBaseClass):
         """
         # request dgn report - this should trigger the tanks to report
         # dgn = 1FFB7 which is actually  BD FF 01 <instance> 00 00 00 00
-        self.Logger.debug("Sending Request for DGN")
-        data = struct.pack("<BBBBBBBB", int("0xB7", 0), int(
-            "0xFF", 0), 1, self.instance, 0, 0, 0, 0)
-        self.send_queue.put({"dgn": "EAFF", "data": data})
+        self._request_dgn("1FFB7", self.instance, lambda: not self.waiting_for_first_msg)
 
     
     def _send_ha_mqtt_discovery_info(self):
@@ -115,6 +111,7 @@ class TankLevelSensor_TANK_STATUS(EntityPluginBaseClass):
                   "value_template": '{{value}}',
                   "unique_id": self.unique_device_id,
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -123,7 +120,7 @@ class TankLevelSensor_TANK_STATUS(EntityPluginBaseClass):
             self.unique_device_id, "sensor")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
 
     def _get_instance_name(self, instance: int) -> str:
@@ -19,7 +19,6 @@ limitations under the License.
 """
 
 
-import queue
 import logging
 import struct
 import json
@@ -32,6 +31,7 @@ class TankWarmer_DC_LOAD_STATUS(EntityPluginBaseClass):
     # This is basically a light but with different icons
     #
     FACTORY_MATCH_ATTRIBUTES = {"name": "DC_LOAD_STATUS", "type": "tank_warmer"}
+    RVC_DECODE_FIELDS = {"DC_LOAD_STATUS": ("instance", "operating_status"), "DC_LOAD_COMMAND": ("instance",)}
     ON = "on"
     OFF = "off"
 
@@ -92,6 +92,7 @@ class TankWarmer_DC_LOAD_STATUS(EntityPluginBaseClass):
 
         if self._is_entry_match(self.rvc_match_status, new_message):
             self.Logger.debug(f"Msg Match Status: {str(new_message)}")
+            self._status_received()
             if new_message["operating_status"] == 100.0:
                 self.state = TankWarmer_DC_LOAD_STATUS.ON
             elif new_message["operating_status"] == 0.0:
@@ -102,8 +103,7 @@ class TankWarmer_DC_LOAD_STATUS(EntityPluginBaseClass):
                 self.Logger.error(
                     f"Unexpected RVC value {str(new_message['operating_status'])}")
 
-            self.mqtt_support.client.publish(
-                self.status_topic, self.state, retain=True)
+            self._publish_state(self.status_topic, self.state)
 
             return True
         elif self._is_entry_match(self.rvc_match_command, new_message):
@@ -135,28 +135,42 @@ class TankWarmer_DC_LOAD_STATUS(EntityPluginBaseClass):
             f"MQTT Msg Received on topic {topic} with payload {payload}")
 
         if topic == self.command_topic:
-            if payload.lower() == TankWarmer_DC_LOAD_STATUS.OFF:
-                if self.state != TankWarmer_DC_LOAD_STATUS.OFF:
-                    self._rvc_off()
-            elif payload.lower() == TankWarmer_DC_LOAD_STATUS.ON:
-                if self.state != TankWarmer_DC_LOAD_STATUS.ON:
-                    self._rvc_on()
-            else:
+            msgs = self.make_rvc_commands(payload)
+            if msgs is None:
                 self.Logger.warning(
                     f"Invalid payload {payload} for topic {topic}")
-
-    def _rvc_off(self):
+                return
+            for msg in msgs:
+                self._send_rvc_command(msg)
+
+    def make_rvc_commands(self, payload: str) -> list:
+        """ rvc messages to turn the tank warmer on or off """
+        if payload.lower() == TankWarmer_DC_LOAD_STATUS.OFF:
+            if self.state != TankWarmer_DC_LOAD_STATUS.OFF:
+                return [self._rvc_off()]
+        elif payload.lower() == TankWarmer_DC_LOAD_STATUS.ON:
+            if self.state != TankWarmer_DC_LOAD_STATUS.ON:
+                return [self._rvc_on()]
+        else:
+            return None
+        return []
+
+    def _rvc_off(self) -> dict:
         # 01 00 FA 00 03 FF 0000
         msg_bytes = bytearray(8)
         struct.pack_into("<BBBBBBH", msg_bytes, 0, self.rvc_instance, 0, 250, 0, 3, 0xFF, 0)
-        self.send_queue.put({"dgn": "1FFBC", "data": msg_bytes})
+        msg = {"dgn": "1FFBC", "data": msg_bytes}
+        self._expect_optimistic_state(msg, {self.status_topic: TankWarmer_DC_LOAD_STATUS.OFF})
+        return msg
 
-    def _rvc_on(self):
+    def _rvc_on(self) -> dict:
 
         # 01 00 FA 00 01 FF 0000
         msg_bytes = bytearray(8)
         struct.pack_into("<BBBBBBH", msg_bytes, 0, self.rvc_instance, 0, 250, 0, 1, 0xFF, 0)
-        self.send_queue.put({"dgn": "1FFBC", "data": msg_bytes})
+        msg = {"dgn": "1FFBC", "data": msg_bytes}
+        self._expect_optimistic_state(msg, {self.status_topic: TankWarmer_DC_LOAD_STATUS.ON})
+        return msg
 
     def initialize(self):
         """ Optional function 
@@ -177,6 +191,7 @@ class TankWarmer_DC_LOAD_STATUS(EntityPluginBaseClass):
                   "payload_off": TankWarmer_DC_LOAD_STATUS.OFF,
                   "unique_id": self.unique_device_id,
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -185,14 +200,10 @@ class TankWarmer_DC_LOAD_STATUS(EntityPluginBaseClass):
             self.unique_device_id, "switch")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_topic, self.state, retain=True)
+        self._publish_state(self.status_topic, self.state)
 
         # request dgn report - this should trigger that light to report
         # dgn = 1FFBD which is actually  BD FF 01 <instance> FF 00 00 00
-        self.Logger.debug("Sending Request for DGN")
-        data = struct.pack("<BBBBBBBB", int("0xBD", 0), int(
-            "0xFF", 0), 1, self.rvc_instance, 0, 0, 0, 0)
-        self.send_queue.put({"dgn": "EAFF", "data": data})
+        self._request_dgn("1FFBD", self.rvc_instance, lambda: self.state != "unknown")
@@ -18,7 +18,6 @@ limitations under the License.
 
 """
 
-import queue
 import logging
 import json
 from rvc2mqtt.mqtt import MQTT_Support
@@ -27,6 +26,7 @@ from rvc2mqtt.entity import EntityPluginBaseClass
 
 class TemperatureSensor_THERMOSTAT_AMBIENT_STATUS(EntityPluginBaseClass):
     FACTORY_MATCH_ATTRIBUTES = {"type": "temperature", "name": "THERMOSTAT_AMBIENT_STATUS"}
+    RVC_DECODE_FIELDS = {"THERMOSTAT_AMBIENT_STATUS": ("instance", "ambient_temp")}
 
     """ Provide basic temperature values using THERMOSTAT_AMBIENT_STATUS 
 
@@ -61,11 +61,11 @@ class TemperatureSensor_THERMOSTAT_AMBIENT_STATUS(EntityPluginBaseClass):
 
         if self._is_entry_match(self.rvc_match_status, new_message):
             self.Logger.debug(f"Msg Match Status: {str(new_message)}")
+            self._status_received()
             # These events happen a lot.  Lets filter down to when temp changes
             if new_message["ambient_temp"] != self.reported_temp:
                 self.reported_temp = new_message["ambient_temp"]
-                self.mqtt_support.client.publish(
-                    self.status_topic, self.reported_temp, retain=True)
+                self._publish_state(self.status_topic, self.reported_temp)
             return True
         return False
 
@@ -87,6 +87,7 @@ class TemperatureSensor_THERMOSTAT_AMBIENT_STATUS(EntityPluginBaseClass):
                   "value_template": '{{value}}',
                   "unique_id": self.unique_device_id,
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -95,5 +96,5 @@ class TemperatureSensor_THERMOSTAT_AMBIENT_STATUS(EntityPluginBaseClass):
             self.unique_device_id, "sensor")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
@@ -24,7 +24,6 @@ limitations under the License.
 """
 
 
-import queue
 import logging
 import struct
 import json
@@ -72,6 +71,18 @@ class WaterHeaterClass(EntityPluginBaseClass):
     
     '''
     FACTORY_MATCH_ATTRIBUTES = {"name": "WATERHEATER_STATUS", "type": "waterheater"}
+    RVC_DECODE_FIELDS = {"WATERHEATER_STATUS": ("instance", "operating_modes", "set_point_temperature", "water_temperature",
+                                                "thermostat_status", "burner_status", "ac_element_status",
+                                                "high_temperature_limit_switch_status", "failure_to_ignite_status",
+                                                "ac_power_failure_status", "dc_power_failure_status",
+                                                "dc_power_warning_status"),
+                         "WATERHEATER_COMMAND": ("instance",),
+                         "WATERHEATER_COMMAND2": ("instance",)}
+
+    # gas and ac switches share one mode command.  Only send the last one
+    # with the changes from both.
+    COMMAND_COALESCE_WINDOW = 0.5
+
     ON = "on"
     OFF = "off"
 
@@ -113,39 +124,39 @@ class WaterHeaterClass(EntityPluginBaseClass):
                        }
 
         # Allow MQTT to control gas - on off
-        self.status_gas_topic = mqtt_support.make_device_topic_string(self.id, "gas", True)
+        self.status_gas_topic = self._make_state_topic("gas")
         self.command_gas_topic = mqtt_support.make_device_topic_string(self.id, "gas", False)
         self.mqtt_support.register(self.command_gas_topic, self.process_mqtt_msg)
 
         # Allow MQTT to control ac electric - on off
-        self.status_ac_topic = mqtt_support.make_device_topic_string(self.id, "ac", True)
+        self.status_ac_topic = self._make_state_topic("ac")
         self.command_ac_topic = mqtt_support.make_device_topic_string(self.id, "ac", False)
         self.mqtt_support.register(self.command_ac_topic, self.process_mqtt_msg)
 
         # Allow MQTT to control set point temperature
-        self.status_set_point_temp_topic = mqtt_support.make_device_topic_string(self.id, "set_point_temperature", True)
+        self.status_set_point_temp_topic = self._make_state_topic("set_point_temperature")
         self.command_set_point_temp_topic = mqtt_support.make_device_topic_string(self.id, "set_point_temperature", False)
         self.mqtt_support.register(self.command_set_point_temp_topic, self.process_mqtt_msg)
 
         # water temp
-        self.status_water_temp_topic = mqtt_support.make_device_topic_string(self.id, "water_temperature", True)
+        self.status_water_temp_topic = self._make_state_topic("water_temperature")
 
         # thermostat 
-        self.status_thermostat_topic = mqtt_support.make_device_topic_string(self.id, "thermostat", True)
+        self.status_thermostat_topic = self._make_state_topic("thermostat")
 
         # Gas Burner status
-        self.status_gas_burner_topic = mqtt_support.make_device_topic_string(self.id, "gas_burner", True)
+        self.status_gas_burner_topic = self._make_state_topic("gas_burner")
 
         # AC/Electric element status
-        self.status_ac_element_topic = mqtt_support.make_device_topic_string(self.id, "ac_element", True)
+        self.status_ac_element_topic = self._make_state_topic("ac_element")
 
         # High temp switch status
-        self.status_high_temp_topic = mqtt_support.make_device_topic_string(self.id, "high_temp", True)
+        self.status_high_temp_topic = self._make_state_topic("high_temp")
 
-        self.status_failure_gas_topic = mqtt_support.make_device_topic_string(self.id, "failure_gas", True)
-        self.status_failure_ac_topic = mqtt_support.make_device_topic_string(self.id, "failure_ac", True)
-        self.status_failure_dc_topic = mqtt_support.make_device_topic_string(self.id, "failure_dc", True)
-        self.status_failure_low_dc_topic = mqtt_support.make_device_topic_string(self.id, "failure_low_dc", True)
+        self.status_failure_gas_topic = self._make_state_topic("failure_gas")
+        self.status_failure_ac_topic = self._make_state_topic("failure_ac")
+        self.status_failure_dc_topic = self._make_state_topic("failure_dc")
+        self.status_failure_low_dc_topic = self._make_state_topic("failure_low_dc")
 
 
 
@@ -175,103 +186,105 @@ class WaterHeaterClass(EntityPluginBaseClass):
 
         if self._is_entry_match(self.rvc_match_status, new_message):
             self.Logger.debug(f"Msg Match Status: {str(new_message)}")
-
-            # Op Mode State
-            self.mode = new_message["operating_modes"]
-            self.gas_mode = WaterHeaterClass.OFF
-            self.ac_mode = WaterHeaterClass.OFF 
-            if new_message["operating_modes"] in [1, 3, 4, 5]:
-                self.gas_mode = WaterHeaterClass.ON
-            if new_message["operating_modes"] in [2, 3, 4, 6]:
-                self.ac_mode = WaterHeaterClass.ON
+            self._status_received()
+
+            with self._json_state_batch():
+                # Op Mode State
+                self.mode = new_message["operating_modes"]
+                self.gas_mode = WaterHeaterClass.OFF
+                self.ac_mode = WaterHeaterClass.OFF 
+                if new_message["operating_modes"] in [1, 3, 4, 5]:
+                    self.gas_mode = WaterHeaterClass.ON
+                if new_message["operating_modes"] in [2, 3, 4, 6]:
+                    self.ac_mode = WaterHeaterClass.ON
             
-            if new_message["operating_modes"] > 7:
-                self.Logger.error(
-                    f"Unexpected RVC Mode Value {str(self.mode)}")
-
-            self.mqtt_support.client.publish(self.status_topic, self.mode, retain=True)
-            self.mqtt_support.client.publish(self.status_gas_topic, self.gas_mode, retain=True)
-            self.mqtt_support.client.publish(self.status_ac_topic, self.ac_mode, retain=True)
-
-            # Set Point Temperature
-            self.set_point_temperature = new_message["set_point_temperature"]
-            self.mqtt_support.client.publish(self.status_set_point_temp_topic, self.set_point_temperature, retain=True)
-
-            # water temperature
-            self.water_temperature = new_message["water_temperature"]
-            self.mqtt_support.client.publish(self.status_water_temp_topic, self.water_temperature, retain=True)
-
-            # Thermostat
-            if new_message["thermostat_status"] == '00':
-                self.thermostat_status = WaterHeaterClass.OFF
-            elif new_message["thermostat_status"] == '01':
-                self.thermostat_status = WaterHeaterClass.ON
-            else:
-                self.Logger.error(f"Unexpected RVC thermostat status value {new_message['thermostat_status']}")
-            self.mqtt_support.client.publish(self.status_thermostat_topic, self.thermostat_status, retain=True)
-
-            # Gas Burner
-            if new_message["burner_status"] == '00':
-                self.burner_status = WaterHeaterClass.OFF
-            elif new_message["burner_status"] == '01':
-                self.burner_status = WaterHeaterClass.ON
-            else:
-                self.Logger.error(f"Unexpected RVC burner status value {new_message['burner_status']}")
-            self.mqtt_support.client.publish(self.status_gas_burner_topic, self.burner_status, retain=True)
-
-            # AC Element
-            if new_message["ac_element_status"] == '00':
-                self.ac_element_status = WaterHeaterClass.OFF
-            elif new_message["ac_element_status"] == '01':
-                self.ac_element_status = WaterHeaterClass.ON
-            else:
-                self.Logger.error(f"Unexpected RVC ac element status value {new_message['ac_element_status']}")
-            self.mqtt_support.client.publish(self.status_ac_element_topic, self.ac_element_status, retain=True)
-
-            # High Temp Limit Tripped
-            if new_message["high_temperature_limit_switch_status"] == '00':
-                self.high_temp_switch_status = WaterHeaterClass.OFF
-            elif new_message["high_temperature_limit_switch_status"] == '01':
-                self.high_temp_switch_status = WaterHeaterClass.ON
-            else:
-                self.Logger.error(f"Unexpected RVC high temp limit switch status value {new_message['high_temperature_limit_switch_status']}")
-            self.mqtt_support.client.publish(self.status_high_temp_topic, self.high_temp_switch_status, retain=True)
-
-            # Failure To Ignite (gas)
-            if new_message["failure_to_ignite_status"] == '00':
-                self.failure_to_ignite = WaterHeaterClass.OFF
-            elif new_message["failure_to_ignite_status"] == '01':
-                self.failure_to_ignite = WaterHeaterClass.ON
-            else:
-                self.Logger.error(f"Unexpected RVC failure to ignite status value {new_message['failure_to_ignite_status']}")
-            self.mqtt_support.client.publish(self.status_failure_gas_topic, self.failure_to_ignite, retain=True)
-
-            # Failure AC element
-            if new_message["ac_power_failure_status"] == '00':
-                self.failure_ac_power = WaterHeaterClass.OFF
-            elif new_message["ac_power_failure_status"] == '01':
-                self.failure_ac_power = WaterHeaterClass.ON
-            else:
-                self.Logger.error(f"Unexpected RVC ac power failure status value {new_message['ac_power_failure_status']}")
-            self.mqtt_support.client.publish(self.status_failure_ac_topic, self.failure_ac_power, retain=True)
-
-            # Failure DC Power
-            if new_message["dc_power_failure_status"] == '00':
-                self.failure_dc_power = WaterHeaterClass.OFF
-            elif new_message["dc_power_failure_status"] == '01':
-                self.failure_dc_power = WaterHeaterClass.ON
-            else:
-                self.Logger.error(f"Unexpected RVC dc power failure status value {new_message['dc_power_failure_status']}")
-            self.mqtt_support.client.publish(self.status_failure_dc_topic, self.failure_dc_power, retain=True)
-
-            # Failure Warning DC Power (power low)
-            if new_message["dc_power_warning_status"] == '00':
-                self.failure_dc_warning = WaterHeaterClass.OFF
-            elif new_message["dc_power_warning_status"] == '01':
-                self.failure_dc_warning = WaterHeaterClass.ON
-            else:
-                self.Logger.error(f"Unexpected RVC dc power warning failure status value {new_message['dc_power_warning_status']}")
-            self.mqtt_support.client.publish(self.status_failure_low_dc_topic, self.failure_dc_warning, retain=True)
+                if new_message["operating_modes"] > 7:
+                    self.Logger.error(
+                        f"Unexpected RVC Mode Value {str(self.mode)}")
+
+                self._publish_state(self.status_topic, self.mode)
+                self._publish_state(self.status_gas_topic, self.gas_mode)
+                self._publish_state(self.status_ac_topic, self.ac_mode)
+
+                # Set Point Temperature
+                self.set_point_temperature = new_message["set_point_temperature"]
+                self._publish_state(self.status_set_point_temp_topic, self.set_point_temperature)
+
+                # water temperature
+                self.water_temperature = new_message["water_temperature"]
+                self._publish_state(self.status_water_temp_topic, self.water_temperature)
+
+                # Thermostat
+                if new_message["thermostat_status"] == '00':
+                    self.thermostat_status = WaterHeaterClass.OFF
+                elif new_message["thermostat_status"] == '01':
+                    self.thermostat_status = WaterHeaterClass.ON
+                else:
+                    self.Logger.error(f"Unexpected RVC thermostat status value {new_message['thermostat_status']}")
+                self._publish_state(self.status_thermostat_topic, self.thermostat_status)
+
+                # Gas Burner
+                if new_message["burner_status"] == '00':
+                    self.burner_status = WaterHeaterClass.OFF
+                elif new_message["burner_status"] == '01':
+                    self.burner_status = WaterHeaterClass.ON
+                else:
+                    self.Logger.error(f"Unexpected RVC burner status value {new_message['burner_status']}")
+                self._publish_state(self.status_gas_burner_topic, self.burner_status)
+
+                # AC Element
+                if new_message["ac_element_status"] == '00':
+                    self.ac_element_status = WaterHeaterClass.OFF
+                elif new_message["ac_element_status"] == '01':
+                    self.ac_element_status = WaterHeaterClass.ON
+                else:
+                    self.Logger.error(f"Unexpected RVC ac element status value {new_message['ac_element_status']}")
+                self._publish_state(self.status_ac_element_topic, self.ac_element_status)
+
+                # High Temp Limit Tripped
+                if new_message["high_temperature_limit_switch_status"] == '00':
+                    self.high_temp_switch_status = WaterHeaterClass.OFF
+                elif new_message["high_temperature_limit_switch_status"] == '01':
+                    self.high_temp_switch_status = WaterHeaterClass.ON
+                else:
+                    self.Logger.error(f"Unexpected RVC high temp limit switch status value {new_message['high_temperature_limit_switch_status']}")
+                self._publish_state(self.status_high_temp_topic, self.high_temp_switch_status)
+
+                # Failure To Ignite (gas)
+                if new_message["failure_to_ignite_status"] == '00':
+                    self.failure_to_ignite = WaterHeaterClass.OFF
+                elif new_message["failure_to_ignite_status"] == '01':
+                    self.failure_to_ignite = WaterHeaterClass.ON
+                else:
+                    self.Logger.error(f"Unexpected RVC failure to ignite status value {new_message['failure_to_ignite_status']}")
+                self._publish_state(self.status_failure_gas_topic, self.failure_to_ignite)
+
+                # Failure AC element
+                if new_message["ac_power_failure_status"] == '00':
+                    self.failure_ac_power = WaterHeaterClass.OFF
+                elif new_message["ac_power_failure_status"] == '01':
+                    self.failure_ac_power = WaterHeaterClass.ON
+                else:
+                    self.Logger.error(f"Unexpected RVC ac power failure status value {new_message['ac_power_failure_status']}")
+                self._publish_state(self.status_failure_ac_topic, self.failure_ac_power)
+
+                # Failure DC Power
+                if new_message["dc_power_failure_status"] == '00':
+                    self.failure_dc_power = WaterHeaterClass.OFF
+                elif new_message["dc_power_failure_status"] == '01':
+                    self.failure_dc_power = WaterHeaterClass.ON
+                else:
+                    self.Logger.error(f"Unexpected RVC dc power failure status value {new_message['dc_power_failure_status']}")
+                self._publish_state(self.status_failure_dc_topic, self.failure_dc_power)
+
+                # Failure Warning DC Power (power low)
+                if new_message["dc_power_warning_status"] == '00':
+                    self.failure_dc_warning = WaterHeaterClass.OFF
+                elif new_message["dc_power_warning_status"] == '01':
+                    self.failure_dc_warning = WaterHeaterClass.ON
+                else:
+                    self.Logger.error(f"Unexpected RVC dc power warning failure status value {new_message['dc_power_warning_status']}")
+                self._publish_state(self.status_failure_low_dc_topic, self.failure_dc_warning)
 
             return True
 
@@ -300,22 +313,18 @@ class WaterHeaterClass(EntityPluginBaseClass):
 
         if topic == self.command_ac_topic:
             if payload.lower() == WaterHeaterClass.OFF:
-                if self.ac_mode != WaterHeaterClass.OFF:
-                    self._rvc_change_mode(self.gas_mode == WaterHeaterClass.ON, False)
+                self._rvc_change_mode(ac_on=False)
             elif payload.lower() == WaterHeaterClass.ON:
-                if self.ac_mode != WaterHeaterClass.ON:
-                    self._rvc_change_mode(self.gas_mode == WaterHeaterClass.ON, True)      
+                self._rvc_change_mode(ac_on=True)
             else:
                 self.Logger.error(
                     f"Invalid payload {payload} for topic {topic}")
 
         elif topic == self.command_gas_topic:
             if payload.lower() == WaterHeaterClass.OFF:
-                if self.gas_mode != WaterHeaterClass.OFF:
-                    self._rvc_change_mode(False, self.ac_mode == WaterHeaterClass.ON)
+                self._rvc_change_mode(gas_on=False)
             elif payload.lower() == WaterHeaterClass.ON:
-                if self.gas_mode != WaterHeaterClass.ON:
-                    self._rvc_change_mode(True, self.ac_mode == WaterHeaterClass.ON)     
+                self._rvc_change_mode(gas_on=True)
             else:
                 self.Logger.error(
                     f"Invalid payload {payload} for topic {topic}")
@@ -327,8 +336,20 @@ class WaterHeaterClass(EntityPluginBaseClass):
             except Exception as e:
                 self.Logger.error(f"Invalid payload {payload} for topic {topic}")
 
-    def _rvc_change_mode(self, gas_on: bool, ac_on: bool):
-        ''' change the mode of the water heater.  This can be off/electic on/gas on/both on'''
+    def _rvc_change_mode(self, **changes):
+        ''' change the mode of the water heater.  This can be off/electic on/gas on/both on
+
+        changes: gas_on and/or ac_on.  The other is kept from the mode command
+        waiting to be sent or else from the state the device reported '''
+        key = ("1FFF6", self.instance)
+        commanded = self._get_pending_command_state(key)
+        held = len(commanded) > 0
+        commanded.update(changes)
+        gas_on = commanded.get("gas_on", self.gas_mode == WaterHeaterClass.ON)
+        ac_on = commanded.get("ac_on", self.ac_mode == WaterHeaterClass.ON)
+        if not held and gas_on == (self.gas_mode == WaterHeaterClass.ON) and ac_on == (self.ac_mode == WaterHeaterClass.ON):
+            return  # already in this mode
+
         mode = 0
 
         if gas_on:
@@ -358,7 +379,10 @@ class WaterHeaterClass(EntityPluginBaseClass):
         # 0100000000000000
         msg_bytes = bytearray(8)
         struct.pack_into("<BBHBBBB", msg_bytes, 0, self.instance, mode, 0, 0, 0, 0, 0)
-        self.send_queue.put({"dgn": "1FFF6", "data": msg_bytes})
+        msg = {"dgn": "1FFF6", "data": msg_bytes}
+        self._expect_optimistic_state(msg, {self.status_gas_topic: WaterHeaterClass.ON if gas_on else WaterHeaterClass.OFF,
+                                             self.status_ac_topic: WaterHeaterClass.ON if ac_on else WaterHeaterClass.OFF})
+        self._send_rvc_command(msg, key, {"gas_on": gas_on, "ac_on": ac_on})
 
     def _rvc_change_set_point(self, temp: float):
         self.Logger.debug(f"Set hotwater set point to {temp}")
@@ -373,6 +397,12 @@ class WaterHeaterClass(EntityPluginBaseClass):
         This can be a good place to request data
 
         """
+        # in json state mode publish the state document once after all the discovery configs
+        with self._json_state_batch():
+            self._publish_ha_discovery()
+
+    def _publish_ha_discovery(self):
+        """ publish the HA discovery configs and the current states """
 
         # Gas switch - produce the HA MQTT discovery config json for
         config = {"name": self.name + " Gas",
@@ -383,6 +413,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "payload_off": WaterHeaterClass.OFF,
                   "unique_id": self.unique_device_id + "_gas_mode",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_gas_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -391,10 +422,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "switch", "gas_mode")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_gas_topic, self.gas_mode, retain=True)
+        self._publish_state(self.status_gas_topic, self.gas_mode)
 
         # AC element switch - produce the HA MQTT discovery config json for
         config = {"name": self.name + " AC", "state_topic": self.status_ac_topic,
@@ -402,6 +432,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "payload_on": WaterHeaterClass.ON, "payload_off": WaterHeaterClass.OFF,
                   "unique_id": self.unique_device_id + "_electric_mode",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_ac_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -410,10 +441,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "switch", "electric_mode")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_ac_topic, self.ac_mode, retain=True)
+        self._publish_state(self.status_ac_topic, self.ac_mode)
 
         # Set Point Temp input - produce the HA MQTT discovery config json for
         config = {"name": self.name + " Set Point Temperature", "state_topic": self.status_set_point_temp_topic,
@@ -425,6 +455,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "value_template": '{{value}}',
                   "unique_id": self.unique_device_id + "_set_point_temperature",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_set_point_temp_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -433,10 +464,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "number", "set_point_temperature")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_set_point_temp_topic, self.set_point_temperature, retain=True)
+        self._publish_state(self.status_set_point_temp_topic, self.set_point_temperature)
 
 
         # Water Temperature sensor  - produce the HA MQTT discovery config json for
@@ -449,6 +479,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "value_template": '{{value}}',
                   "unique_id": self.unique_device_id + "_water_temperature",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_water_temp_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -457,10 +488,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "sensor", "water_temperature")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_water_temp_topic, self.water_temperature, retain=True)
+        self._publish_state(self.status_water_temp_topic, self.water_temperature)
 
 
         # thermostat status binary sensor  - produce the HA MQTT discovery config json for
@@ -470,6 +500,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "unique_id": self.unique_device_id + "_thermostat",
                   "enabled_by_default": False,  # this implementation doesn't expect this sensor to be used
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_thermostat_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -478,10 +509,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "binary_sensor", "thermostat")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_thermostat_topic, self.thermostat_status, retain=True)
+        self._publish_state(self.status_thermostat_topic, self.thermostat_status)
 
 
         # Gas Burner Status binary sensor  - produce the HA MQTT discovery config json for
@@ -492,6 +522,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "enabled_by_default": False,  # this implementation doesn't expect this sensor to be used
                   "unique_id": self.unique_device_id + "_gas_burner_status",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_gas_burner_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -500,10 +531,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "binary_sensor", "gas_burner_status")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_gas_burner_topic, self.burner_status, retain=True)
+        self._publish_state(self.status_gas_burner_topic, self.burner_status)
 
         # AC Element Status binary sensor  - produce the HA MQTT discovery config json for
         config = {"name": self.name + " AC Element" , "state_topic": self.status_ac_element_topic,
@@ -513,6 +543,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "enabled_by_default": False,  # this implementation doesn't expect this sensor to be used
                   "unique_id": self.unique_device_id + "_ac_element_status",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_ac_element_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -521,10 +552,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "binary_sensor", "ac_element_status")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_ac_element_topic, self.ac_element_status, retain=True)
+        self._publish_state(self.status_ac_element_topic, self.ac_element_status)
 
         # High temp limit switch Status binary sensor  - produce the HA MQTT discovery config json for
         config = {"name": self.name + " High-Temp Limit" , "state_topic": self.status_high_temp_topic,
@@ -534,6 +564,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "enabled_by_default": False,  # this implementation doesn't expect this sensor to be used
                   "unique_id": self.unique_device_id + "_high_temp_limit_switch_status",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_high_temp_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -542,10 +573,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "binary_sensor", "high_temp_limit_switch_status")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_high_temp_topic, self.high_temp_switch_status, retain=True)
+        self._publish_state(self.status_high_temp_topic, self.high_temp_switch_status)
 
         # Failure to ignite Status binary sensor  - produce the HA MQTT discovery config json for
         config = {"name": self.name + " Gas Igniter Failure" , "state_topic": self.status_failure_gas_topic,
@@ -554,6 +584,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "payload_off": WaterHeaterClass.OFF,
                   "unique_id": self.unique_device_id + "_failure_to_ignite_status",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_failure_gas_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -562,10 +593,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "binary_sensor", "failure_to_ignite_status")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_failure_gas_topic, self.failure_to_ignite, retain=True)
+        self._publish_state(self.status_failure_gas_topic, self.failure_to_ignite)
 
         # Failure AC Power Status binary sensor  - produce the HA MQTT discovery config json for
         config = {"name": self.name + " AC Power Failure" , "state_topic": self.status_failure_ac_topic,
@@ -574,6 +604,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "payload_off": WaterHeaterClass.OFF,
                   "unique_id": self.unique_device_id + "_failure_ac_power_status",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_failure_ac_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -582,10 +613,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "binary_sensor", "failure_ac_power_status")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_failure_ac_topic, self.failure_ac_power, retain=True)
+        self._publish_state(self.status_failure_ac_topic, self.failure_ac_power)
 
         # Failure DC Power Status binary sensor  - produce the HA MQTT discovery config json for
         config = {"name": self.name + " DC Power Failure" , "state_topic": self.status_failure_dc_topic,
@@ -594,6 +624,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "payload_off": WaterHeaterClass.OFF,
                   "unique_id": self.unique_device_id + "_failure_dc_power_status",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_failure_dc_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -602,10 +633,9 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "binary_sensor", "failure_dc_power_status")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_failure_dc_topic, self.failure_dc_power, retain=True)
+        self._publish_state(self.status_failure_dc_topic, self.failure_dc_power)
 
         # Failure DC Power warning Status binary sensor  - produce the HA MQTT discovery config json for
         config = {"name": self.name + " DC Low Power Warning" , "state_topic": self.status_failure_low_dc_topic,
@@ -614,6 +644,7 @@ class WaterHeaterClass(EntityPluginBaseClass):
                   "payload_off": WaterHeaterClass.OFF,
                   "unique_id": self.unique_device_id + "_failure_dc_power_warning_status",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_failure_low_dc_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -622,7 +653,6 @@ class WaterHeaterClass(EntityPluginBaseClass):
             self.unique_device_id, "binary_sensor", "failure_dc_power_warning_status")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_failure_low_dc_topic, self.failure_dc_warning, retain=True)
\ No newline at end of file
+        self._publish_state(self.status_failure_low_dc_topic, self.failure_dc_warning)
@@ -24,7 +24,6 @@ limitations under the License.
 """
 
 
-import queue
 import logging
 import struct
 import json
@@ -50,6 +49,9 @@ class WaterPumpClass(EntityPluginBaseClass):
     '''
     FACTORY_MATCH_ATTRIBUTES = {
         "name": "WATER_PUMP_STATUS", "type": "water_pump"}
+    RVC_DECODE_FIELDS = {"WATER_PUMP_STATUS": ("operating_status", "pump_status", "water_hookup_detected",
+                                               "current_system_pressure"),
+                         "WATER_PUMP_COMMAND": ()}
     ON = "on"
     OFF = "off"
     OUTSIDE_WATER_CONNECTED = "connected"
@@ -79,12 +81,9 @@ class WaterPumpClass(EntityPluginBaseClass):
         # Allow MQTT to control power
         self.command_topic = mqtt_support.make_device_topic_string(
             self.id, None, False)
-        self.running_status_topic = mqtt_support.make_device_topic_string(
-            self.id, "running", True)
-        self.external_water_status_topic = mqtt_support.make_device_topic_string(
-            self.id, "external_water", True)
-        self.system_pressure_status_topic = mqtt_support.make_device_topic_string(
-            self.id, "system_pressure", True)
+        self.running_status_topic = self._make_state_topic("running")
+        self.external_water_status_topic = self._make_state_topic("external_water")
+        self.system_pressure_status_topic = self._make_state_topic("system_pressure")
         self.mqtt_support.register(self.command_topic, self.process_mqtt_msg)
 
         self.device = {"manufacturer": "RV-C",
@@ -104,53 +103,51 @@ class WaterPumpClass(EntityPluginBaseClass):
 
         if self._is_entry_match(self.rvc_match_status, new_message):
             self.Logger.debug(f"Msg Match Status: {str(new_message)}")
-
-            # Power State
-            if new_message["operating_status"] == "01":
-                self.power_state = WaterPumpClass.ON
-            elif new_message["operating_status"] == "00":
-                self.power_state = WaterPumpClass.OFF
-            else:
-                self.power_state = "UNEXPECTED(" + \
-                    str(new_message["operating_status"]) + ")"
-                self.Logger.error(
-                    f"Unexpected RVC value {str(new_message['operating_status'])}")
-
-            self.mqtt_support.client.publish(
-                self.status_topic, self.power_state, retain=True)
-
-            # Running State
-            if new_message["pump_status"] == "01":
-                self.running_state = WaterPumpClass.ON
-            elif new_message["pump_status"] == "00":
-                self.running_state = WaterPumpClass.OFF
-            else:
-                self.running_state = "UNEXPECTED(" + \
-                    str(new_message["pump_status"]) + ")"
-                self.Logger.error(
-                    f"Unexpected RVC value {str(new_message['pump_status'])}")
-
-            self.mqtt_support.client.publish(
-                self.running_status_topic, self.running_state, retain=True)
-
-            # External Water Hookup State
-            if new_message["water_hookup_detected"] == "01":
-                self.external_water_hookup = WaterPumpClass.OUTSIDE_WATER_DISCONNECTED
-            elif new_message["water_hookup_detected"] == "00":
-                self.external_water_hookup = WaterPumpClass.OUTSIDE_WATER_CONNECTED
-            else:
-                self.external_water_hookup = "UNEXPECTED(" + \
-                    str(new_message["water_hookup_detected"]) + ")"
-                self.Logger.error(
-                    f"Unexpected RVC value {str(new_message['water_hookup_detected'])}")
-
-            self.mqtt_support.client.publish(
-                self.external_water_status_topic, self.external_water_hookup, retain=True)
-
-            # System Pressure
-            self.system_pressure = new_message['current_system_pressure']
-            self.mqtt_support.client.publish(
-                self.system_pressure_status_topic, self.system_pressure, retain=True)
+            self._status_received()
+
+            with self._json_state_batch():
+                # Power State
+                if new_message["operating_status"] == "01":
+                    self.power_state = WaterPumpClass.ON
+                elif new_message["operating_status"] == "00":
+                    self.power_state = WaterPumpClass.OFF
+                else:
+                    self.power_state = "UNEXPECTED(" + \
+                        str(new_message["operating_status"]) + ")"
+                    self.Logger.error(
+                        f"Unexpected RVC value {str(new_message['operating_status'])}")
+
+                self._publish_state(self.status_topic, self.power_state)
+
+                # Running State
+                if new_message["pump_status"] == "01":
+                    self.running_state = WaterPumpClass.ON
+                elif new_message["pump_status"] == "00":
+                    self.running_state = WaterPumpClass.OFF
+                else:
+                    self.running_state = "UNEXPECTED(" + \
+                        str(new_message["pump_status"]) + ")"
+                    self.Logger.error(
+                        f"Unexpected RVC value {str(new_message['pump_status'])}")
+
+                self._publish_state(self.running_status_topic, self.running_state)
+
+                # External Water Hookup State
+                if new_message["water_hookup_detected"] == "01":
+                    self.external_water_hookup = WaterPumpClass.OUTSIDE_WATER_DISCONNECTED
+                elif new_message["water_hookup_detected"] == "00":
+                    self.external_water_hookup = WaterPumpClass.OUTSIDE_WATER_CONNECTED
+                else:
+                    self.external_water_hookup = "UNEXPECTED(" + \
+                        str(new_message["water_hookup_detected"]) + ")"
+                    self.Logger.error(
+                        f"Unexpected RVC value {str(new_message['water_hookup_detected'])}")
+
+                self._publish_state(self.external_water_status_topic, self.external_water_hookup)
+
+                # System Pressure
+                self.system_pressure = new_message['current_system_pressure']
+                self._publish_state(self.system_pressure_status_topic, self.system_pressure)
 
             return True
 
@@ -168,27 +165,41 @@ class WaterPumpClass(EntityPluginBaseClass):
             f"MQTT Msg Received on topic {topic} with payload {payload}")
 
         if topic == self.command_topic:
-            if payload.lower() == WaterPumpClass.OFF:
-                if self.power_state != WaterPumpClass.OFF:
-                    self._rvc_pump_off()
-            elif payload.lower() == WaterPumpClass.ON:
-                if self.power_state != WaterPumpClass.ON:
-                    self._rvc_pump_on()
-            else:
+            msgs = self.make_rvc_commands(payload)
+            if msgs is None:
                 self.Logger.warning(
                     f"Invalid payload {payload} for topic {topic}")
-
-    def _rvc_pump_off(self):
+                return
+            for msg in msgs:
+                self._send_rvc_command(msg)
+
+    def make_rvc_commands(self, payload: str) -> list:
+        """ rvc messages to turn the pump power on or off """
+        if payload.lower() == WaterPumpClass.OFF:
+            if self.power_state != WaterPumpClass.OFF:
+                return [self._rvc_pump_off()]
+        elif payload.lower() == WaterPumpClass.ON:
+            if self.power_state != WaterPumpClass.ON:
+                return [self._rvc_pump_on()]
+        else:
+            return None
+        return []
+
+    def _rvc_pump_off(self) -> dict:
         msg_bytes = bytearray(8)
         struct.pack_into("<BHHBBB", msg_bytes, 0, 0, 0, 0, 0, 0, 0)
         self.Logger.debug("Turn Pump Off")
-        self.send_queue.put({"dgn": "1FFB2", "data": msg_bytes})
+        msg = {"dgn": "1FFB2", "data": msg_bytes}
+        self._expect_optimistic_state(msg, {self.status_topic: WaterPumpClass.OFF})
+        return msg
 
-    def _rvc_pump_on(self):
+    def _rvc_pump_on(self) -> dict:
         msg_bytes = bytearray(8)
         struct.pack_into("<BHHBBB", msg_bytes, 0, 1, 0, 0, 0, 0, 0)
         self.Logger.debug("Turn Pump On")
-        self.send_queue.put({"dgn": "1FFB2", "data": msg_bytes})
+        msg = {"dgn": "1FFB2", "data": msg_bytes}
+        self._expect_optimistic_state(msg, {self.status_topic: WaterPumpClass.ON})
+        return msg
 
     def initialize(self):
         """ Optional function 
@@ -208,6 +219,7 @@ class WaterPumpClass(EntityPluginBaseClass):
                   "payload_off": WaterPumpClass.OFF,
                   "unique_id": self.unique_device_id + "_power",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.status_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -216,10 +228,9 @@ class WaterPumpClass(EntityPluginBaseClass):
             self.unique_device_id, "switch", "power")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.status_topic, self.power_state, retain=True)
+        self._publish_state(self.status_topic, self.power_state)
 
         # running state binary sensor  - produce the HA MQTT discovery config json for
         config = {"name": self.name + " running status",
@@ -230,6 +241,7 @@ class WaterPumpClass(EntityPluginBaseClass):
                   "enabled_by_default": False,  # this implementation running is the same as power
                   "unique_id": self.unique_device_id + "_running",
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.running_status_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -238,10 +250,9 @@ class WaterPumpClass(EntityPluginBaseClass):
             self.unique_device_id, "binary_sensor", "running")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.running_status_topic, self.running_state, retain=True)
+        self._publish_state(self.running_status_topic, self.running_state)
 
         # External Water Connected binary sensor  - produce the HA MQTT discovery config json for
         config = {"name": self.name + " external water",
@@ -252,6 +263,7 @@ class WaterPumpClass(EntityPluginBaseClass):
                   "unique_id": self.unique_device_id + "_external_water",
                   "enabled_by_default": False,  # this sensor is just the opposite of running/power
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.external_water_status_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -260,10 +272,9 @@ class WaterPumpClass(EntityPluginBaseClass):
             self.unique_device_id, "binary_sensor", "external_water")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.external_water_status_topic, self.external_water_hookup, retain=True)
+        self._publish_state(self.external_water_status_topic, self.external_water_hookup)
 
         # System Pressure sensor  - produce the HA MQTT discovery config json for
         config = {"name": self.name + " system pressure", 
@@ -276,6 +287,7 @@ class WaterPumpClass(EntityPluginBaseClass):
                   "unique_id": self.unique_device_id + "_system_pressure",
                   "enabled_by_default": False,  # this implementation doesn't expect this sensor to be used
                   "device": self.device}
+        config.update(self._get_state_discovery_info_for_ha(self.system_pressure_status_topic))
         config.update(self.get_availability_discovery_info_for_ha())
 
         config_json = json.dumps(config)
@@ -284,7 +296,6 @@ class WaterPumpClass(EntityPluginBaseClass):
             self.unique_device_id, "sensor", "system_pressure")
 
         # publish info to mqtt
-        self.mqtt_support.client.publish(
+        self.mqtt_support.publish(
             ha_config_topic, config_json, retain=True)
-        self.mqtt_support.client.publish(
-            self.system_pressure_status_topic, self.system_pressure, retain=True)
+        self._publish_state(self.system_pressure_status_topic, self.system_pressure)
@@ -20,31 +20,139 @@ limitations under the License.
 """
 
 import logging
+from typing import Union, Optional
 from rvc2mqtt.entity import EntityPluginBaseClass
 from rvc2mqtt.mqtt import MQTT_Support
 
-def entity_factory(data: dict, mqtt_support: MQTT_Support, entity_factory_list: list) -> EntityPluginBaseClass:
-    # loop thru the factory list and if a full match between factory and data then
-    # instantiate the object. 
+
+class EntityFactoryRegistry(object):
+    """ Registry of entity plugin classes indexed by their FACTORY_MATCH_ATTRIBUTES.
+
+    Plugins are grouped by the set of attribute names they match on and each group
+    is a dictionary keyed by the tuple of values for those names.  Finding the class
+    for a floorplan entry is one dictionary lookup per group instead of comparing
+    every key of every registered plugin.
+
+    If more than one plugin matches, the one registered first wins.
+    """
+
+    def __init__(self):
+        self.Logger = logging.getLogger(__name__)
+        self._groups = {}  # tuple of attribute names -> {tuple of values: (registration order, class)}
+        self._count = 0
+
+    def register(self, match_attributes: dict, entity_class) -> None:
+        keys = tuple(sorted(match_attributes.keys()))
+        values = tuple(match_attributes[k] for k in keys)
+        group = self._groups.setdefault(keys, {})
+        if values in group:
+            self.Logger.warning(f"Duplicate factory match {str(match_attributes)} for {entity_class.__name__}.  "
+                                f"Keeping {group[values][1].__name__}")
+            return
+        group[values] = (self._count, entity_class)
+        self._count += 1
+
+    def append(self, entry: tuple) -> None:
+        """ register a (FACTORY_MATCH_ATTRIBUTES, class) tuple.  Allows the registry
+        to be filled anywhere the old factory list was used."""
+        self.register(entry[0], entry[1])
+
+    def find(self, data: dict):
+        """ return the entity class that matches data or None """
+        found = None
+        for keys, group in self._groups.items():
+            try:
+                entry = group.get(tuple(data[k] for k in keys))
+            except (KeyError, TypeError):
+                # missing key or unhashable value in data.  Can't be this group.
+                continue
+            if entry is not None and (found is None or entry[0] < found[0]):
+                found = entry
+        return None if found is None else found[1]
+
+    def __len__(self) -> int:
+        return self._count
+
+    @classmethod
+    def from_list(cls, entries: list) -> "EntityFactoryRegistry":
+        """ make a registry from the legacy list of (match attributes, class) tuples """
+        registry = cls()
+        for entry in entries:
+            registry.append(entry)
+        return registry
+
+
+# (legacy list, its length, registry) of the last list passed to entity_factory.
+# The floorplan passes the same list for every entry so it is only indexed once.
+_legacy_registry_cache = (None, 0, None)
+
+
+def _registry_for_list(entries: list) -> EntityFactoryRegistry:
+    global _legacy_registry_cache
+    (cached, length, registry) = _legacy_registry_cache
+    if cached is not entries or length != len(entries):
+        registry = EntityFactoryRegistry.from_list(entries)
+        _legacy_registry_cache = (entries, len(entries), registry)
+    return registry
+
+
+def entity_factory(data: dict, mqtt_support: MQTT_Support, entity_factory_registry: Union[EntityFactoryRegistry, list]) -> EntityPluginBaseClass:
+    """ instantiate the entity that matches data.  Returns None if no plugin matches."""
     logger = logging.getLogger(__name__)
-    logger.debug(f"Factory for: {str(data)}")
-    for f_entry in entity_factory_list:
-        match = True
-        for k,v in f_entry[0].items():
-            if k not in data:
-                logger.debug(f"Key not in data: {k}")
-                match = False
-                break
-            if data[k] != v:
-                logger.debug(f"Value {v} for key {k} not the same as data: {str(data)}")
-                match = False
-                break
-        # finished or break - check for match
-        if match:
-            # matched.  Make matching entity
-            logger.debug(f"Found Entity Match for {str(data)} as {f_entry[1].__name__}")
-            return f_entry[1](data, mqtt_support)
-        
-    logger.error(f"Unsupported entity: {str(data)}")
-    return None
-    
\ No newline at end of file
+
+    if not isinstance(entity_factory_registry, EntityFactoryRegistry):
+        # support the legacy list of (match attributes, class) tuples
+        entity_factory_registry = _registry_for_list(entity_factory_registry)
+
+    entity_class = entity_factory_registry.find(data)
+    if entity_class is None:
+        logger.error(f"Unsupported entity: {str(data)}")
+        return None
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Found Entity Match for {str(data)} as {entity_class.__name__}")
+    return entity_class(data, mqtt_support)
+
+
+def resolve_entity_links(entity_list: list) -> None:
+    """ Second pass after all entities are created.
+
+    Build a dictionary of link_id to entity and then give each entity a reference
+    to every entity named in its entity_links.  Order in the floorplan does not matter.
+    """
+    logger = logging.getLogger(__name__)
+    link_map = {}
+    for obj in entity_list:
+        if obj.link_id is None:
+            continue
+        if obj.link_id in link_map:
+            logger.error(f"Duplicate link_id {obj.link_id}.  Ignoring it for {obj.id}")
+            continue
+        link_map[obj.link_id] = obj
+
+    for obj in entity_list:
+        for link in obj.entity_links:
+            requested_entity = link_map.get(link)
+            if requested_entity is None:
+                logger.error(f"Entity {obj.id} has link to unknown link_id {link}")
+                continue
+            obj.add_entity_link(requested_entity)
+
+
+def collect_rvc_decode_fields(entity_list: list) -> Optional[dict]:
+    """ Merge RVC_DECODE_FIELDS from all entities into a dictionary of DGN name
+    to set of fields for the decoder field projection.
+
+    Returns None (decode everything) if any entity doesn't declare its fields.
+    """
+    fields_by_name = {}
+    for obj in entity_list:
+        if obj.RVC_DECODE_FIELDS is None:
+            logging.getLogger(__name__).debug(f"Entity {obj.id} needs full decode of all DGNs")
+            return None
+        for name, fields in obj.RVC_DECODE_FIELDS.items():
+            if fields is None or (name in fields_by_name and fields_by_name[name] is None):
+                fields_by_name[name] = None
+            else:
+                fields_by_name.setdefault(name, set()).update(fields)
+    return fields_by_name
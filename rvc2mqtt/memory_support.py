@@ -0,0 +1,176 @@
+"""
+Memory growth diagnostics for rvc2mqtt
+
+The bridge runs for weeks.  A slow leak in an entity, the mqtt client or one
+of the queues only shows up when the gateway runs out of memory.  A memory
+report compares a tracemalloc snapshot and the gc object counts by type with
+the previous report and publishes the allocation sites and types that grew
+the most along with the queue sizes.
+
+Reports are made on demand (bridge memory_report/set topic) and optionally
+every interval seconds.  tracemalloc slows down allocations so it is only
+started by the first report.  That report is the baseline.  Without an
+interval an on demand request reports the baseline, reports the growth after
+a window of seconds and then stops tracing.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import gc
+import json
+import logging
+import os
+import tracemalloc
+from typing import Callable, Optional
+from rvc2mqtt.mqtt import MQTT_Support
+from rvc2mqtt.timer_support import TimerSupport
+
+
+class MemoryReport(object):
+    """ Make memory growth reports.  All functions must be called from the main loop """
+
+    TOP_COUNT = 10     # allocation sites and types in a report
+    TRACE_FRAMES = 1   # stack frames saved per allocation.  More frames use more memory
+    DEFAULT_WINDOW = 60.0   # seconds between the reports of an on demand request
+
+    def __init__(self, timer_support: TimerSupport, mqtt_support: Optional[MQTT_Support] = None,
+                 queue_depths: Callable[[], dict] = dict, interval: float = 0):
+        """ interval: seconds between periodic reports.  0 for on demand only """
+        self.Logger = logging.getLogger(__name__)
+        self.timer_support = timer_support
+        self.mqtt_support = mqtt_support
+        self.queue_depths = queue_depths
+        self.interval = interval
+        self._snapshot = None      # tracemalloc snapshot of the last report
+        self._type_counts = None   # gc object counts by type of the last report
+        self._started_tracing = False
+        self._window_running = False
+
+        if self.mqtt_support is not None:
+            self.command_topic = self.mqtt_support.root_topic + "/memory_report/set"
+            self.info_topic = self.mqtt_support.bridge_info_topic + "/memory"
+            self.mqtt_support.register(self.command_topic, self.process_mqtt_msg)
+
+    def start(self) -> None:
+        """ start periodic reports if an interval is set """
+        if self.interval > 0:
+            self.report()
+            self.timer_support.call_later(self.interval, self._tick)
+
+    def _tick(self) -> None:
+        self.timer_support.call_later(self.interval, self._tick)
+        self.report()
+
+    def process_mqtt_msg(self, topic, payload):
+        """ Make a report.  Without periodic reports payload is the seconds
+        (default DEFAULT_WINDOW) to wait before reporting the growth """
+        self.Logger.debug(f"MQTT Msg Received on topic {topic} with payload {payload}")
+        if self.interval > 0:
+            self.report()
+            return
+        try:
+            window = float(payload) if len(payload.strip()) > 0 else MemoryReport.DEFAULT_WINDOW
+        except ValueError:
+            self.Logger.warning(f"Invalid payload {payload} for topic {topic}.  Expected seconds to trace")
+            return
+        self.report_window(window)
+
+    def report_window(self, window: float = DEFAULT_WINDOW) -> bool:
+        """ report the baseline now and the growth after window seconds.  Then stop
+        tracing.  Returns False if a window is already running """
+        if self._window_running:
+            self.Logger.warning("Memory report window already running")
+            return False
+        self._window_running = True
+        self.report()
+        self.timer_support.call_later(max(window, 0.0), self._window_done)
+        return True
+
+    def _window_done(self) -> None:
+        self._window_running = False
+        self.report()
+        self.close()
+
+    def close(self) -> None:
+        """ stop tracing if this object started it """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self._snapshot = None
+        self._type_counts = None
+
+    def report(self) -> dict:
+        """ make a report of growth since the last report and publish it """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MemoryReport.TRACE_FRAMES)
+            self._started_tracing = True
+            self._snapshot = None
+
+        snapshot = self._filter(tracemalloc.take_snapshot())
+        (traced, peak) = tracemalloc.get_traced_memory()
+        type_counts = self._count_types()
+
+        result = {
+            "traced_kb": round(traced / 1024, 1),
+            "peak_kb": round(peak / 1024, 1),
+            "baseline": self._snapshot is None,
+            "top_growth": self._allocation_growth(snapshot),
+            "type_growth": self._type_growth(type_counts),
+            "gc_objects": sum(type_counts.values()),
+            "queues": self.queue_depths(),
+        }
+        self._snapshot = snapshot
+        self._type_counts = type_counts
+
+        self.Logger.info(f"Memory report: {result}")
+        if self.mqtt_support is not None:
+            self.mqtt_support.publish(self.info_topic, json.dumps(result), retain=False)
+        return result
+
+    @staticmethod
+    def _filter(snapshot):
+        """ don't count the memory used by tracemalloc itself """
+        return snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+    def _allocation_growth(self, snapshot) -> list:
+        """ allocation sites that grew the most since the last snapshot """
+        if self._snapshot is None:
+            return []
+        growth = []
+        for stat in snapshot.compare_to(self._snapshot, "lineno"):
+            if stat.size_diff <= 0:
+                continue
+            frame = stat.traceback[0]
+            growth.append({"site": f"{os.path.basename(frame.filename)}:{frame.lineno}",
+                           "size_diff_kb": round(stat.size_diff / 1024, 1),
+                           "count_diff": stat.count_diff,
+                           "size_kb": round(stat.size / 1024, 1)})
+            if len(growth) >= MemoryReport.TOP_COUNT:
+                break
+        return growth
+
+    @staticmethod
+    def _count_types() -> collections.Counter:
+        return collections.Counter(type(o).__name__ for o in gc.get_objects())
+
+    def _type_growth(self, type_counts: collections.Counter) -> dict:
+        """ types with the biggest increase in live gc objects since the last report """
+        if self._type_counts is None:
+            return {}
+        diff = type_counts.copy()
+        diff.subtract(self._type_counts)
+        return {name: count for name, count in diff.most_common(MemoryReport.TOP_COUNT) if count > 0}
@@ -0,0 +1,226 @@
+"""
+Metrics support for rvc2mqtt
+
+Small fixed memory metrics that can be published to mqtt as json.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+from typing import Callable, Optional
+
+
+class LatencyHistogram(object):
+    """ Histogram of latencies using fixed buckets.
+
+    Values are recorded in seconds.  Bucket bounds and reports are in milliseconds.
+    Memory use doesn't grow with the number of values recorded.
+    """
+
+    # upper bound (ms) of each bucket.  Values above the last bound go in the overflow bucket
+    DEFAULT_BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self, bucket_bounds_ms: tuple = DEFAULT_BUCKET_BOUNDS_MS):
+        self.bucket_bounds_ms = tuple(bucket_bounds_ms)
+        self.reset()
+
+    def reset(self) -> None:
+        self.buckets = [0] * (len(self.bucket_bounds_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+
+    def record(self, seconds: float) -> None:
+        ms = seconds * 1000.0
+        self.buckets[bisect.bisect_left(self.bucket_bounds_ms, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if self.min_ms is None or ms < self.min_ms:
+            self.min_ms = ms
+        if self.max_ms is None or ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, p: float) -> Optional[float]:
+        """ upper bound (ms) of the bucket holding the p percentile (0-100).
+        The overflow bucket reports the max value seen.  None if empty """
+        if self.count == 0:
+            return None
+        target = max(1, round(self.count * p / 100.0))
+        running = 0
+        for index, c in enumerate(self.buckets):
+            running += c
+            if running >= target:
+                if index < len(self.bucket_bounds_ms):
+                    return min(float(self.bucket_bounds_ms[index]), self.max_ms)
+                return self.max_ms
+        return self.max_ms
+
+    def as_dict(self) -> dict:
+        """ summary suitable for json """
+        d = {"count": self.count}
+        if self.count > 0:
+            d["min_ms"] = round(self.min_ms, 3)
+            d["max_ms"] = round(self.max_ms, 3)
+            d["avg_ms"] = round(self.total_ms / self.count, 3)
+            d["p50_ms"] = round(self.percentile(50), 3)
+            d["p90_ms"] = round(self.percentile(90), 3)
+            d["p99_ms"] = round(self.percentile(99), 3)
+            labels = [f"le_{b}" for b in self.bucket_bounds_ms] + ["overflow"]
+            d["buckets"] = {k: v for k, v in zip(labels, self.buckets) if v > 0}
+        return d
+
+
+class StartupTimer(object):
+    """ Time the phases of startup and milestones since start.
+
+    Phases can run on different threads at the same time.  Reports are in milliseconds.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.start = clock()
+        self.phases = {}      # name -> seconds the phase took
+        self.milestones = {}  # name -> seconds from start
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """ context manager that records how long the block took """
+        begin = self.clock()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.clock() - begin
+
+    def mark(self, name: str) -> None:
+        """ record the time from start.  Only the first mark of a name is kept """
+        with self._lock:
+            if name not in self.milestones:
+                self.milestones[name] = self.clock() - self.start
+
+    def has_mark(self, name: str) -> bool:
+        return name in self.milestones
+
+    def as_dict(self) -> dict:
+        """ summary suitable for json """
+        with self._lock:
+            return {"phases_ms": {k: round(v * 1000.0, 1) for k, v in self.phases.items()},
+                    "milestones_ms": {k: round(v * 1000.0, 1) for k, v in self.milestones.items()}}
+
+    def __str__(self) -> str:
+        d = self.as_dict()
+        phases = ", ".join(f"{k} {v}ms" for k, v in d["phases_ms"].items())
+        milestones = ", ".join(f"{k} at {v}ms" for k, v in d["milestones_ms"].items())
+        return f"phases: {phases}.  milestones: {milestones}"
+
+
+class FrameLatencyTracer(object):
+    """ Latency of each stage of processing a received can bus frame.
+
+    The main loop calls begin() when a frame is taken from the receive queue,
+    decoded() when it is decoded, and end() when the entities are done with it.
+    The mqtt support calls published() when a publish is handed to the mqtt client.
+    Stages recorded:
+        queue    - can bus receive timestamp to taken from the receive queue
+        decode   - taken from the queue to decoded
+        dispatch - decoded to entities done
+        publish  - can bus receive timestamp to the first publish (frames that published)
+        total    - can bus receive timestamp to entities done
+    total is also kept per DGN name.  Memory is fixed: at most MAX_DGNS names are kept
+    and the rest are counted under "other".
+
+    The clock must match the can bus timestamps (python-can uses time.time).
+    All functions must be called from the main loop.
+    """
+
+    STAGES = ("queue", "decode", "dispatch", "publish", "total")
+    MAX_DGNS = 64
+    # decode and dispatch take well under a millisecond
+    BUCKET_BOUNDS_MS = (0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+    OTHER_DGN = "other"
+
+    def __init__(self, clock: Callable[[], float] = time.time, max_dgns: int = MAX_DGNS):
+        self.clock = clock
+        self.max_dgns = max_dgns
+        self.reset()
+
+    def reset(self) -> None:
+        self.stages = {name: LatencyHistogram(self.BUCKET_BOUNDS_MS) for name in FrameLatencyTracer.STAGES}
+        self.dgn_total = {}
+        self._start = None
+        self._dequeued = None
+        self._decoded = None
+        self._published = None
+        self._dgn = None
+
+    def begin(self, rx_timestamp: float) -> None:
+        """ a frame was taken from the receive queue.  rx_timestamp is its can bus receive time """
+        now = self.clock()
+        self._dequeued = now
+        self._decoded = None
+        self._published = None
+        self._dgn = None
+        # some interfaces don't timestamp frames.  Then start from the dequeue
+        if rx_timestamp is not None and 0 < rx_timestamp <= now:
+            self._start = rx_timestamp
+            self.stages["queue"].record(now - rx_timestamp)
+        else:
+            self._start = now
+
+    def decoded(self, dgn_name: str) -> None:
+        """ the frame being traced was decoded """
+        if self._dequeued is None:
+            return
+        self._decoded = self.clock()
+        self._dgn = dgn_name
+        self.stages["decode"].record(self._decoded - self._dequeued)
+
+    def published(self) -> None:
+        """ a publish was handed to the mqtt client.  Only the first for a frame is recorded """
+        if self._decoded is not None and self._published is None:
+            self._published = self.clock()
+            self.stages["publish"].record(self._published - self._start)
+
+    def end(self) -> None:
+        """ the entities are done with the frame.  Frames that failed to decode only record queue """
+        if self._decoded is not None:
+            now = self.clock()
+            self.stages["dispatch"].record(now - self._decoded)
+            self.stages["total"].record(now - self._start)
+            self._get_dgn_histogram(self._dgn).record(now - self._start)
+        self._dequeued = None
+        self._decoded = None
+
+    def _get_dgn_histogram(self, dgn_name: str) -> LatencyHistogram:
+        h = self.dgn_total.get(dgn_name)
+        if h is None:
+            if len(self.dgn_total) >= self.max_dgns:
+                dgn_name = FrameLatencyTracer.OTHER_DGN
+                h = self.dgn_total.get(dgn_name)
+            if h is None:
+                h = LatencyHistogram(self.BUCKET_BOUNDS_MS)
+                self.dgn_total[dgn_name] = h
+        return h
+
+    def get_stats(self) -> dict:
+        """ latency histograms per stage and total per DGN suitable for json """
+        return {"stages": {name: h.as_dict() for name, h in self.stages.items()},
+                "dgn_total": {name: h.as_dict() for name, h in self.dgn_total.items()}}
@@ -17,19 +17,42 @@ See the License for the specific language governing permissions and
 limitations under the License.
 
 """
+import collections
+import json
 import logging
-import paho.mqtt.client as mqc
+import queue
+import threading
+from typing import TYPE_CHECKING
+
+# paho is imported where it is used so tools that only decode don't load it
+if TYPE_CHECKING:
+    import paho.mqtt.client as mqc
 
 
 class MQTT_Support(object):
     TOPIC_BASE = "rvc2mqtt"
     HA_AUTO_BASE = "homeassistant"
-     
+
+    # seconds between connection attempts.  Doubles after each failure up to the max
+    RECONNECT_MIN_DELAY = 1
+    RECONNECT_MAX_DELAY = 60
+
+    # While disconnected only the latest message for each topic is kept.
+    OFFLINE_BUFFER_SIZE = 2000   # max topics held.  Oldest are dropped
+    FLUSH_BATCH_SIZE = 50        # messages published per flush step after reconnect
+    FLUSH_INTERVAL = 0.1         # seconds between flush steps
     
     def __init__(self, client_id:str):
         self.Logger = logging.getLogger(__name__)
         self.client_id = client_id
         self._connected = False
+        self.timer_support = None
+
+        # topic -> (payload, qos, retain).  In publish order
+        self._offline_buffer = collections.OrderedDict()
+        self._offline_lock = threading.Lock()
+        self._flush_scheduled = False
+        self.offline_counters = {"buffered": 0, "replaced": 0, "dropped": 0, "flushed": 0}
 
         self.root_topic = MQTT_Support.TOPIC_BASE + "/" + self.client_id
         self.device_topic_base = self.root_topic + "/d"
@@ -37,8 +60,12 @@ class MQTT_Support(object):
         # topic strings
         self.bridge_state_topic = self.root_topic + "/" + "state"
         self.bridge_info_topic = self.root_topic + "/" + "info"
+        self.bridge_metrics_topic = self.root_topic + "/" + "metrics"
 
         self.registered_mqtt_devices = {}
+        self.command_queue: queue.Queue = None
+        # optional FrameLatencyTracer told when a publish is handed to paho
+        self.frame_tracer = None
 
 
     def register(self, topic, func):
@@ -46,19 +73,108 @@ class MQTT_Support(object):
         if self._connected:
             self.client.subscribe((topic,0))
 
-    def set_client(self, client: mqc):
+    def set_command_queue(self, command_queue: queue.Queue):
+        """ Put received messages in command_queue as (func, topic, payload)
+        instead of calling func on the mqtt network thread. """
+        self.command_queue = command_queue
+
+    def set_client(self, client: "mqc.Client"):
+        import paho.mqtt.client as mqc
         self.client = client
+        # saved so publish doesn't look up the paho module every call
+        self._err_no_conn = mqc.MQTT_ERR_NO_CONN
+
+    def set_timer_support(self, timer_support):
+        """ Provide the shared TimerSupport used to pace the flush of the offline buffer """
+        self.timer_support = timer_support
+
+    def publish(self, topic: str, payload, retain: bool = False, qos: int = 0):
+        """ publish a message.  While not connected to the broker only the
+        latest message for each topic is kept and sent once connected. """
+        with self._offline_lock:
+            if not self._connected:
+                self._buffer_offline(topic, payload, qos, retain)
+                return
+            # a newer value replaces one still waiting to be flushed
+            self._offline_buffer.pop(topic, None)
+
+        # paho takes its own locks (also held during callbacks) so don't hold ours
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        if info.rc == self._err_no_conn:
+            with self._offline_lock:
+                self._buffer_offline(topic, payload, qos, retain)
+        elif self.frame_tracer is not None:
+            self.frame_tracer.published()
+
+    def _buffer_offline(self, topic: str, payload, qos: int, retain: bool):
+        """ must hold _offline_lock """
+        if topic in self._offline_buffer:
+            self.offline_counters["replaced"] += 1
+            self._offline_buffer.move_to_end(topic)
+        else:
+            self.offline_counters["buffered"] += 1
+            if len(self._offline_buffer) >= MQTT_Support.OFFLINE_BUFFER_SIZE:
+                self._offline_buffer.popitem(last=False)
+                self.offline_counters["dropped"] += 1
+        self._offline_buffer[topic] = (payload, qos, retain)
+
+    def get_offline_buffer_count(self) -> int:
+        return len(self._offline_buffer)
+
+    def get_outgoing_count(self) -> int:
+        """ messages the mqtt client is holding that are not yet sent or acknowledged """
+        return len(getattr(self.client, "_out_messages", ()))
+
+    def _flush_offline_buffer(self):
+        """ timer callback.  Publish the next batch of buffered messages """
+        with self._offline_lock:
+            self._flush_scheduled = False
+            if not self._connected:
+                return
+        self._publish_buffered(MQTT_Support.FLUSH_BATCH_SIZE)
+        with self._offline_lock:
+            if len(self._offline_buffer) == 0:
+                self.Logger.info("Offline publish buffer flushed")
+                return
+            self._flush_scheduled = True
+        self.timer_support.call_later(MQTT_Support.FLUSH_INTERVAL, self._flush_offline_buffer)
+
+    def _publish_buffered(self, count: int):
+        """ publish up to count of the oldest buffered messages """
+        with self._offline_lock:
+            batch = [self._offline_buffer.popitem(last=False) for _ in range(min(count, len(self._offline_buffer)))]
+            self.offline_counters["flushed"] += len(batch)
+        for (topic, (payload, qos, retain)) in batch:
+            self.client.publish(topic, payload, qos=qos, retain=retain)
+
+    def get_offline_stats(self) -> dict:
+        """ counters suitable for json """
+        stats = dict(self.offline_counters)
+        stats["waiting"] = len(self._offline_buffer)
+        return stats
 
     def on_connect(self, client, userdata, flags, rc):
         """ callback function for when it has been connected.
         Should subscribe to topics
         """
+        import paho.mqtt.client as mqc
         self.Logger.info(f"MQTT connected: {mqc.connack_string(rc)}")
         if rc == mqc.CONNACK_ACCEPTED:
             # publish topic
             self.client.publish(self.bridge_state_topic, "online", retain=True)
-            
-            self._connected = True
+
+            with self._offline_lock:
+                self._connected = True
+                waiting = len(self._offline_buffer)
+                schedule = waiting > 0 and not self._flush_scheduled and self.timer_support is not None
+                self._flush_scheduled |= schedule
+            if waiting > 0:
+                self.Logger.info(f"Flushing {waiting} messages published while offline")
+                # paced from the main loop when possible
+                if schedule:
+                    self.timer_support.call_later(0, self._flush_offline_buffer)
+                elif self.timer_support is None:
+                    self._publish_buffered(waiting)
             topic_tuple_list = [(x, 0) for x in self.registered_mqtt_devices.keys()]
             if len(topic_tuple_list) > 0:
                 self.client.subscribe(topic_tuple_list)
@@ -72,18 +188,27 @@ class MQTT_Support(object):
     def on_message(self, client, userdata, msg):
         if msg.topic in self.registered_mqtt_devices:
             func = self.registered_mqtt_devices[msg.topic]
-            func(msg.topic, msg.payload.decode('utf-8'))
+            if self.command_queue is not None:
+                self.command_queue.put((func, msg.topic, msg.payload.decode('utf-8')))
+            else:
+                func(msg.topic, msg.payload.decode('utf-8'))
         else:
             self.Logger.warning("Received mqtt message without a device registered '" + str(msg.payload) + "' on topic '" + msg.topic + "' with QoS " + str(msg.qos))
     
     def on_disconnect(self, client, userdata, msg):
         self.Logger.critical("MQTT disconnected")
-        self._connected = False
+        with self._offline_lock:
+            self._connected = False
 
 
     def send_bridge_info(self, info:str):
         pass
 
+    def publish_metrics(self, name: str, metrics: dict):
+        """ publish a dictionary of metrics as json to the bridge metrics/<name> topic """
+        topic = self.bridge_metrics_topic + "/" + self._prepare_topic_string_node(name)
+        self.publish(topic, json.dumps(metrics), retain=False)
+
     def _make_device_topic_root(self, id:str) -> str:
         return self.device_topic_base + "/" + self._prepare_topic_string_node(id)
 
@@ -150,12 +275,15 @@ def on_mqtt_disconnect(client, userdata, msg):
 def MqttInitalize(host:str, port:str, user:str, password:str, client_id:str):
     """ main function to parse config and initialize the 
     mqtt client.
+
+    Doesn't wait for the broker.  The connection is made (and retried with
+    backoff) by the network thread started with client.loop_start().  Until
+    then publishes are held in the offline buffer.
     """
     global gMQTTObj
     gMQTTObj = MQTT_Support(client_id)
 
-    port = int(port)
-    
+    import paho.mqtt.client as mqc
     mqttc = mqc.Client(client_id=client_id)
     gMQTTObj.set_client(mqttc)
     mqttc.on_connect = on_mqtt_connect
@@ -164,15 +292,14 @@ def MqttInitalize(host:str, port:str, user:str, password:str, client_id:str):
     mqttc.on_disconnect = on_mqtt_disconnect
     mqttc.username_pw_set(user, password)
     mqttc.will_set(gMQTTObj.bridge_state_topic, payload="offline", qos=0, retain=True)
-    
+    mqttc.reconnect_delay_set(MQTT_Support.RECONNECT_MIN_DELAY, MQTT_Support.RECONNECT_MAX_DELAY)
 
     try:
         logging.getLogger(__name__).info(f"Connecting to MQTT broker {host}:{port}")
-        mqttc.connect(host, port=port)
-        return gMQTTObj
-    
+        mqttc.connect_async(host, port=int(port))
     except Exception as e:
+        # bad config.  The bridge keeps running on the can bus with publishes buffered
         logging.getLogger(__name__).error(f"MQTT Broker Connection Failed. {e}")
-        return None
+    return gMQTTObj
 
 
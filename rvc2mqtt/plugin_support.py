@@ -47,13 +47,16 @@ class PluginSupport(object):
          else:
             self.Logger.error(f"Invalid Plugin Path: {p}")
       
-   def register_with_factory_the_entity_plugins(self, factory_map:list):
+   def register_with_factory_the_entity_plugins(self, factory_map):
       """
       Load the classes defined in plugins that are:
          * subclass of EntityPluginBaseClass and 
          * define class dict of FACTORY_MATCH_ATTRIBUTES
       Register the class with the factory
 
+      factory_map can be an EntityFactoryRegistry or a list.  Each
+      registration is appended as a (FACTORY_MATCH_ATTRIBUTES, class) tuple.
+
       DEVELOPER NOTE:  This is pretty hacky.  This was hacked together
       with trial and error.  I am sure numerous steps are not needed
       or different functions/implementations could be used
@@ -0,0 +1,135 @@
+"""
+On demand profiling support for rvc2mqtt
+
+Performance problems often only show up on a real coach.  A time boxed
+cProfile session of the main loop (receive, decode, entity dispatch and
+publish) can be started in place with SIGUSR1 or by publishing the number of
+seconds to the bridge profile/set topic.  The stats are written to a .pstats
+file and a summary of the top functions is published to the bridge
+info/profile topic.
+
+Nothing is profiled or checked until a session is requested.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+import json
+import logging
+import os
+import signal
+from typing import Optional
+from rvc2mqtt.mqtt import MQTT_Support
+from rvc2mqtt.timer_support import TimerSupport
+
+
+class ProfileSupport(object):
+    """ Run cProfile on the main loop for a number of seconds.
+
+    start() and stop() must be called from the main loop.  Profiling
+    only covers the thread that calls start().
+    """
+
+    DEFAULT_DURATION = 30.0   # seconds
+    MAX_DURATION = 600.0      # seconds
+    TOP_COUNT = 20            # functions in the published summary
+
+    def __init__(self, output_dir: os.PathLike, timer_support: TimerSupport,
+                 mqtt_support: Optional[MQTT_Support] = None):
+        self.Logger = logging.getLogger(__name__)
+        self.output_dir = output_dir
+        self.timer_support = timer_support
+        self.mqtt_support = mqtt_support
+        self.profiler = None
+        # set by the signal handler.  The main loop calls start() when it sees it
+        self.start_requested = False
+
+        if self.mqtt_support is not None:
+            self.command_topic = self.mqtt_support.root_topic + "/profile/set"
+            self.info_topic = self.mqtt_support.bridge_info_topic + "/profile"
+            self.mqtt_support.register(self.command_topic, self.process_mqtt_msg)
+
+    def install_signal_handler(self, signum: int = getattr(signal, "SIGUSR1", None)) -> None:
+        """ start a session of DEFAULT_DURATION when signum is received """
+        if signum is not None:
+            signal.signal(signum, self._signal_handler)
+
+    def _signal_handler(self, signum, frame):
+        # The main loop may hold the timer or queue locks when the signal arrives.
+        # Only set a flag here.
+        self.start_requested = True
+
+    def process_mqtt_msg(self, topic, payload):
+        self.Logger.debug(f"MQTT Msg Received on topic {topic} with payload {payload}")
+        try:
+            duration = float(payload) if len(payload.strip()) > 0 else ProfileSupport.DEFAULT_DURATION
+        except ValueError:
+            self.Logger.warning(f"Invalid payload {payload} for topic {topic}.  Expected seconds to profile")
+            return
+        self.start(duration)
+
+    def is_running(self) -> bool:
+        return self.profiler is not None
+
+    def start(self, duration: float = DEFAULT_DURATION) -> bool:
+        """ start profiling the calling thread for duration seconds.  Returns False if already running """
+        self.start_requested = False
+        if self.profiler is not None:
+            self.Logger.warning("Profile session already running")
+            return False
+        duration = min(max(duration, 0.1), ProfileSupport.MAX_DURATION)
+
+        import cProfile  # only needed when profiling
+        self.Logger.info(f"Starting {duration} second profile session")
+        self.profiler = cProfile.Profile()
+        self.timer_support.call_later(duration, self.stop)
+        self.profiler.enable()
+        return True
+
+    def stop(self) -> Optional[dict]:
+        """ stop profiling, write the stats file and publish the summary.  Returns the summary """
+        if self.profiler is None:
+            return None
+        self.profiler.disable()
+        profiler = self.profiler
+        self.profiler = None
+
+        import pstats
+        stats = pstats.Stats(profiler)
+        summary = {"file": None, "total_ms": round(stats.total_tt * 1000, 3), "top": self._top_functions(stats)}
+        path = os.path.join(self.output_dir, datetime.datetime.now().strftime("rvc2mqtt-%Y%m%d-%H%M%S.pstats"))
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            stats.dump_stats(path)
+            summary["file"] = path
+        except OSError as e:
+            self.Logger.error(f"Failed to write profile stats {path}: {e}")
+
+        self.Logger.info(f"Profile session done.  {summary}")
+        if self.mqtt_support is not None:
+            self.mqtt_support.publish(self.info_topic, json.dumps(summary), retain=False)
+        return summary
+
+    @staticmethod
+    def _top_functions(stats, count: int = TOP_COUNT) -> list:
+        """ functions with the most time spent in the function itself """
+        top = []
+        # stats.stats is (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            top.append({"function": f"{os.path.basename(filename)}:{line}({name})", "calls": calls,
+                        "tottime_ms": round(tottime * 1000, 3), "cumtime_ms": round(cumtime * 1000, 3)})
+        top.sort(key=lambda f: f["tottime_ms"], reverse=True)
+        return top[:count]
@@ -0,0 +1,181 @@
+"""
+DGN request support for rvc2mqtt
+
+Entities ask devices to report their status by sending a REQUEST_FOR_DGN.
+The scheduler collects these requests, removes duplicates, merges requests
+for many instances of the same DGN into one all instance (0xFF) request, and
+sends them paced out so a large floorplan doesn't flood the bus at startup.
+Requests that are still not satisfied after a timeout are sent again.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import logging
+import struct
+from typing import Callable, Optional
+from rvc2mqtt.timer_support import TimerSupport
+from rvc2mqtt.tx_support import TxScheduler
+
+
+class _Waiter(object):
+    __slots__ = ("attempts", "satisfied_checks")
+
+    def __init__(self):
+        self.attempts = 0
+        self.satisfied_checks = []
+
+
+class DgnRequestScheduler(object):
+    """ Deduplicate, merge and pace REQUEST_FOR_DGN messages.
+
+    Requests made before start() are held so requests from all entities can be merged.
+    All functions must be called from the main loop.
+    """
+
+    REQUEST_DGN = "EAFF"  # REQUEST_FOR_DGN to all nodes
+    WILDCARD_INSTANCE = 0xFF
+
+    def __init__(self, timer_support: TimerSupport, send_func: Callable[[dict], None],
+                 interval: float = 0.1, retry_timeout: float = 5.0, max_retries: int = 2,
+                 wildcard_dgns: set = frozenset(), merge_threshold: int = 2):
+        """
+        send_func - queues a rvc message for sending
+        interval - seconds between request messages
+        retry_timeout - seconds to wait before checking if a request was satisfied
+        max_retries - times a request is sent again if not satisfied
+        wildcard_dgns - DGNs that support an all instance request
+        merge_threshold - number of instances of a DGN needed to send an all instance request
+        """
+        self.Logger = logging.getLogger(__name__)
+        self.timer_support = timer_support
+        self.send_func = send_func
+        self.interval = interval
+        self.retry_timeout = retry_timeout
+        self.max_retries = max_retries
+        self.wildcard_dgns = {self._normalize_dgn(d) for d in wildcard_dgns} - {None}
+        self.merge_threshold = merge_threshold
+
+        self._waiters = {}    # (dgn, instance) -> _Waiter  requested and not yet satisfied
+        self._pending = {}    # dgn -> list of instances not yet sent.  In request order
+        self._ready = collections.deque()  # (dgn, instance, keys covered) ready to send
+        self._started = False
+        self._tick_scheduled = False
+        self.counters = {"requested": 0, "sent": 0, "merged": 0, "retried": 0, "unsatisfied": 0}
+
+    def _normalize_dgn(self, dgn: str) -> Optional[str]:
+        """ 5 digit upper case hex string or None if dgn is not hex """
+        try:
+            return "{0:05X}".format(int(dgn, 16))
+        except (ValueError, TypeError):
+            self.Logger.warning(f"Ignoring invalid DGN {dgn}")
+            return None
+
+    @staticmethod
+    def make_request_data(dgn: str, instance: int) -> bytes:
+        """ make the 8 byte REQUEST_FOR_DGN payload """
+        d = int(dgn, 16)
+        return struct.pack("<BBBBBBBB", d & 0xFF, (d >> 8) & 0xFF, (d >> 16) & 0xFF, instance, 0, 0, 0, 0)
+
+    def request(self, dgn: str, instance: int, is_satisfied: Optional[Callable[[], bool]] = None) -> None:
+        """ Request devices report dgn for instance.
+
+        is_satisfied returns True once the response was received.  If not
+        provided the request is sent once.
+        """
+        key = (self._normalize_dgn(dgn), instance)
+        if key[0] is None:
+            return
+        self.counters["requested"] += 1
+        waiter = self._waiters.get(key)
+        if waiter is None:
+            waiter = _Waiter()
+            self._waiters[key] = waiter
+            self._pending.setdefault(key[0], []).append(instance)
+            self._schedule_tick(0)
+        if is_satisfied is not None:
+            waiter.satisfied_checks.append(is_satisfied)
+
+    def start(self) -> None:
+        """ start sending requests """
+        self._started = True
+        self._schedule_tick(0)
+
+    def get_pending_count(self) -> int:
+        return len(self._waiters)
+
+    def get_stats(self) -> dict:
+        """ counters suitable for json """
+        stats = dict(self.counters)
+        stats["pending"] = len(self._waiters)
+        return stats
+
+    def _schedule_tick(self, delay: float) -> None:
+        if self._started and not self._tick_scheduled and (len(self._ready) > 0 or len(self._pending) > 0):
+            self._tick_scheduled = True
+            self.timer_support.call_later(delay, self._tick)
+
+    def _tick(self) -> None:
+        """ send one request message """
+        self._tick_scheduled = False
+        if len(self._ready) == 0:
+            self._expand_next_pending()
+
+        if len(self._ready) > 0:
+            (dgn, instance, keys) = self._ready.popleft()
+            self.Logger.debug(f"Sending Request for DGN {dgn} instance {instance}")
+            # first request is discovery.  Requests sent again are a refresh
+            retry = any(self._waiters[key].attempts > 0 for key in keys)
+            self.send_func({"dgn": DgnRequestScheduler.REQUEST_DGN,
+                            "data": DgnRequestScheduler.make_request_data(dgn, instance),
+                            "tx_class": TxScheduler.TX_CLASS_REFRESH if retry else TxScheduler.TX_CLASS_DISCOVERY})
+            self.counters["sent"] += 1
+            for key in keys:
+                self._waiters[key].attempts += 1
+            self.timer_support.call_later(self.retry_timeout, self._check_satisfied, keys)
+
+        self._schedule_tick(self.interval)
+
+    def _expand_next_pending(self) -> None:
+        """ turn the oldest pending DGN into request messages """
+        if len(self._pending) == 0:
+            return
+        dgn = next(iter(self._pending))
+        instances = self._pending.pop(dgn)
+        keys = [(dgn, i) for i in instances]
+        if dgn in self.wildcard_dgns and len(instances) >= self.merge_threshold:
+            self.counters["merged"] += len(instances) - 1
+            self._ready.append((dgn, DgnRequestScheduler.WILDCARD_INSTANCE, keys))
+        else:
+            self._ready.extend((dgn, i, [k]) for (i, k) in zip(instances, keys))
+
+    def _check_satisfied(self, keys: list) -> None:
+        """ send the request again for keys that haven't been satisfied """
+        for key in keys:
+            waiter = self._waiters.get(key)
+            if waiter is None:
+                continue
+            if len(waiter.satisfied_checks) == 0 or all(check() for check in waiter.satisfied_checks):
+                del self._waiters[key]
+            elif waiter.attempts > self.max_retries:
+                del self._waiters[key]
+                self.counters["unsatisfied"] += 1
+                self.Logger.warning(f"No response to request for DGN {key[0]} instance {key[1]} "
+                                    f"after {waiter.attempts} attempt(s)")
+            else:
+                self.counters["retried"] += 1
+                self._pending.setdefault(key[0], []).append(key[1])
+        self._schedule_tick(0)
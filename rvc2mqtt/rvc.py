@@ -4,7 +4,8 @@ Defines a RVC Decoder class for decoding RV-C messages.
 This decoder uses a YAML formatted document that describes the RV-C specification
 and the various data group number (DGN) and data (bit, bytes, and values found
 in the data).  This decoder takes a raw dgn and data buffer and converts to a
-more friendly dictionary describing the message. 
+more friendly record describing the message.  Record types are generated per DGN
+when the spec is loaded and can be used like a read only dictionary.
 
 RVIA: https://www.rvia.org/node/standards-subcommittee-rv-c
 RVC:  http://rv-c.com
@@ -35,13 +36,274 @@ limitations under the License.
 """
 from os import PathLike
 import logging
-import ruyaml as YAML
-from typing import Union, Tuple
+import time
+import re
+import keyword
+from collections.abc import Mapping
+from typing import Union, Tuple, Optional
+
+
+class _FrameHeader(object):
+    """ Fields derived from a CAN arbitration id.  Computed once per arbitration id
+    and shared by every message decoded with that id."""
+    __slots__ = ("arbitration_id", "priority", "dgn_h", "dgn_l", "dgn", "source_id", "name", "decoder")
+
+
+# fields that come from the frame header in dictionary order
+_HEADER_KEYS = ("arbitration_id", "data", "priority", "dgn_h", "dgn_l", "dgn", "source_id", "name")
+
+
+class RVC_Message(Mapping):
+    """ A decoded RV-C message.
+
+    Record types with __slots__ are generated per DGN from the spec when it is loaded.
+    Decoded parameters are attributes (msg.instance) and the message can also be used
+    as a read only dictionary (msg["instance"]) with the same keys the decoder has always
+    produced.  Use as_dict() to get a real dictionary.
+
+    *_definition values are looked up from the spec only when accessed.
+    """
+    __slots__ = ("_header", "data", "decoder_pending")
+
+    _keys = tuple((k, k) for k in _HEADER_KEYS)  # (dictionary key, attribute name) in order
+    _key_to_attr = dict(_keys)
+    _definitions = {}  # definition attribute name -> (attribute name of value, values dict)
+
+    def __init__(self, header: _FrameHeader, data: str):
+        self._header = header
+        self.data = data
+
+    @property
+    def arbitration_id(self) -> str:
+        return self._header.arbitration_id
+
+    @property
+    def priority(self) -> str:
+        return self._header.priority
+
+    @property
+    def dgn_h(self) -> str:
+        return self._header.dgn_h
+
+    @property
+    def dgn_l(self) -> str:
+        return self._header.dgn_l
+
+    @property
+    def dgn(self) -> str:
+        return self._header.dgn
+
+    @property
+    def source_id(self) -> str:
+        return self._header.source_id
+
+    @property
+    def name(self) -> str:
+        return self._header.name
+
+    def __getattr__(self, name: str):
+        # Only called when the attribute is not set.
+        d = type(self)._definitions.get(name)
+        if d is not None:
+            try:
+                if d[0] in _HEADER_KEYS:
+                    # don't fall back to the header field.  Only the decoded parameter has a definition
+                    value = type(self).__dict__[d[0]].__get__(self)
+                else:
+                    value = getattr(self, d[0])
+                # int(value) is a hack because the spec yaml interprets binary bits
+                # as integers instead of binary strings.
+                return d[1][int(value)]
+            except Exception:
+                raise AttributeError(name) from None
+
+        if name in _HEADER_KEYS and name != "data":
+            # a parameter that overrides a header field (priority) but failed to decode
+            return getattr(self._header, name)
+        raise AttributeError(name)
+
+    def __getitem__(self, key: str):
+        attr = self._key_to_attr.get(key)
+        if attr is None:
+            raise KeyError(key)
+        try:
+            return getattr(self, attr)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default=None):
+        attr = self._key_to_attr.get(key)
+        if attr is None:
+            return default
+        return getattr(self, attr, default)
+
+    def __contains__(self, key) -> bool:
+        attr = self._key_to_attr.get(key)
+        return attr is not None and hasattr(self, attr)
+
+    def __iter__(self):
+        for key, attr in self._keys:
+            if hasattr(self, attr):
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def as_dict(self) -> dict:
+        """ return a new dictionary of all fields in this message """
+        result = {}
+        for key, attr in self._keys:
+            try:
+                result[key] = getattr(self, attr)
+            except AttributeError:
+                pass
+        return result
+
+    def __repr__(self) -> str:
+        return repr(self.as_dict())
+
+
+class _ParamDecoder(object):
+    """ A parameter from the spec compiled for decoding """
+    __slots__ = ("name", "key", "attr", "slices", "bits", "is_uint", "unit", "type", "convert")
+
+    def decode(self, data: str):
+        """ return the value of this parameter from the hex string data.
+
+        Raises an exception if data doesn't contain the bytes for this param
+        """
+        if len(self.slices) == 1:
+            (s, e) = self.slices[0]
+            value = int(data[s:e], 16)
+        else:
+            value = int("".join(data[s:e] for (s, e) in self.slices), 16)
+
+        # Get bits if needed for param
+        if self.bits is not None and value >= 0 and value <= 256:
+            (start, end) = self.bits
+            value = "{0:08b}".format(value)[7 - end: 8 - start]
+            if self.is_uint:
+                value = int(value, 2)  # convert binary back to int
+
+        # convert if type/unit defined
+        if self.unit is not None and self.type is not None:
+            try:
+                value = self.convert(value, self.unit, self.type)
+            except Exception:
+                pass
+        return value
+
+
+class _DgnDecoder(object):
+    """ Record type and compiled parameters for one entry of the spec
+
+    projected_params is the subset of params decoded when a field projection is
+    set.  None means decode all params.
+    """
+    __slots__ = ("name", "record_class", "params", "projected_params", "Logger")
+
+    def decode(self, header: _FrameHeader, data: str, full: bool) -> RVC_Message:
+        record = self.record_class(header, data)
+        if not full and self.projected_params is not None:
+            for param in self.projected_params:
+                try:
+                    setattr(record, param.attr, param.decode(data))
+                except Exception:
+                    pass  # skipped fields are just missing.  Full decode will log it
+            return record
+
+        param_count = 0
+        for param in self.params:
+            try:
+                value = param.decode(data)
+            except Exception:
+                # If you get here, it's because the params had more bytes than the data packet.
+                # Thus, skip the rest of the processing
+                self.Logger.error(
+                    f"Invalid decoding {self.name} param: {param.name} data: {data}"
+                )
+                continue
+            setattr(record, param.attr, value)
+            param_count += 1
+
+        if param_count == 0:
+            record.decoder_pending = 1
+        return record
+
+
+class _UnknownDgn(object):
+    """ Negative cache entry for a DGN that is not in the spec.  Counts frames."""
+    __slots__ = ("dgn", "count", "tracker")
+
+    def decode(self, header: _FrameHeader, data: str, full: bool) -> RVC_Message:
+        self.count += 1
+        self.tracker.frame_seen()
+        return RVC_Message(header, data)
+
+
+class UnknownDgnTracker(object):
+    """ Count frames of DGNs that are not in the loaded spec.
+
+    The first frame of each unknown DGN is logged as a warning.  After that a
+    summary of counts is logged at most once per report_interval seconds.
+    """
+    MAX_TRACKED_DGNS: int = 1024
+    OTHER: str = "OTHER"  # counter used once MAX_TRACKED_DGNS is reached
+
+    def __init__(self, report_interval: float = 300):
+        self.Logger = logging.getLogger(__name__)
+        self.report_interval = report_interval
+        self._dgns = {}  # dgn string -> _UnknownDgn
+        self._reported = {}  # dgn string -> count at last summary
+        self._next_report = time.monotonic() + report_interval
+
+    def get(self, dgn: str) -> _UnknownDgn:
+        """ get the counter for an unknown dgn """
+        entry = self._dgns.get(dgn)
+        if entry is None:
+            if len(self._dgns) >= UnknownDgnTracker.MAX_TRACKED_DGNS:
+                dgn = UnknownDgnTracker.OTHER
+                entry = self._dgns.get(dgn)
+            if entry is None:
+                self.Logger.warning(f"Failed to find DGN {dgn} in loaded specification")
+                entry = _UnknownDgn()
+                entry.dgn = dgn
+                entry.count = 0
+                entry.tracker = self
+                self._dgns[dgn] = entry
+        return entry
+
+    def frame_seen(self) -> None:
+        if time.monotonic() >= self._next_report:
+            self.log_summary()
+
+    def log_summary(self) -> None:
+        """ log counts of unknown DGN frames since the last summary """
+        self._next_report = time.monotonic() + self.report_interval
+        recent = []
+        for dgn, entry in self._dgns.items():
+            delta = entry.count - self._reported.get(dgn, 0)
+            if delta > 0:
+                recent.append((delta, dgn, entry.count))
+            self._reported[dgn] = entry.count
+        if len(recent) == 0:
+            return
+        recent.sort(reverse=True)
+        summary = ", ".join(f"{dgn}: {delta} (total {total})" for (delta, dgn, total) in recent[:10])
+        if len(recent) > 10:
+            summary += f", and {len(recent) - 10} more"
+        self.Logger.info(f"Frames for DGNs not in loaded specification: {summary}")
+
+    def get_counts(self) -> dict:
+        """ return dictionary of unknown dgn to frame count """
+        return {dgn: entry.count for dgn, entry in self._dgns.items()}
 
 
 class RVC_Decoder(object):
     DEFAULT_PRIORITY: int = '6'
     DEFAULT_SOURCE_ID: int = '82'  # 130 decimal
+    MAX_CACHED_ARBITRATION_IDS: int = 4096
+    _DGN_KEY = re.compile("[0-9A-F]{3}([0-9A-F]{2})?")  # spec keys that are DGNs (dgn_h or dgn)
 
     def __init__(self):
         """create a decoder object to support decoding can bus messages
@@ -49,10 +311,16 @@ class RVC_Decoder(object):
         """
         self.Logger = logging.getLogger(__name__)
         self.spec = {}
+        self._dgn_decoders = {}  # spec key -> _DgnDecoder
+        self._header_cache = {}  # arbitration id -> _FrameHeader
+        self._projection = None  # DGN name -> fields to decode.  None is full decode
+        self.unknown_dgns = UnknownDgnTracker()
 
     def load_rvc_spec(self, filepath: PathLike) -> None:
         """load the rvc specification yaml file so that messages can be decoded"""
 
+        import ruyaml as YAML  # only needed to load the spec
+
         self.Logger.info(f"Loading RVC Spec file {filepath}")
         with open(filepath, "r") as specfile:
             try:
@@ -61,89 +329,227 @@ class RVC_Decoder(object):
             except YAML.YAMLError as err:
                 self.Logger.error("Yaml Load Error.\n" + err)
                 raise (err)
-
-    def rvc_decode(self, can_arbitration_id: int, data: str) -> dict:
-        result = {"arbitration_id": hex(can_arbitration_id), "data": data}
-        result.update(self._can_frame_to_rvc(can_arbitration_id))
-        result["name"] = "UNKNOWN-" + result["dgn"]
-
-        dgn = result["dgn"]
-        if dgn not in self.spec:
-
-            # try just the upper half as a few commands match only upper.
-            # commands like ACK
-            dgn = result["dgn_h"]
-
-            if dgn not in self.spec:
-                self.Logger.warning(f"Failed to find DGN {result['dgn']} in loaded specification")
-                return result
-
-        decoder = self.spec[dgn]
-        result["name"] = decoder["name"]
-        params = []
-        try:
-            # first load parameters from alias if present
-            params.extend(self.spec[decoder["alias"]]["parameters"])
-        except:
-            pass
-
-        try:
-            # extend and override params from this entry
-            params.extend(decoder["parameters"])
-        except:
-            pass
-
-        param_count = 0
-        for param in params:
-
-            # Get bytes based on byte param and convert into integer
-            try:
-                mybytes = self._get_bytes(data, param["byte"])
-                myvalue = int(mybytes, 16)  # Get the decimal value of the hex bytes
-            except:
-                # If you get here, it's because the params had more bytes than the data packet.
-                # Thus, skip the rest of the processing
-                self.Logger.error(
-                    f"Invalid decoding {result.get('name')} param: {param.get('name')} data: {data}"
-                )
-                continue
-
-            # Get bits if needed for param
+        self._compile_spec()
+
+    def _compile_spec(self) -> None:
+        """ generate the record type and parameter decoders for every DGN in the spec"""
+        self._dgn_decoders = {}
+        self._header_cache = {}
+        for key, entry in self.spec.items():
+            if not isinstance(entry, dict):
+                continue  # API_VERSION
+            params = []
             try:
-                myvalue = self._get_bits(myvalue, param["bit"])
-                if param["type"][:4] == "uint":
-                    myvalue = int(myvalue, 2)  # convert binary back to int
+                # first load parameters from alias if present
+                params.extend(self.spec[entry["alias"]]["parameters"])
             except:
                 pass
 
-            # convert if type/unit defined
             try:
-                myvalue = self._convert_unit(myvalue, param["unit"], param["type"])
+                # extend and override params from this entry
+                params.extend(entry["parameters"])
             except:
                 pass
 
-            result[param["name"]] = myvalue
+            self._dgn_decoders[key] = self._make_dgn_decoder(key, entry["name"], params)
+        self.set_field_projection(self._projection)
 
-            try:
-                mydef = "undefined"
-                mydef = param["values"][int(myvalue)]
-                # int(myvalue) is a hack because the spec yaml interprets binary bits
-                # as integers instead of binary strings.
-                result[param["name"] + " definition"] = mydef
+    def set_field_projection(self, fields_by_name: Optional[dict]) -> None:
+        """ Only decode the fields consumers need.
 
-            except:
-                pass
+        fields_by_name is a dictionary of DGN name to an iterable of field names.  A
+        field can be the parameter name or its *_definition.  A DGN with a value of None
+        is fully decoded.  DGNs not in the dictionary only get the header fields
+        (name, dgn, source_id, etc).  Pass None to fully decode every DGN.
 
-            param_count += 1
+        The projection applies to rvc_decode unless it is called with full=True.
+        """
+        self._projection = fields_by_name
+        known_names = set()
+        for d in self._dgn_decoders.values():
+            known_names.add(d.name)
+            if fields_by_name is None or (d.name in fields_by_name and fields_by_name[d.name] is None):
+                d.projected_params = None
+                continue
+            fields = set(fields_by_name.get(d.name, ()))
+            d.projected_params = tuple(p for p in d.params if p.key in fields or (p.key + "_definition") in fields)
+
+        if fields_by_name is not None:
+            for name in fields_by_name.keys():
+                if name not in known_names:
+                    self.Logger.warning(f"Field projection for DGN {name} that is not in loaded specification")
+
+    def _make_dgn_decoder(self, key: str, name: str, params: list) -> _DgnDecoder:
+        keys = list(RVC_Message._keys)
+        key_to_attr = dict(keys)
+        attrs = set(key_to_attr.values()) | set(dir(RVC_Message))
+        definitions = {}
+        slots = []
+        compiled = []
 
-        if param_count == 0:
-            result["DECODER PENDING"] = 1
+        for param in params:
+            p = self._compile_param(key, param)
+            if p is None:
+                continue
+            pkey = self._parameterize_string(param["name"])
+            p.key = pkey
+            if pkey in key_to_attr:
+                p.attr = key_to_attr[pkey]
+                if pkey in _HEADER_KEYS and p.attr not in slots:
+                    # parameter overrides a header field (DC_LOAD_STATUS has a priority)
+                    slots.append(p.attr)
+            else:
+                p.attr = self._make_attribute_name(pkey, attrs)
+                attrs.add(p.attr)
+                slots.append(p.attr)
+                keys.append((pkey, p.attr))
+                key_to_attr[pkey] = p.attr
+            compiled.append(p)
+
+            # values are looked up on access.  Last definition of a parameter wins
+            dkey = pkey + "_definition"
+            if "values" in param:
+                if dkey not in key_to_attr:
+                    dattr = self._make_attribute_name(dkey, attrs)
+                    attrs.add(dattr)
+                    keys.append((dkey, dattr))
+                    key_to_attr[dkey] = dattr
+                definitions[key_to_attr[dkey]] = (p.attr, param["values"])
+            elif dkey in key_to_attr:
+                definitions.pop(key_to_attr[dkey], None)
+
+        keys.append(("decoder_pending", "decoder_pending"))
+        key_to_attr["decoder_pending"] = "decoder_pending"
+
+        record_class = type("RVC_" + re.sub(r"\W", "_", name), (RVC_Message,), {
+            "__slots__": tuple(slots),
+            "_keys": tuple(keys),
+            "_key_to_attr": key_to_attr,
+            "_definitions": definitions,
+        })
+
+        d = _DgnDecoder()
+        d.name = name
+        d.record_class = record_class
+        d.params = tuple(compiled)
+        d.projected_params = None
+        d.Logger = self.Logger
+        return d
+
+    def get_instanced_dgns(self) -> set:
+        """ DGNs with an instance in byte 0.  These support an all instance (0xFF) request.
+        Only real DGN keys.  Not the templates (Z0000...) other entries alias """
+        return {k for (k, d) in self._dgn_decoders.items()
+                if RVC_Decoder._DGN_KEY.fullmatch(k) is not None and any(p.key == "instance" and p.slices == ((0, 2),) and p.bits is None for p in d.params)}
+
+    def get_dgn_name(self, dgn: str) -> Optional[str]:
+        """ name of a DGN (hex string) in the loaded specification or None """
+        decoder = self._dgn_decoders.get(dgn, self._dgn_decoders.get(dgn[:3]))
+        return decoder.name if decoder is not None else None
+
+    def get_unknown_dgn_counts(self) -> dict:
+        """ return dictionary of DGN (hex string) to count of frames received that
+        are not in the loaded specification.  Useful to discover devices on the bus."""
+        return self.unknown_dgns.get_counts()
+
+    def _make_attribute_name(self, key: str, used: set) -> str:
+        """ make a valid python identifier for key that isn't already used"""
+        attr = re.sub(r"\W", "_", key)
+        if keyword.iskeyword(attr) or not attr.isidentifier():
+            attr = "_" + attr
+        candidate = attr
+        i = 1
+        while candidate in used:
+            candidate = f"{attr}_{i}"
+            i += 1
+        return candidate
+
+    def _compile_param(self, key: str, param: dict) -> _ParamDecoder:
+        """ precompute the byte and bit ranges of a param.  Returns None if invalid"""
+        p = _ParamDecoder()
+        p.name = param.get("name")
+        try:
+            byte_range = param["byte"]
+            if isinstance(byte_range, str) and "-" in byte_range:
+                (start, _, end) = byte_range.partition("-")
+                start = int(start)
+                end = int(end)
+                if start < 0 or start > 7 or end < 0 or end > 7 or end <= start:
+                    raise Exception(f"Invalid byte_range {byte_range}")
+                # reverse order of bytes
+                p.slices = tuple((i, i + 2) for i in range(end * 2, (start - 1) * 2, -2))
+            else:
+                start = int(byte_range)
+                if start < 0 or start > 7:
+                    raise Exception(f"Invalid byte_range {byte_range}")
+                p.slices = ((start * 2, (start + 1) * 2),)
+        except Exception as e:
+            self.Logger.error(f"Invalid spec {key} param: {p.name}. {e}")
+            return None
+
+        p.bits = None
+        try:
+            bit_range = param["bit"]
+            if isinstance(bit_range, str) and "-" in bit_range:
+                (start, _, end) = bit_range.partition("-")
+                start = int(start)
+                end = int(end)
+                if start < 0 or start > 7 or end < 0 or end > 7 or end <= start:
+                    raise Exception(f"Invalid bit_range {bit_range}")
+                p.bits = (start, end)
+            else:
+                start = int(bit_range)
+                if start < 0 or start > 7:
+                    raise Exception(f"Invalid bit_range {bit_range}")
+                p.bits = (start, start)
+        except KeyError:
+            pass
+        except Exception as e:
+            self.Logger.error(f"Invalid spec {key} param: {p.name}. {e}")
+
+        p.type = param.get("type")
+        p.is_uint = p.type is not None and p.type[:4] == "uint"
+        p.unit = param.get("unit")
+        p.convert = self._convert_unit
+        return p
 
-        presult = {}
-        for key in result.keys():
-            presult[self._parameterize_string(key)] = result[key]
+    def rvc_decode(self, can_arbitration_id: int, data: str, full: bool = False) -> RVC_Message:
+        """ decode a can frame.  data is the payload as a hex string.
+
+        If a field projection is set only those fields are decoded unless full is True
+        """
+        header = self._header_cache.get(can_arbitration_id)
+        if header is None:
+            header = self._make_frame_header(can_arbitration_id)
+
+        # DGNs not in the spec have a counter as the decoder
+        return header.decoder.decode(header, data, full)
+
+    def _make_frame_header(self, can_arbitration_id: int) -> _FrameHeader:
+        """ make and cache the header fields for an arbitration id """
+        rvc = self._can_frame_to_rvc(can_arbitration_id)
+        header = _FrameHeader()
+        header.arbitration_id = hex(can_arbitration_id)
+        header.priority = rvc["priority"]
+        header.dgn_h = rvc["dgn_h"]
+        header.dgn_l = rvc["dgn_l"]
+        header.dgn = rvc["dgn"]
+        header.source_id = rvc["source_id"]
+
+        # try just the upper half as a few commands match only upper.
+        # commands like ACK
+        decoder = self._dgn_decoders.get(header.dgn, self._dgn_decoders.get(header.dgn_h))
+        if decoder is None:
+            header.name = "UNKNOWN-" + header.dgn
+            header.decoder = self.unknown_dgns.get(header.dgn)
+        else:
+            header.name = decoder.name
+            header.decoder = decoder
 
-        return presult
+        if len(self._header_cache) >= RVC_Decoder.MAX_CACHED_ARBITRATION_IDS:
+            self._header_cache.clear()
+        self._header_cache[can_arbitration_id] = header
+        return header
 
     def _can_frame_to_rvc(self, arbitration_id: int) -> dict:
         """
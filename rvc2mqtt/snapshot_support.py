@@ -0,0 +1,141 @@
+"""
+State snapshot support for rvc2mqtt
+
+The states reported by devices are saved to a file so they can be published
+right away at the next start instead of showing unknown until every device
+answers.  Restored states are marked stale until the device reports again.
+
+The file is append only json lines.  Each line has the states that changed
+since the last line: {"t": <unix time>, "e": {<entity id>: {<topic>: <value>}}}
+Later lines replace earlier values.  The file is rewritten with one line
+holding every state once it has COMPACT_LINES lines.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import logging
+import os
+import time
+from rvc2mqtt.timer_support import TimerSupport
+
+_NOT_FOUND = object()
+
+
+class StateSnapshot(object):
+    """ Save and restore the device reported states of entities.
+
+    All functions must be called from the main loop.
+    """
+
+    SAVE_INTERVAL = 10.0   # seconds.  Changes are written at most this often
+    COMPACT_LINES = 100    # rewrite the file once it has this many lines
+
+    def __init__(self, path: os.PathLike, entity_list: list, timer_support: TimerSupport,
+                 interval: float = SAVE_INTERVAL):
+        self.Logger = logging.getLogger(__name__)
+        self.path = path
+        self.entity_list = entity_list
+        self.timer_support = timer_support
+        self.interval = interval
+        self._saved = {}   # entity id -> {topic: value} as saved in the file
+        self._lines = 0
+
+    def load(self) -> dict:
+        """ read the snapshot file.  Returns entity id -> {topic: value} """
+        self._saved = {}
+        self._lines = 0
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        for entity_id, states in entry["e"].items():
+                            self._saved.setdefault(entity_id, {}).update(states)
+                    except (ValueError, KeyError, AttributeError):
+                        # a line cut short when the bridge was stopped
+                        self.Logger.warning(f"Ignoring bad line in state snapshot {self.path}")
+                    self._lines += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.Logger.error(f"Failed to read state snapshot {self.path}: {e}")
+        return self._saved
+
+    def restore(self) -> int:
+        """ load the snapshot and publish the saved states of each entity.
+        Returns the number of states restored """
+        saved = self.load()
+        restored = 0
+        for entity in self.entity_list:
+            states = saved.get(entity.id)
+            if states:
+                restored += entity.restore_snapshot(states)
+        self.Logger.info(f"Restored {restored} states from {self.path}")
+        return restored
+
+    def start(self) -> None:
+        """ start saving changes """
+        self.timer_support.call_later(self.interval, self._tick)
+
+    def _tick(self) -> None:
+        self.timer_support.call_later(self.interval, self._tick)
+        self.save()
+
+    def save(self) -> bool:
+        """ write states that changed since the last save.  Returns True if written """
+        changes = {}
+        for entity in self.entity_list:
+            saved = self._saved.get(entity.id, {})
+            delta = {t: v for t, v in entity.get_snapshot().items() if saved.get(t, _NOT_FOUND) != v}
+            if len(delta) > 0:
+                changes[entity.id] = delta
+        if len(changes) == 0:
+            return False
+
+        # only count the changes as saved once they are written.  Else a failed
+        # write would keep them out of every later save
+        saved = {entity_id: dict(states) for entity_id, states in self._saved.items()}
+        for entity_id, delta in changes.items():
+            saved.setdefault(entity_id, {}).update(delta)
+        try:
+            if self._lines >= StateSnapshot.COMPACT_LINES:
+                self._write_compacted(saved)
+            else:
+                line = self._make_line(changes)
+                with open(self.path, "a") as f:
+                    f.write(line)
+                self._lines += 1
+        except (OSError, TypeError, ValueError) as e:
+            self.Logger.error(f"Failed to write state snapshot {self.path}: {e}")
+            return False
+        self._saved = saved
+        return True
+
+    def close(self) -> None:
+        """ save any changes.  Call at shutdown """
+        self.save()
+
+    def _make_line(self, states: dict) -> str:
+        return json.dumps({"t": round(time.time(), 1), "e": states}, separators=(",", ":")) + "\n"
+
+    def _write_compacted(self, states: dict) -> None:
+        """ replace the file with one line holding every state """
+        tmp_path = str(self.path) + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self._make_line(states))
+        os.replace(tmp_path, self.path)
+        self._lines = 1
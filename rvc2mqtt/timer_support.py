@@ -0,0 +1,106 @@
+"""
+Timer support for rvc2mqtt
+
+Callbacks are scheduled on a single heap and run from the app main loop
+by calling service().  This keeps all timed work (command coalescing,
+timeouts, periodic reports) on the main thread without a thread or
+threading.Timer per use.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+
+class TimerHandle(object):
+    """ Returned when a callback is scheduled.  Use cancel() to stop it from running """
+    __slots__ = ("when", "func", "args", "cancelled")
+
+    def __init__(self, when: float, func: Callable, args: tuple):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class TimerSupport(object):
+    """ Heap of timed callbacks run from the main loop.
+
+    Scheduling is thread safe.  Callbacks run on the thread that calls service().
+    Cancelled callbacks stay in the heap until their time and are then dropped.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.Logger = logging.getLogger(__name__)
+        self.clock = clock
+        self._heap = []
+        self._lock = threading.Lock()
+        self._seq = itertools.count()  # tie breaker so handles are never compared
+
+    def time(self) -> float:
+        """ current time of the clock used by this timer """
+        return self.clock()
+
+    def call_at(self, when: float, func: Callable, *args) -> TimerHandle:
+        """ run func(*args) at or after time when """
+        handle = TimerHandle(when, func, args)
+        with self._lock:
+            heapq.heappush(self._heap, (when, next(self._seq), handle))
+        return handle
+
+    def call_later(self, delay: float, func: Callable, *args) -> TimerHandle:
+        """ run func(*args) delay seconds from now """
+        return self.call_at(self.clock() + delay, func, *args)
+
+    def next_deadline(self) -> Optional[float]:
+        """ time of the next scheduled callback or None """
+        with self._lock:
+            return self._heap[0][0] if len(self._heap) > 0 else None
+
+    def service(self) -> int:
+        """ run all callbacks that are due.  Returns the number run
+
+        Callbacks scheduled while servicing run on the next call so a callback
+        that reschedules itself can't hold up the main loop.
+        """
+        now = self.clock()
+        ran = 0
+        with self._lock:
+            last_seq = next(self._seq)
+        while True:
+            with self._lock:
+                if len(self._heap) == 0 or self._heap[0][0] > now or self._heap[0][1] > last_seq:
+                    break
+                (_, _, handle) = heapq.heappop(self._heap)
+            if handle.cancelled:
+                continue
+            try:
+                handle.func(*handle.args)
+            except Exception as e:
+                self.Logger.error(f"Exception in timer callback {handle.func}: {e}")
+            ran += 1
+        return ran
+
+    def __len__(self) -> int:
+        return len(self._heap)
@@ -0,0 +1,132 @@
+"""
+Can bus traffic analyzer for rvc2mqtt
+
+To choose filters and tune the bridge it helps to know what is on the bus.
+Every received frame is counted by DGN and source address straight from the
+arbitration id (no decode) along with whether an entity or the ack tracker
+handled it.  A summary with the rate of each DGN/source and the bus load at
+250 kbit/s since the last summary is published periodically.  The bus load
+includes the frames sent by the bridge as those are not received back.
+
+Memory is fixed.  At most MAX_ENTRIES DGN/source pairs are counted.  Frames
+from any more are counted under OTHER.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+from typing import Callable, Optional
+from rvc2mqtt.tx_support import TxScheduler
+
+
+class _TrafficEntry(object):
+    """ Counters for one DGN and source address """
+    __slots__ = ("count", "handled", "bits", "reported")
+
+    def __init__(self):
+        self.count = 0      # frames received
+        self.handled = 0    # frames handled by an entity or the ack tracker
+        self.bits = 0       # estimated bits on the bus
+        self.reported = 0   # count at the last summary
+
+
+class BusTrafficAnalyzer(object):
+    """ Count received frames per (DGN, source address).
+
+    frame_received() is O(1).  All functions must be called from the main loop.
+    """
+
+    MAX_ENTRIES: int = 512
+    OTHER: tuple = (-1, -1)  # entry used once MAX_ENTRIES is reached
+
+    def __init__(self, dgn_name: Callable[[str], Optional[str]] = lambda dgn: None,
+                 bitrate: int = TxScheduler.BUS_BITRATE, clock: Callable[[], float] = time.monotonic,
+                 tx_bits: Callable[[], int] = lambda: 0):
+        """ dgn_name: returns the name of a DGN hex string for summaries
+        tx_bits: returns the total bits sent by the bridge (TxScheduler.bits_sent) """
+        self.dgn_name = dgn_name
+        self.tx_bits = tx_bits
+        self.bitrate = bitrate
+        self.clock = clock
+        self._entries = {}   # (dgn, source address) -> _TrafficEntry
+        self._frame_bits = [TxScheduler.frame_bits(n) for n in range(9)]
+        self._frames = 0
+        self._bits = 0
+        self._last_frames = 0
+        self._last_bits = 0
+        self._last_tx_bits = tx_bits()
+        self._last_summary = clock()
+
+    def frame_received(self, arbitration_id: int, data_length: int, handled: bool) -> None:
+        """ count a received frame """
+        key = ((arbitration_id >> 8) & 0x1FFFF, arbitration_id & 0xFF)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._add_entry(key)
+        bits = self._frame_bits[min(data_length, 8)]
+        entry.count += 1
+        entry.bits += bits
+        if handled:
+            entry.handled += 1
+        self._frames += 1
+        self._bits += bits
+
+    def _add_entry(self, key: tuple) -> _TrafficEntry:
+        if len(self._entries) >= BusTrafficAnalyzer.MAX_ENTRIES:
+            key = BusTrafficAnalyzer.OTHER
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+        entry = _TrafficEntry()
+        self._entries[key] = entry
+        return entry
+
+    def get_summary(self) -> dict:
+        """ rates and bus load since the last summary suitable for json.
+        Starts a new summary interval """
+        now = self.clock()
+        interval = max(now - self._last_summary, 1e-6)
+        frames = self._frames - self._last_frames
+        bits = self._bits - self._last_bits
+        tx_bits_total = self.tx_bits()
+        tx_bits = tx_bits_total - self._last_tx_bits
+
+        dgns = {}
+        for (dgn, source), entry in sorted(self._entries.items(), key=lambda i: i[1].count - i[1].reported, reverse=True):
+            if (dgn, source) == BusTrafficAnalyzer.OTHER:
+                key = "OTHER"
+                name = None
+            else:
+                dgn_hex = f"{dgn:05X}"
+                key = f"{dgn_hex}/{source:02X}"
+                name = self.dgn_name(dgn_hex)
+            dgns[key] = {"name": name,
+                         "rate": round((entry.count - entry.reported) / interval, 2),
+                         "count": entry.count,
+                         "handled": entry.handled}
+            entry.reported = entry.count
+
+        summary = {"interval_s": round(interval, 1),
+                   "frames": frames,
+                   "frames_per_s": round(frames / interval, 2),
+                   "bus_load_pct": round(100.0 * (bits + tx_bits) / (self.bitrate * interval), 2),
+                   "tx_load_pct": round(100.0 * tx_bits / (self.bitrate * interval), 2),
+                   "dgns": dgns}
+        self._last_summary = now
+        self._last_tx_bits = tx_bits_total
+        self._last_frames = self._frames
+        self._last_bits = self._bits
+        return summary
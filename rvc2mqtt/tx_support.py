@@ -0,0 +1,123 @@
+"""
+Transmit scheduling for rvc2mqtt
+
+Messages waiting to go on the canbus are ordered by traffic class and then
+by the RV-C priority bits of the arbitration id.  The bridge is limited to a
+share of the bus bandwidth using a token bucket so it can't saturate the bus.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+
+class TxScheduler(object):
+    """ Thread safe priority queue of rvc messages (with arbitration_id) to send.
+
+    The app puts messages and the canbus thread takes them with get_next().
+    A message dictionary can set "tx_class" to one of the TX_CLASS values.
+    The default is TX_CLASS_USER.
+    """
+
+    # traffic classes.  Lower values are sent first
+    TX_CLASS_USER = 0        # commands from a user
+    TX_CLASS_REFRESH = 1     # automated status refresh
+    TX_CLASS_DISCOVERY = 2   # startup discovery requests
+    TX_CLASS_NAMES = {TX_CLASS_USER: "user", TX_CLASS_REFRESH: "refresh", TX_CLASS_DISCOVERY: "discovery"}
+
+    BUS_BITRATE = 250000        # RV-C bus speed in bits per second
+    FRAME_OVERHEAD_BITS = 67    # extended frame bits other than data
+    BIT_STUFFING_FACTOR = 1.2   # worst case is ~1.25.  Typical is less
+    BURST_FRAMES = 8            # frames that can be sent back to back when the bridge has been quiet
+
+    def __init__(self, max_bus_share: float = 0.3, bitrate: int = BUS_BITRATE,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        max_bus_share - fraction (0 - 1] of the bus bandwidth the bridge may use
+        """
+        self.Logger = logging.getLogger(__name__)
+        self.clock = clock
+        self.bits_per_second = bitrate * max_bus_share
+        self.bucket_size = TxScheduler.frame_bits(8) * TxScheduler.BURST_FRAMES
+        self._tokens = self.bucket_size
+        self._last_refill = clock()
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.sent_counts = {name: 0 for name in TxScheduler.TX_CLASS_NAMES.values()}
+        self.bits_sent = 0
+
+    @staticmethod
+    def frame_bits(data_length: int) -> int:
+        """ estimated bits on the bus for an extended frame with data_length bytes """
+        return round((TxScheduler.FRAME_OVERHEAD_BITS + (8 * data_length)) * TxScheduler.BIT_STUFFING_FACTOR)
+
+    @staticmethod
+    def can_priority(arbitration_id: int) -> int:
+        """ RV-C priority bits (0 is highest) """
+        return (arbitration_id >> 26) & 0x7
+
+    def put(self, msg_dict: dict) -> None:
+        tx_class = msg_dict.get("tx_class", TxScheduler.TX_CLASS_USER)
+        key = (tx_class, TxScheduler.can_priority(msg_dict["arbitration_id"]), next(self._seq))
+        with self._lock:
+            heapq.heappush(self._heap, (key, msg_dict))
+
+    def empty(self) -> bool:
+        return len(self._heap) == 0
+
+    def qsize(self) -> int:
+        return len(self._heap)
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.bucket_size, self._tokens + (now - self._last_refill) * self.bits_per_second)
+        self._last_refill = now
+
+    def get_next(self) -> Optional[dict]:
+        """ Return the next message to send or None if nothing can be sent now """
+        with self._lock:
+            if len(self._heap) == 0:
+                return None
+            self._refill(self.clock())
+            (key, msg_dict) = self._heap[0]
+            bits = TxScheduler.frame_bits(len(msg_dict["data"]))
+            if self._tokens < bits:
+                return None
+            heapq.heappop(self._heap)
+            self._tokens -= bits
+            self.bits_sent += bits
+            self.sent_counts[TxScheduler.TX_CLASS_NAMES.get(key[0], "user")] += 1
+            return msg_dict
+
+    def get_wait_time(self, max_wait: float) -> float:
+        """ Seconds until get_next() could return a message.  max_wait if the queue is empty """
+        with self._lock:
+            if len(self._heap) == 0:
+                return max_wait
+            self._refill(self.clock())
+            bits = TxScheduler.frame_bits(len(self._heap[0][1]["data"]))
+            if self._tokens >= bits:
+                return 0
+            return min(max_wait, (bits - self._tokens) / self.bits_per_second)
+
+    def get_stats(self) -> dict:
+        """ counters suitable for json """
+        return {"queued": len(self._heap), "sent": dict(self.sent_counts), "bits_sent": self.bits_sent}
@@ -0,0 +1,95 @@
+"""
+Main loop stall watchdog for rvc2mqtt
+
+The main loop calls beat() every pass.  A thread checks how long it has been
+since the last beat.  When it is longer than the threshold the main thread is
+stuck (slow publish, blocking plugin, too much logging) and received frames are
+backing up.  The stack of the main thread is captured with sys._current_frames
+and reported with the queue depths so the hot spot can be found without a
+debugger.  Only one report is made per stall.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+
+class LoopWatchdog(threading.Thread):
+    """ Thread that reports when the watched thread stops calling beat() """
+
+    CHECK_INTERVAL = 0.25   # seconds between checks
+
+    def __init__(self, threshold: float, report: Callable[[dict], None],
+                 queue_depths: Callable[[], dict] = dict,
+                 clock: Callable[[], float] = time.monotonic,
+                 thread_id: Optional[int] = None):
+        """ threshold: seconds without a beat before it is a stall
+        report: called from the watchdog thread with the stall report
+        queue_depths: returns a dictionary of queue name -> depth
+        thread_id: thread to watch.  Default is the thread creating the watchdog """
+        threading.Thread.__init__(self, name="loop_watchdog", daemon=True)
+        # A flag to notify the thread that it should finish up and exit
+        self.kill_received = False
+        self.Logger = logging.getLogger(__name__)
+        self.threshold = threshold
+        self.report = report
+        self.queue_depths = queue_depths
+        self.clock = clock
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self._last_beat = clock()
+        self._stalled = False
+        self._stalls = 0
+        self._max_latency = 0.0
+
+    def beat(self) -> None:
+        """ called by the watched thread every pass of its loop.  Must be cheap """
+        self._last_beat = self.clock()
+
+    def check(self) -> Optional[dict]:
+        """ called from the watchdog thread.  Returns the report if a new stall was found """
+        latency = self.clock() - self._last_beat
+        self._max_latency = max(self._max_latency, latency)
+        if latency < self.threshold:
+            self._stalled = False
+            return None
+        if self._stalled:
+            return None   # already reported this stall
+
+        self._stalled = True
+        self._stalls += 1
+        frame = sys._current_frames().get(self.thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        report = {"stalled_s": round(latency, 3), "queues": self.queue_depths(), "stack": stack}
+        self.Logger.warning(f"Main loop stalled for {latency:.3f}s.  Queues: {report['queues']}\n{stack}")
+        try:
+            self.report(report)
+        except Exception as e:
+            self.Logger.error(f"Exception reporting main loop stall: {e}")
+        return report
+
+    def run(self):
+        while not self.kill_received:
+            time.sleep(LoopWatchdog.CHECK_INTERVAL)
+            self.check()
+
+    def get_stats(self) -> dict:
+        """ return the stall count and the longest time between beats seen by the checks """
+        return {"stalls": self._stalls, "max_heartbeat_ms": round(self._max_latency * 1000, 1)}
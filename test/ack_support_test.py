@@ -0,0 +1,168 @@
+"""
+Unit tests for the command acknowledgment tracker
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+import unittest
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.ack_support import CommandAckTracker
+from rvc2mqtt.timer_support import TimerSupport
+from rvc2mqtt.rvc import RVC_Decoder
+
+
+class Test_CommandAckTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 50.0
+        self.timer = TimerSupport(lambda: self.now)
+        self.resent = []
+        self.tracker = CommandAckTracker(self.timer, self.resent.append, timeout=1.0, retries=2, backoff=2.0)
+        self.decoder = RVC_Decoder()
+        self.decoder.load_rvc_spec(os.path.join(os.path.dirname(__file__), "..", "rvc2mqtt", "rvc-spec.yml"))
+        self.decoder.set_field_projection(CommandAckTracker.RVC_DECODE_FIELDS)
+
+    def _ack(self, code: int, instance: int, dest: int = 0x82, dgn: int = 0x1FFBC):
+        data = bytes([code, instance, 0xFF, 0xFF, dest]) + dgn.to_bytes(3, "little")
+        return self.decoder.rvc_decode(0x18E80044 | (dest << 8), data.hex().upper())
+
+    def _light_cmd(self, instance: int):
+        return {"dgn": "1FFBC", "data": bytearray([instance, 0, 250, 0, 1, 0xFF, 0, 0])}
+
+    def _advance(self, seconds: float):
+        self.now += seconds
+        self.timer.service()
+
+    def test_untracked_command(self):
+        self.tracker.command_sent({"dgn": "EAFF", "data": bytearray(8)})
+        self.assertEqual(self.tracker.get_in_flight_count(), 0)
+
+    def test_ack(self):
+        self.tracker.command_sent(self._light_cmd(3))
+        self.assertEqual(self.tracker.get_in_flight_count(), 1)
+        self.now += 0.02
+        # wrong instance and ack for a different node are ignored
+        self.assertFalse(self.tracker.process_rvc_msg(self._ack(0, 4)))
+        self.assertFalse(self.tracker.process_rvc_msg(self._ack(0, 3, dest=0x44)))
+        self.assertTrue(self.tracker.process_rvc_msg(self._ack(0, 3)))
+        self.assertEqual(self.tracker.get_in_flight_count(), 0)
+
+        stats = self.tracker.get_stats()
+        self.assertEqual(stats["acked"], 1)
+        self.assertEqual(stats["latency"]["DC_LOAD_COMMAND"]["count"], 1)
+        self.assertAlmostEqual(stats["latency"]["DC_LOAD_COMMAND"]["max_ms"], 20.0)
+
+        # nothing resent after the ack
+        self._advance(10)
+        self.assertEqual(self.resent, [])
+
+    def test_ack_callback(self):
+        results = []
+        acked = self._light_cmd(3)
+        acked["ack_callback"] = results.append
+        self.tracker.command_sent(acked)
+        self.tracker.process_rvc_msg(self._ack(0, 3))
+
+        timed_out = self._light_cmd(4)
+        timed_out["ack_callback"] = results.append
+        self.tracker.command_sent(timed_out)
+        for _ in range(3):
+            self._advance(10)
+            self.tracker.command_sent(timed_out)
+        self.assertEqual(results, [True, False])
+
+    def test_nak(self):
+        self.tracker.command_sent(self._light_cmd(3))
+        with self.assertLogs("rvc2mqtt.ack_support", level="WARNING") as cm:
+            self.assertTrue(self.tracker.process_rvc_msg(self._ack(3, 3)))
+        # reason is decoded with the field projection on
+        self.assertIn("conditions do not allow command to be executed", cm.output[0])
+        self.assertEqual(self.tracker.get_stats()["nacked"], 1)
+        self._advance(10)
+        self.assertEqual(self.resent, [])
+
+    def test_not_an_ack(self):
+        msg = self.decoder.rvc_decode(0x19FFBD44, "0300C80005000000")
+        self.assertFalse(self.tracker.process_rvc_msg(msg))
+
+    def test_retry_with_backoff(self):
+        cmd = self._light_cmd(3)
+        self.tracker.command_sent(cmd)
+        self._advance(0.99)
+        self.assertEqual(self.resent, [])
+        self._advance(0.02)
+        self.assertEqual(self.resent, [cmd])
+
+        # resent message goes out.  Wait is doubled
+        self.tracker.command_sent(cmd)
+        self._advance(1.5)
+        self.assertEqual(len(self.resent), 1)
+        self._advance(0.6)
+        self.assertEqual(len(self.resent), 2)
+
+        # last attempt times out and is dropped
+        self.tracker.command_sent(cmd)
+        self._advance(4.1)
+        self.assertEqual(len(self.resent), 2)
+        stats = self.tracker.get_stats()
+        self.assertEqual(stats["timed_out"], 1)
+        self.assertEqual(stats["resent"], 2)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_no_retries_by_default(self):
+        tracker = CommandAckTracker(self.timer, self.resent.append, timeout=1.0)
+        results = []
+        cmd = self._light_cmd(3)
+        cmd["ack_callback"] = results.append
+        tracker.command_sent(cmd)
+        self._advance(10)
+        # timeout is counted but not resent or reported as a failure
+        self.assertEqual(self.resent, [])
+        self.assertEqual(results, [])
+        self.assertEqual(tracker.get_stats()["timed_out"], 1)
+        self.assertEqual(tracker.get_in_flight_count(), 0)
+
+        # a NAK is still a failure
+        tracker.command_sent(cmd)
+        tracker.process_rvc_msg(self._ack(3, 3))
+        self.assertEqual(results, [False])
+
+    def test_ack_needs_more_time(self):
+        self.tracker.command_sent(self._light_cmd(3))
+        self._advance(0.5)
+        self.assertTrue(self.tracker.process_rvc_msg(self._ack(7, 3)))
+        self._advance(0.9)
+        self.assertEqual(self.resent, [])
+        self.assertTrue(self.tracker.process_rvc_msg(self._ack(0, 3)))
+        self.assertEqual(self.tracker.get_stats()["acked"], 1)
+
+    def test_newer_command_supersedes(self):
+        self.tracker.command_sent(self._light_cmd(3))
+        self._advance(0.5)
+        newer = self._light_cmd(3)
+        self.tracker.command_sent(newer)
+        self._advance(0.6)
+        # first command timer expired but it was replaced
+        self.assertEqual(self.resent, [])
+        self._advance(0.5)
+        self.assertEqual(self.resent, [newer])
+        self.assertEqual(self.tracker.get_stats()["superseded"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
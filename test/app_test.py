@@ -0,0 +1,76 @@
+"""
+Unit tests for the app metrics and shutdown
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+import signal
+import unittest
+from unittest.mock import MagicMock, patch
+import context  # add rvc2mqtt package to the python path using local reference
+import rvc2mqtt.app as app_module
+from rvc2mqtt.app import app
+from rvc2mqtt.rvc import RVC_Decoder
+from rvc2mqtt.timer_support import TimerSupport
+
+rvc_spec_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'rvc2mqtt', 'rvc-spec.yml'))
+
+
+class Test_App_Metrics(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app()
+        self.app.timer_support = TimerSupport(lambda: 0.0)
+        self.app.mqtt_client = MagicMock()
+        self.app.ack_tracker = MagicMock()
+        self.app.dgn_request_scheduler = MagicMock()
+        self.app.txQueue = MagicMock()
+        self.app.traffic_analyzer = MagicMock()
+        self.app.watchdog = None
+        self.app.frame_tracer = None
+        self.app.capture_recorder = None
+        self.app.rvc_decoder = RVC_Decoder()
+        self.app.rvc_decoder.load_rvc_spec(rvc_spec_file_path)
+
+    def _metrics(self) -> dict:
+        return {c.args[0]: c.args[1] for c in self.app.mqtt_client.publish_metrics.call_args_list}
+
+    def test_unknown_dgns_published(self):
+        with self.assertLogs("rvc2mqtt.rvc", level="WARNING"):
+            for _ in range(3):
+                self.app.rvc_decoder.rvc_decode(int("19EF0080", 16), '0011223344556677')
+        self.app._publish_metrics()
+        self.assertEqual(self._metrics()["unknown_dgns"], {"1EF00": 3})
+        # rescheduled
+        self.assertEqual(len(self.app.timer_support), 1)
+
+
+class Test_App_Shutdown(unittest.TestCase):
+
+    def test_signal_only_sets_flag(self):
+        a = app()
+        a.close = MagicMock()
+        with patch.object(app_module, "MyApp", a, create=True):
+            app_module.signal_handler(signal.SIGTERM, None)
+        self.assertTrue(a.stop_requested)
+        a.close.assert_not_called()
+        self.assertFalse(app().stop_requested)
+
+
+if __name__ == '__main__':
+    unittest.main()
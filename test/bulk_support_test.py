@@ -0,0 +1,135 @@
+"""
+Unit tests for bulk (scene) commands
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import unittest
+from unittest.mock import MagicMock
+import json
+import queue
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.bulk_support import BulkCommandSupport
+from rvc2mqtt.ack_support import CommandAckTracker
+from rvc2mqtt.timer_support import TimerSupport
+from rvc2mqtt.entity.light_switch import LightSwitch_DC_LOAD_STATUS as Light
+from rvc2mqtt.entity.tank_warmer import TankWarmer_DC_LOAD_STATUS as TankWarmer
+
+
+class Test_BulkCommandSupport(unittest.TestCase):
+
+    def setUp(self):
+        self.mqtt = MagicMock()
+        self.mqtt.root_topic = "rvc2mqtt/bridge"
+        self.mqtt.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        self.q = queue.Queue()
+        self.lights = [Light({'instance': i, 'instance_name': f"light {i}", 'group': '00000010'}, self.mqtt)
+                       for i in (1, 2, 3)]
+        self.other = Light({'instance': 4, 'instance_name': "light 4"}, self.mqtt)
+        self.warmer = TankWarmer({'instance': 34, 'instance_name': "tank heater"}, self.mqtt)
+        self.entities = self.lights + [self.other, self.warmer]
+        for e in self.entities:
+            e.set_rvc_send_queue(self.q)
+        self.bulk = BulkCommandSupport(self.mqtt, self.entities, self.q)
+
+    def _send(self, commands: dict):
+        self.bulk.process_mqtt_msg(self.bulk.bulk_command_topic, json.dumps(commands))
+        msgs = []
+        while not self.q.empty():
+            msgs.append(self.q.get_nowait())
+        return [(m["dgn"], m["data"].hex().upper()) for m in msgs]
+
+    def test_registered(self):
+        self.mqtt.register.assert_any_call("rvc2mqtt/bridge/bulk/set", self.bulk.process_mqtt_msg)
+
+    def test_per_entity(self):
+        msgs = self._send({self.lights[0].id: "on", self.other.id: "on", self.warmer.id: "off"})
+        self.assertEqual(msgs, [("1FFBC", "0102FA0001FF0000"),
+                                ("1FFBC", "0400FA0001FF0000"),
+                                ("1FFBC", "2200FA0003FF0000")])
+
+    def test_whole_group_merged(self):
+        msgs = self._send({l.id: "off" for l in self.lights})
+        self.assertEqual(msgs, [("1FFBC", "FF02FA0003FF0000")])
+
+    def test_group_not_merged_when_states_differ(self):
+        commands = {l.id: "on" for l in self.lights}
+        commands[self.lights[2].id] = "off"
+        self.assertEqual(len(self._send(commands)), 3)
+
+    def test_unknown_and_invalid_skipped(self):
+        msgs = self._send({"nope": "on", self.other.id: "dim", self.warmer.id: "on"})
+        self.assertEqual(msgs, [("1FFBC", "2200FA0001FF0000")])
+
+    def test_already_in_state(self):
+        self.other.state = "on"
+        self.assertEqual(self._send({self.other.id: "on"}), [])
+
+    def test_invalid_json(self):
+        self.bulk.process_mqtt_msg(self.bulk.bulk_command_topic, "not json")
+        self.bulk.process_mqtt_msg(self.bulk.bulk_command_topic, "[1, 2]")
+        self.assertTrue(self.q.empty())
+
+    def test_group_command_not_tracked(self):
+        msgs = self.bulk.make_rvc_commands({l.id: "on" for l in self.lights})
+        tracker = CommandAckTracker(TimerSupport(lambda: 0.0), MagicMock())
+        tracker.command_sent(msgs[0])
+        self.assertEqual(tracker.get_in_flight_count(), 0)
+
+
+class Test_BulkCommandSupport_Optimistic(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.timer = TimerSupport(lambda: self.now)
+        self.mqtt = MagicMock()
+        self.mqtt.root_topic = "rvc2mqtt/bridge"
+        self.mqtt.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        self.q = queue.Queue()
+        self.lights = [Light({'instance': i, 'instance_name': f"light {i}", 'group': '00000010', 'optimistic': True}, self.mqtt)
+                       for i in (1, 2)]
+        self.warmer = TankWarmer({'instance': 34, 'instance_name': "tank heater", 'optimistic': True}, self.mqtt)
+        for e in self.lights + [self.warmer]:
+            e.set_rvc_send_queue(self.q)
+            e.set_timer_support(self.timer)
+        self.bulk = BulkCommandSupport(self.mqtt, self.lights + [self.warmer], self.q)
+        self.mqtt.publish.reset_mock()
+
+    def _published(self, entity):
+        return [c.args[1] for c in self.mqtt.publish.call_args_list if c.args[0] == entity.status_topic]
+
+    def test_made_not_sent_publishes_nothing(self):
+        msgs = self.bulk.make_rvc_commands({self.lights[0].id: "on", self.lights[1].id: "on", self.warmer.id: "on"})
+        self.assertEqual(len(msgs), 2)
+        self.assertEqual(self.mqtt.publish.call_count, 0)
+        self.assertEqual(len(self.timer), 0)
+        self.assertTrue(all("ack_callback" not in m for m in msgs))
+
+    def test_sent_publishes(self):
+        self.bulk.process_mqtt_msg(self.bulk.bulk_command_topic,
+                                   json.dumps({self.lights[0].id: "on", self.lights[1].id: "on", self.warmer.id: "on"}))
+        self.assertEqual(self._published(self.lights[0]), ["on"])
+        self.assertEqual(self._published(self.lights[1]), ["on"])
+        self.assertEqual(self._published(self.warmer), ["on"])
+        msgs = [self.q.get_nowait() for _ in range(self.q.qsize())]
+        # the group command isn't acknowledged per light.  The warmer command is
+        self.assertEqual(["ack_callback" in m for m in msgs], [False, True])
+        self.assertTrue(all("optimistic_states" not in m for m in msgs))
+
+
+if __name__ == '__main__':
+    unittest.main()
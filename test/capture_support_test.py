@@ -0,0 +1,251 @@
+"""
+Unit tests for the binary can bus capture
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import glob
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.capture_support import CaptureRecorder, CaptureReader, CaptureIndex, RECORD, FILE_MAGIC, FLAG_TX
+from rvc2mqtt.rvc import RVC_Decoder
+from rvc2mqtt.decode import decode_capture
+
+rvc_spec_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'rvc2mqtt', 'rvc-spec.yml'))
+
+WATERHEATER_STATUS = 0x19FFF780
+DC_LOAD_STATUS = 0x19FFBD80
+
+
+def read_records(path: str) -> list:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        content = f.read()
+    assert content[:len(FILE_MAGIC)] == FILE_MAGIC
+    return [RECORD.unpack_from(content, o) for o in range(len(FILE_MAGIC), len(content), RECORD.size)]
+
+
+class Test_CaptureRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.now = 0.0
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _files(self) -> list:
+        return sorted(f for f in glob.glob(os.path.join(self.tmp.name, "capture-*")) if not f.endswith(".idx"))
+
+    def _recorder(self, **kwargs) -> CaptureRecorder:
+        r = CaptureRecorder(self.tmp.name, clock=lambda: self.now, **kwargs)
+        self.addCleanup(r._close_file)
+        return r
+
+    def test_record_size(self):
+        self.assertEqual(RECORD.size, 24)
+
+    def test_records(self):
+        r = self._recorder()
+        r.record(1650000000.25, 0x19FFF780, bytearray(b"\x01\x02\x03\x04\x05\x06\x07\x08"))
+        r.record(1650000000.5, 0x19FFBD82, b"\x01\x02", tx=True)
+        self.assertEqual(r.write_pending(), 2)
+        r._close_file()
+        records = read_records(self._files()[0])
+        self.assertEqual(records[0], (1650000000.25, 0x19FFF780, 8, 0, b"\x01\x02\x03\x04\x05\x06\x07\x08"))
+        self.assertEqual(records[1], (1650000000.5, 0x19FFBD82, 2, FLAG_TX, b"\x01\x02\x00\x00\x00\x00\x00\x00"))
+        self.assertEqual(r.get_stats(), {"frames": 2, "dropped": 0, "write_failed": 0,
+                                         "bytes": 48, "files": 1, "pending": 0})
+
+    def test_rotate_by_size_and_keep(self):
+        r = self._recorder(max_bytes=RECORD.size * 10, keep_files=2)
+        for batch in range(4):
+            for i in range(10):
+                r.record(float(batch * 10 + i), 0x19FFF780, b"\x00" * 8)
+            r.write_pending()
+        r._close_file()
+        files = self._files()
+        self.assertEqual(r.get_stats()["files"], 4)
+        self.assertEqual(len(files), 2)
+        self.assertEqual(read_records(files[-1])[0][0], 30.0)
+
+    def test_rotate_by_time(self):
+        r = self._recorder(max_seconds=60)
+        r.record(1.0, 0x19FFF780, b"\x00")
+        r.write_pending()
+        self.now = 30
+        r.record(2.0, 0x19FFF780, b"\x00")
+        r.write_pending()
+        self.now = 61
+        r.write_pending()  # idle file is closed when due
+        self.assertIsNone(r._file)
+        r.record(3.0, 0x19FFF780, b"\x00")
+        r.write_pending()
+        r._close_file()
+        self.assertEqual([len(read_records(f)) for f in self._files()], [2, 1])
+
+    def test_compressed(self):
+        r = self._recorder(compress=True)
+        for i in range(100):
+            r.record(float(i), 0x19FFF780, b"\x00" * 8)
+        r.write_pending()
+        r._close_file()
+        files = self._files()
+        self.assertTrue(files[0].endswith(".rvccap.gz"))
+        self.assertEqual(len(read_records(files[0])), 100)
+        self.assertLess(os.path.getsize(files[0]), 100 * RECORD.size)
+
+    def test_pending_bounded(self):
+        r = self._recorder()
+        with patch.object(CaptureRecorder, "MAX_PENDING", 5):
+            for i in range(8):
+                r.record(float(i), 0x19FFF780, b"\x00")
+        self.assertEqual(r.get_stats()["dropped"], 3)
+        self.assertEqual(r.write_pending(), 5)
+
+    def test_thread_writes_on_close(self):
+        r = CaptureRecorder(self.tmp.name)
+        r.start()
+        r.record(1.0, 0x19FFF780, b"\x00")
+        r.close()
+        self.assertFalse(r.is_alive())
+        self.assertEqual(len(read_records(self._files()[0])), 1)
+        self.assertTrue(os.path.isfile(self._files()[0] + ".idx"))
+
+    def test_old_index_removed(self):
+        r = self._recorder(max_bytes=RECORD.size, keep_files=1)
+        for i in range(3):
+            r.record(float(i), WATERHEATER_STATUS, b"\x00")
+            r.write_pending()
+        r._close_file()
+        self.assertEqual(len(os.listdir(self.tmp.name)), 2)
+
+
+class Test_CaptureReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _capture(self, compress: bool = False, write_index: bool = True) -> str:
+        """ 10 minutes of a waterheater status every second and a light status every 10 seconds """
+        r = CaptureRecorder(self.tmp.name, max_bytes=1 << 30, max_seconds=1e9, compress=compress)
+        for second in range(600):
+            r.record(1000.0 + second, WATERHEATER_STATUS, bytes([1, 0, 0, 0, 0, 0, 0, 0]))
+            if second % 10 == 0:
+                r.record(1000.5 + second, DC_LOAD_STATUS, bytes([1, 0xFF, 200, 0, 0, 0, 0, 0]), tx=True)
+        r.write_pending()
+        path = r._file_path
+        if not write_index:
+            r._index = None
+        r._close_file()
+        return path
+
+    def test_all_frames(self):
+        with CaptureReader(self._capture()) as reader:
+            self.assertEqual(len(reader), 660)
+            frames = list(reader.frames())
+        self.assertEqual(len(frames), 660)
+        self.assertEqual(frames[1].timestamp, 1000.5)
+        self.assertEqual(frames[1].arbitration_id, DC_LOAD_STATUS)
+        self.assertEqual(frames[1].data, bytes([1, 0xFF, 200, 0, 0, 0, 0, 0]))
+        self.assertTrue(frames[1].tx)
+        self.assertFalse(frames[0].tx)
+
+    def test_query_reads_only_matching_buckets(self):
+        with CaptureReader(self._capture()) as reader:
+            self.assertEqual(len(reader.index.buckets), 11)   # 1000s is in the middle of a minute
+            ranges = list(reader.index.find_records(start=1200.0, end=1259.0))
+            self.assertEqual(sum(len(r) for r in ranges), 66)  # one of 11 buckets is read
+            frames = list(reader.frames(start=1200.0, end=1259.0, dgns=["1FFBD"]))
+        self.assertEqual([f.timestamp for f in frames], [1200.5 + 10 * i for i in range(6)])
+
+    def test_unknown_dgn(self):
+        with CaptureReader(self._capture()) as reader:
+            self.assertEqual(list(reader.index.find_records(dgns=[0x1EF00])), [])
+            self.assertEqual(list(reader.frames(dgns=[0x1EF00])), [])
+
+    def test_index_rebuilt_when_missing(self):
+        path = self._capture(write_index=False)
+        self.assertFalse(os.path.isfile(path + ".idx"))
+        with CaptureReader(path) as reader:
+            self.assertEqual(reader.index.records, 660)
+            self.assertEqual(len(list(reader.frames(dgns=[0x1FFF7], end=1009.0))), 10)
+
+    def test_index_rebuilt_when_file_grew(self):
+        path = self._capture()
+        with open(path, "ab") as f:
+            f.write(RECORD.pack(2000.0, WATERHEATER_STATUS, 1, 0, b"\x01"))
+        with CaptureReader(path) as reader:
+            self.assertEqual(reader.index.records, 661)
+            self.assertEqual(len(list(reader.frames(start=2000.0))), 1)
+
+    def test_compressed(self):
+        with CaptureReader(self._capture(compress=True)) as reader:
+            self.assertEqual(len(list(reader.frames(dgns=["1FFBD"]))), 60)
+
+    def test_not_a_capture(self):
+        path = os.path.join(self.tmp.name, "other.rvccap")
+        with open(path, "wb") as f:
+            f.write(b"not a capture file")
+        with self.assertRaises(ValueError):
+            CaptureReader(path)
+
+    def test_decode(self):
+        decoder = RVC_Decoder()
+        decoder.load_rvc_spec(rvc_spec_file_path)
+        with CaptureReader(self._capture()) as reader:
+            results = list(reader.decode(decoder, dgns=["1FFF7"], end=1001.0))
+        self.assertEqual(len(results), 2)
+        (frame, msg) = results[0]
+        self.assertEqual(frame.timestamp, 1000.0)
+        self.assertEqual(msg["name"], "WATERHEATER_STATUS")
+        self.assertEqual(msg["instance"], 1)
+
+    def test_decoder_tool(self):
+        decoder = RVC_Decoder()
+        decoder.load_rvc_spec(rvc_spec_file_path)
+        output = io.StringIO()
+        with CaptureReader(self._capture()) as reader:
+            self.assertEqual(decode_capture(decoder, reader, output, start=1100.0, end=1110.0, dgns=["1FFBD"]), 0)
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([(m["name"], m["timestamp"], m["tx"]) for m in lines], [("DC_LOAD_STATUS", 1100.5, True)])
+
+
+class Test_CaptureIndex(unittest.TestCase):
+
+    def test_round_trip(self):
+        index = CaptureIndex(10)
+        for (ts, arb) in [(5.0, WATERHEATER_STATUS), (12.0, DC_LOAD_STATUS), (11.5, WATERHEATER_STATUS), (25.0, DC_LOAD_STATUS)]:
+            index.add(ts, arb)
+        self.assertEqual(index.buckets, [[0, 5.0, 5.0], [1, 11.5, 12.0], [3, 25.0, 25.0]])
+        self.assertEqual(index.dgn_buckets, {0x1FFF7: [0, 1], 0x1FFBD: [1, 2]})
+        copy = CaptureIndex.from_dict(index.as_dict())
+        self.assertEqual(copy.as_dict(), index.as_dict())
+        self.assertEqual(list(copy.find_records(start=20.0)), [range(3, 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,6 +20,7 @@ limitations under the License.
 
 import unittest
 from unittest.mock import MagicMock
+import json
 import context  # add rvc2mqtt package to the python path using local reference
 from rvc2mqtt.entity.diagnostic import Diagnostic
 
@@ -32,5 +33,29 @@ class Test_Diagnostic(unittest.TestCase):
         l = Diagnostic({'source_id': 255, 'instance_name': "test Diagnostic Sensor"}, mock)
         self.assertTrue(type(l), Diagnostic)
 
+    def test_json_state(self):
+        mqtt = MagicMock()
+        mqtt.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        mqtt.TOPIC_BASE = "rvc2mqtt"
+        mqtt.client_id = "bridge"
+        mqtt.get_bridge_ha_name.return_value = "bridge"
+        mqtt.bridge_state_topic = "bridge/state"
+        mqtt.make_ha_auto_discovery_config_topic.side_effect = lambda id, component, sub: f"ha/{sub}/config"
+        d = Diagnostic({'source_id': '80', 'instance_name': "test Diagnostic Sensor", 'json_state': True}, mqtt)
+        d.process_rvc_msg({"name": "DM_RV", "source_id": '80', "red_lamp_status": '01', "yellow_lamp_status": '00',
+                           "fmi": 3, "fmi_definition": "voltage high", "operating_status_definition": "on"})
+        self.assertEqual(mqtt.publish.call_count, 1)
+        doc = json.loads(mqtt.publish.call_args.args[1])
+        self.assertEqual(doc["state"], "on")
+        self.assertTrue(doc["fault"])
+        self.assertEqual(doc["fault_attributes"]["fmi"], 3)
+
+        d.initialize()
+        config = json.loads([c.args[1] for c in mqtt.publish.call_args_list
+                             if c.args[0] == "ha/fault_state/config"][0])
+        self.assertEqual(config["state_topic"], d.status_topic)
+        self.assertEqual(config["json_attributes_topic"], d.status_topic)
+        self.assertEqual(config["json_attributes_template"], "{{ value_json.fault_attributes | tojson }}")
+
 if __name__ == '__main__':
     unittest.main()
@@ -18,25 +18,122 @@ limitations under the License.
 
 """
 
+import os
 import unittest
+from unittest.mock import MagicMock, patch
 import context  # add rvc2mqtt package to the python path using local reference
-import rvc2mqtt.entity
+from rvc2mqtt.entity import EntityPluginBaseClass
+from rvc2mqtt.entity_factory_support import entity_factory, resolve_entity_links, EntityFactoryRegistry, collect_rvc_decode_fields
+from rvc2mqtt.plugin_support import PluginSupport
+from rvc2mqtt.rvc import RVC_Decoder
+
+rvc_spec_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'rvc2mqtt', 'rvc-spec.yml'))
+plugin_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'rvc2mqtt', 'entity'))
+
+
+class Light(EntityPluginBaseClass):
+    FACTORY_MATCH_ATTRIBUTES = {"name": "DC_LOAD_STATUS", "type": "light_switch"}
+
+    def __init__(self, data: dict, mqtt_support):
+        self.id = "light-" + str(data["instance"])
+        super().__init__(data, mqtt_support)
+        self.links = []
+
+    def add_entity_link(self, obj):
+        self.links.append(obj)
+
+
+class Warmer(Light):
+    FACTORY_MATCH_ATTRIBUTES = {"name": "DC_LOAD_STATUS", "type": "tank_warmer"}
+
+
+class Pump(Light):
+    FACTORY_MATCH_ATTRIBUTES = {"type": "water_pump"}
+
 
 class Test_Entity(unittest.TestCase):
 
-    def test_factory_success(self):
-        pass
+    def _make_registry(self):
+        registry = EntityFactoryRegistry()
+        for c in [Light, Warmer, Pump]:
+            registry.register(c.FACTORY_MATCH_ATTRIBUTES, c)
+        return registry
 
-        # d = {"type": "Light"}
-        # obj = rvc2mqtt.entity.entity_factory(d)
-        # self.assertIsNotNone(obj)
-        # self.assertTrue(type(obj), rvc2mqtt.entity.Light)
+    def test_factory_success(self):
+        registry = self._make_registry()
+        obj = entity_factory({"name": "DC_LOAD_STATUS", "type": "tank_warmer", "instance": 2}, MagicMock(), registry)
+        self.assertIsInstance(obj, Warmer)
+        obj = entity_factory({"type": "water_pump", "instance": 1}, MagicMock(), registry)
+        self.assertIsInstance(obj, Pump)
 
     def test_factory_invalid(self):
-        pass
-        # d = {"type": "not_here"}
-        # obj = rvc2mqtt.entity.entity_factory(d)
-        # self.assertIsNone(obj)
+        registry = self._make_registry()
+        self.assertIsNone(entity_factory({"type": "not_here"}, MagicMock(), registry))
+        self.assertIsNone(entity_factory({"name": "DC_LOAD_STATUS", "instance": 1}, MagicMock(), registry))
+        self.assertIsNone(entity_factory({"type": ["unhashable"]}, MagicMock(), registry))
+
+    def test_factory_legacy_list(self):
+        fl = [(Light.FACTORY_MATCH_ATTRIBUTES, Light)]
+        obj = entity_factory({"name": "DC_LOAD_STATUS", "type": "light_switch", "instance": 1}, MagicMock(), fl)
+        self.assertIsInstance(obj, Light)
+
+    def test_factory_legacy_list_indexed_once(self):
+        fl = [(Light.FACTORY_MATCH_ATTRIBUTES, Light), (Pump.FACTORY_MATCH_ATTRIBUTES, Pump)]
+        with patch.object(EntityFactoryRegistry, "register", autospec=True,
+                          side_effect=EntityFactoryRegistry.register) as register:
+            for i in range(10):
+                entity_factory({"type": "water_pump", "instance": i}, MagicMock(), fl)
+            self.assertEqual(register.call_count, 2)
+
+            # list changed.  Indexed again
+            fl.append((Warmer.FACTORY_MATCH_ATTRIBUTES, Warmer))
+            obj = entity_factory({"name": "DC_LOAD_STATUS", "type": "tank_warmer", "instance": 2}, MagicMock(), fl)
+            self.assertIsInstance(obj, Warmer)
+            self.assertEqual(register.call_count, 5)
+
+    def test_factory_first_registered_wins(self):
+        registry = EntityFactoryRegistry()
+        registry.append(({"type": "water_pump"}, Pump))
+        registry.append(({"type": "water_pump", "name": "WATER_PUMP_STATUS"}, Light))
+        registry.append(({"type": "water_pump"}, Warmer))
+        self.assertEqual(len(registry), 2)
+        self.assertIs(registry.find({"type": "water_pump", "name": "WATER_PUMP_STATUS"}), Pump)
+
+    def test_links_resolved_in_any_order(self):
+        mock = MagicMock()
+        a = Light({"instance": 1, "entity_links": ["temp"]}, mock)
+        b = Light({"instance": 2, "link_id": "temp"}, mock)
+        c = Light({"instance": 3, "entity_links": ["missing"]}, mock)
+        resolve_entity_links([a, b, c])
+        self.assertEqual(a.links, [b])
+        self.assertEqual(c.links, [])
+
+    def test_collect_decode_fields(self):
+        mock = MagicMock()
+        a = Light({"instance": 1}, mock)
+        self.assertIsNone(collect_rvc_decode_fields([a]))
+
+        a.RVC_DECODE_FIELDS = {"DC_LOAD_STATUS": ("instance",)}
+        b = Light({"instance": 2}, mock)
+        b.RVC_DECODE_FIELDS = {"DC_LOAD_STATUS": ("operating_status",), "DM_RV": None}
+        c = Light({"instance": 3}, mock)
+        c.RVC_DECODE_FIELDS = {"DM_RV": ("fmi",)}
+        self.assertEqual(collect_rvc_decode_fields([a, b, c]),
+                         {"DC_LOAD_STATUS": {"instance", "operating_status"}, "DM_RV": None})
+
+    def test_builtin_decode_fields_are_in_spec(self):
+        rvc = RVC_Decoder()
+        rvc.load_rvc_spec(rvc_spec_file_path)
+        names = {d.name: d for d in rvc._dgn_decoders.values()}
+        registry = []
+        PluginSupport(plugin_path, []).register_with_factory_the_entity_plugins(registry)
+        self.assertGreater(len(registry), 0)
+        for (_, entity_class) in registry:
+            self.assertIsNotNone(entity_class.RVC_DECODE_FIELDS, entity_class.__name__)
+            for name, fields in entity_class.RVC_DECODE_FIELDS.items():
+                self.assertIn(name, names)
+                for field in fields or ():
+                    self.assertIn(field, names[name].record_class._key_to_attr, f"{entity_class.__name__} {name}")
 
 if __name__ == '__main__':
     unittest.main()
@@ -18,10 +18,14 @@ limitations under the License.
 
 """
 
+import json
 import unittest
 from unittest.mock import MagicMock
+import queue
 import context  # add rvc2mqtt package to the python path using local reference
 from rvc2mqtt.entity.hvac import HvacClass, FanMode, HvacMode
+from rvc2mqtt.timer_support import TimerSupport
+from rvc2mqtt.entity.temperature import TemperatureSensor_THERMOSTAT_AMBIENT_STATUS as TemperatureSensor
 
 class Test_FanMode(unittest.TestCase):
 
@@ -119,6 +123,91 @@ class Test_HvacClimate(unittest.TestCase):
          '''
         self.assertEqual(l._make_rvc_payload(2, HvacMode.OFF, FanMode.AUTO, 'disabled', 17.75), bytearray.fromhex("0200645824582400"))
 
+    def test_set_point_commands_coalesced(self):
+        mock = MagicMock()
+        mock.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        now = [10.0]
+        timer = TimerSupport(lambda: now[0])
+        q = queue.Queue()
+
+        l = HvacClass({'instance': 2, 'instance_name': "test hvac"}, mock)
+        l.set_rvc_send_queue(q)
+        l.set_timer_support(timer)
+
+        # slider drag
+        for t in (17.0, 17.25, 17.5, 17.75):
+            l.process_mqtt_msg(l.command_set_point_temp_topic, str(t))
+            now[0] += 0.1
+            timer.service()
+        self.assertTrue(q.empty())
+
+        now[0] += HvacClass.COMMAND_COALESCE_WINDOW
+        timer.service()
+        self.assertEqual(q.qsize(), 1)
+        msg = q.get()
+        self.assertEqual(msg["dgn"], "1FEF9")
+        self.assertEqual(msg["data"], l._make_rvc_payload(2, HvacMode.OFF, FanMode.OFF, 'disabled', 17.75))
+
+    def test_mode_and_set_point_merged(self):
+        mock = MagicMock()
+        mock.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        now = [10.0]
+        timer = TimerSupport(lambda: now[0])
+        q = queue.Queue()
+
+        l = HvacClass({'instance': 2, 'instance_name': "test hvac"}, mock)
+        l.set_rvc_send_queue(q)
+        l.set_timer_support(timer)
+
+        l.process_mqtt_msg(l.command_mode_topic, "cool")
+        l.process_mqtt_msg(l.command_fan_mode_topic, "high")
+        l.process_mqtt_msg(l.command_set_point_temp_topic, "20.0")
+        now[0] += HvacClass.COMMAND_COALESCE_WINDOW
+        timer.service()
+        self.assertEqual(q.qsize(), 1)
+        self.assertEqual(q.get()["data"], l._make_rvc_payload(2, HvacMode.COOL, FanMode.HIGH, 'disabled', 20.0))
+
+    def test_coalesce_disabled_from_floorplan(self):
+        mock = MagicMock()
+        mock.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        q = queue.Queue()
+        l = HvacClass({'instance': 2, 'instance_name': "test hvac", 'command_coalesce_window': 0}, mock)
+        l.set_rvc_send_queue(q)
+        l.set_timer_support(TimerSupport())
+        l.process_mqtt_msg(l.command_set_point_temp_topic, "17.0")
+        l.process_mqtt_msg(l.command_set_point_temp_topic, "18.0")
+        self.assertEqual(q.qsize(), 2)
+
+
+class Test_Hvac_Discovery(unittest.TestCase):
+
+    def _discovery(self, json_state: bool) -> tuple:
+        mqtt = MagicMock()
+        mqtt.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        mqtt.make_ha_auto_discovery_config_topic.side_effect = lambda id, component, *sub: f"ha/{component}/{id}"
+        mqtt.get_bridge_ha_name.return_value = "bridge"
+        mqtt.bridge_state_topic = "bridge/state"
+        mqtt.TOPIC_BASE = "rvc2mqtt"
+        mqtt.client_id = "bridge"
+        temperature = TemperatureSensor({'instance': 2, 'instance_name': "test temperature", 'json_state': json_state}, mqtt)
+        hvac = HvacClass({'instance': 2, 'instance_name': "test hvac", 'json_state': json_state}, mqtt)
+        hvac.add_entity_link(temperature)
+        hvac.set_rvc_send_queue(queue.Queue())
+        hvac.initialize()
+        configs = [json.loads(c.args[1]) for c in mqtt.publish.call_args_list if c.args[0].startswith("ha/climate/")]
+        return (configs[0], hvac, temperature)
+
+    def test_current_temperature(self):
+        (config, hvac, temperature) = self._discovery(False)
+        self.assertEqual(config["current_temperature_topic"], temperature.status_topic)
+        self.assertEqual(config["current_temperature_template"], "{{value}}")
+
+    def test_current_temperature_json_state(self):
+        (config, hvac, temperature) = self._discovery(True)
+        self.assertEqual(config["current_temperature_topic"], temperature.status_topic)
+        self.assertEqual(config["current_temperature_template"], "{{ value_json.state }}")
+        self.assertEqual(config["mode_state_topic"], hvac.status_topic)
+        self.assertEqual(config["mode_state_template"], "{{ value_json.mode }}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+"""
+Import time budget for the rvc2mqtt package
+
+Imports run in a fresh interpreter so modules loaded by other tests don't hide the cost.
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+import context  # add rvc2mqtt package to the python path using local reference
+
+PACKAGE_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# heavy dependencies that must only be imported when used
+LAZY_MODULES = ("can", "paho", "ruyaml")
+
+# cumulative import time of rvc2mqtt.app.  With python-can imported eagerly it was ~270ms.
+# Generous so slow CI machines don't fail.  Lower it as imports get faster.
+IMPORT_TIME_BUDGET_MS = 200
+
+
+def run_python(code: str, *options) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *options, "-c", code], cwd=PACKAGE_ROOT,
+                          capture_output=True, text=True, check=True)
+
+
+def loaded_lazy_modules(module: str) -> list:
+    code = f"import sys, {module}; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    out = run_python(code).stdout.strip()
+    return out.split(",") if len(out) > 0 else []
+
+
+def cumulative_import_time_ms(module: str) -> float:
+    """ best of 3 cumulative time from python -X importtime """
+    best = None
+    for _ in range(3):
+        err = run_python(f"import {module}", "-X", "importtime").stderr
+        for line in err.splitlines():
+            parts = [p.strip() for p in line.split("|")]
+            if len(parts) == 3 and parts[2] == module:
+                ms = int(parts[1]) / 1000.0
+                best = ms if best is None else min(best, ms)
+    return best
+
+
+class Test_ImportTime(unittest.TestCase):
+
+    def test_app_doesnt_import_heavy_dependencies(self):
+        self.assertEqual(loaded_lazy_modules("rvc2mqtt.app"), [])
+
+    def test_decoder_tool_doesnt_import_can_or_mqtt(self):
+        self.assertEqual(loaded_lazy_modules("rvc2mqtt.decode"), [])
+
+    def test_entities_dont_import_heavy_dependencies(self):
+        self.assertEqual(loaded_lazy_modules("rvc2mqtt.entity.water_heater"), [])
+
+    def test_app_import_time_budget(self):
+        ms = cumulative_import_time_ms("rvc2mqtt.app")
+        self.assertIsNotNone(ms)
+        self.assertLess(ms, IMPORT_TIME_BUDGET_MS, f"import rvc2mqtt.app took {ms}ms")
+
+
+if __name__ == '__main__':
+    unittest.main()
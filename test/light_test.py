@@ -18,10 +18,13 @@ limitations under the License.
 
 """
 
+import json
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, call
+import queue
 import context  # add rvc2mqtt package to the python path using local reference
 from rvc2mqtt.entity.light_switch import LightSwitch_DC_LOAD_STATUS as Light
+from rvc2mqtt.timer_support import TimerSupport
 
 class Test_Light(unittest.TestCase):
 
@@ -32,5 +35,171 @@ class Test_Light(unittest.TestCase):
         l = Light({'instance': 1, 'instance_name': "test light"}, mock)
         self.assertTrue(type(l), Light)
 
+
+class Test_Light_Optimistic(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.timer = TimerSupport(lambda: self.now)
+        self.mqtt = MagicMock()
+        self.mqtt.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        self.q = queue.Queue()
+        self.light = Light({'instance': 1, 'instance_name': "test light", 'optimistic': True}, self.mqtt)
+        self.light.set_rvc_send_queue(self.q)
+        self.light.set_timer_support(self.timer)
+        self._status(0.0)
+        self.mqtt.publish.reset_mock()
+
+    def _status(self, level: float):
+        self.light.process_rvc_msg({"name": "DC_LOAD_STATUS", "instance": 1, "operating_status": level})
+
+    def _published(self):
+        return [c.args[1] for c in self.mqtt.publish.call_args_list if c.args[0] == self.light.status_topic]
+
+    def test_confirmed(self):
+        self.light.process_mqtt_msg(self.light.command_topic, "on")
+        self.assertEqual(self._published(), ["on"])
+        self.assertEqual(self.q.qsize(), 1)
+
+        # status from before the device acted is held back
+        self._status(0.0)
+        self.assertEqual(self._published(), ["on"])
+        self._status(100.0)
+        self.assertEqual(self._published(), ["on", "on"])
+
+        self.now += 10
+        self.timer.service()
+        self.assertEqual(self._published(), ["on", "on"])
+
+    def test_rollback_on_timeout(self):
+        self.light.process_mqtt_msg(self.light.command_topic, "on")
+        self._status(0.0)
+        self.now += Light.OPTIMISTIC_TIMEOUT
+        self.timer.service()
+        self.assertEqual(self._published(), ["on", "off"])
+
+    def test_rollback_on_nak(self):
+        self.light.process_mqtt_msg(self.light.command_topic, "on")
+        self.q.get()["ack_callback"](False)
+        self.assertEqual(self._published(), ["on", "off"])
+
+    def test_not_optimistic_by_default(self):
+        l = Light({'instance': 2, 'instance_name': "test light"}, self.mqtt)
+        l.set_rvc_send_queue(self.q)
+        l.set_timer_support(self.timer)
+        self.mqtt.publish.reset_mock()
+        l.process_mqtt_msg(l.command_topic, "on")
+        self.mqtt.publish.assert_not_called()
+        self.assertNotIn("ack_callback", self.q.get())
+
+
+class Test_Light_Availability(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.timer = TimerSupport(lambda: self.now)
+        self.mqtt = MagicMock()
+        self.mqtt.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        self.mqtt.bridge_state_topic = "bridge/state"
+        self.light = Light({'instance': 1, 'instance_name': "test light", 'availability_timeout': 30}, self.mqtt)
+        self.light.set_timer_support(self.timer)
+
+    def _status(self):
+        self.light.process_rvc_msg({"name": "DC_LOAD_STATUS", "instance": 1, "operating_status": 0.0})
+
+    def _availability(self):
+        return [c.args[1] for c in self.mqtt.publish.call_args_list if c.args[0] == self.light.availability_topic]
+
+    def _advance(self, seconds: float):
+        self.now += seconds
+        self.timer.service()
+
+    def test_online_at_start_then_offline(self):
+        self.assertEqual(self._availability(), ["online"])
+        self._advance(29)
+        self.assertEqual(self._availability(), ["online"])
+        self._advance(1)
+        self.assertEqual(self._availability(), ["online", "offline"])
+        self.assertEqual(len(self.timer), 0)
+
+    def test_status_keeps_online_with_one_timer(self):
+        for _ in range(10):
+            self._advance(20)
+            self._status()
+            self.assertEqual(len(self.timer), 1)
+        self.assertEqual(self._availability(), ["online"])
+        self._advance(30)
+        self.assertEqual(self._availability(), ["online", "offline"])
+
+    def test_back_online_on_status(self):
+        self._advance(30)
+        self._status()
+        self.assertEqual(self._availability(), ["online", "offline", "online"])
+        self._advance(29)
+        self.assertEqual(self._availability()[-1], "online")
+
+    def test_discovery_requires_both(self):
+        info = self.light.get_availability_discovery_info_for_ha()
+        self.assertEqual(info["availability_mode"], "all")
+        self.assertEqual([a["topic"] for a in info["availability"]], ["bridge/state", self.light.availability_topic])
+
+    def test_disabled_by_default(self):
+        timer = TimerSupport(lambda: self.now)
+        l = Light({'instance': 2, 'instance_name': "test light"}, self.mqtt)
+        l.set_timer_support(timer)
+        self.assertEqual(len(timer), 0)
+        self.assertEqual(l.get_availability_discovery_info_for_ha(), {"availability_topic": "bridge/state"})
+
+
+class Test_Light_JsonState(unittest.TestCase):
+
+    def setUp(self):
+        self.mqtt = MagicMock()
+        self.mqtt.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        self.mqtt.bridge_state_topic = "bridge/state"
+        self.mqtt.make_ha_auto_discovery_config_topic.return_value = "ha/config"
+        self.mqtt.get_bridge_ha_name.return_value = "bridge"
+        self.mqtt.TOPIC_BASE = "rvc2mqtt"
+        self.mqtt.client_id = "bridge"
+        self.light = Light({'instance': 1, 'instance_name': "test light", 'json_state': True}, self.mqtt)
+
+    def _status(self, level: float):
+        self.light.process_rvc_msg({"name": "DC_LOAD_STATUS", "instance": 1, "operating_status": level})
+
+    def _state_publishes(self):
+        return [c.args for c in self.mqtt.publish.call_args_list if c.args[0] != "ha/config"]
+
+    def test_status_publishes_document(self):
+        self._status(100.0)
+        publishes = self._state_publishes()
+        self.assertEqual(len(publishes), 1)
+        self.assertEqual(publishes[0][0], self.light.status_topic)
+        self.assertEqual(json.loads(publishes[0][1])["state"], "on")
+
+        # same status again doesn't publish
+        self._status(100.0)
+        self.assertEqual(len(self._state_publishes()), 1)
+
+        self._status(0.0)
+        self.assertEqual(json.loads(self._state_publishes()[-1][1])["state"], "off")
+
+    def test_stale_in_same_document(self):
+        self.light.restore_snapshot({self.light.status_topic: "on"})
+        doc = json.loads(self._state_publishes()[-1][1])
+        self.assertEqual(doc, {"state": "on", "stale": "true"})
+
+        self._status(0.0)
+        self.assertEqual(len(self._state_publishes()), 2)
+        doc = json.loads(self._state_publishes()[-1][1])
+        self.assertEqual(doc, {"state": "off", "stale": "false"})
+
+    def test_discovery(self):
+        self.light.set_rvc_send_queue(queue.Queue())
+        self.light.initialize()
+        configs = [json.loads(c.args[1]) for c in self.mqtt.publish.call_args_list if c.args[0] == "ha/config"]
+        self.assertEqual(configs[0]["state_topic"], self.light.status_topic)
+        self.assertEqual(configs[0]["value_template"], "{{ value_json.state }}")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,118 @@
+"""
+Unit tests for the memory growth report
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import json
+import tracemalloc
+import unittest
+from unittest.mock import MagicMock
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.memory_support import MemoryReport
+from rvc2mqtt.timer_support import TimerSupport
+
+
+class Leaky(object):
+    pass
+
+
+class Test_MemoryReport(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.timer = TimerSupport(lambda: self.now)
+        self.mqtt = MagicMock()
+        self.mqtt.root_topic = "rvc2mqtt/bridge"
+        self.mqtt.bridge_info_topic = "rvc2mqtt/bridge/info"
+        self.leak = []
+        self.mr = MemoryReport(self.timer, self.mqtt, lambda: {"rx": 3})
+
+    def tearDown(self):
+        self.mr.close()
+
+    def test_first_report_is_baseline(self):
+        self.assertFalse(tracemalloc.is_tracing())
+        r = self.mr.report()
+        self.assertTrue(tracemalloc.is_tracing())
+        self.assertTrue(r["baseline"])
+        self.assertEqual(r["top_growth"], [])
+        self.assertEqual(r["type_growth"], {})
+        self.assertEqual(r["queues"], {"rx": 3})
+        self.mr.close()
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_growth_found(self):
+        self.mr.report()
+        self.leak.extend(Leaky() for _ in range(5000))
+        r = self.mr.report()
+        self.assertFalse(r["baseline"])
+        self.assertGreaterEqual(r["type_growth"]["Leaky"], 5000)
+        self.assertTrue(any(g["site"].startswith("memory_support_test.py") for g in r["top_growth"]))
+        self.assertLessEqual(len(r["top_growth"]), MemoryReport.TOP_COUNT)
+
+        (topic, payload) = self.mqtt.publish.call_args.args[:2]
+        self.assertEqual(topic, "rvc2mqtt/bridge/info/memory")
+        self.assertEqual(json.loads(payload)["type_growth"]["Leaky"], r["type_growth"]["Leaky"])
+
+    def test_on_demand_from_mqtt(self):
+        self.mqtt.register.assert_called_once_with("rvc2mqtt/bridge/memory_report/set", self.mr.process_mqtt_msg)
+        self.mr.process_mqtt_msg(self.mr.command_topic, "")
+        self.assertEqual(self.mqtt.publish.call_count, 1)
+        self.assertTrue(tracemalloc.is_tracing())
+
+        # second request while the window runs is ignored
+        with self.assertLogs("rvc2mqtt.memory_support", level="WARNING"):
+            self.mr.process_mqtt_msg(self.mr.command_topic, "10")
+        self.assertEqual(self.mqtt.publish.call_count, 1)
+
+        # growth reported after the window then tracing stops
+        self.leak.extend(Leaky() for _ in range(5000))
+        self.now = MemoryReport.DEFAULT_WINDOW
+        self.timer.service()
+        self.assertEqual(self.mqtt.publish.call_count, 2)
+        report = json.loads(self.mqtt.publish.call_args.args[1])
+        self.assertFalse(report["baseline"])
+        self.assertGreaterEqual(report["type_growth"]["Leaky"], 5000)
+        self.assertFalse(tracemalloc.is_tracing())
+
+        # next request is a new baseline
+        self.mr.process_mqtt_msg(self.mr.command_topic, "5")
+        self.assertTrue(json.loads(self.mqtt.publish.call_args.args[1])["baseline"])
+
+    def test_on_demand_with_periodic_keeps_tracing(self):
+        self.mr.interval = 60
+        self.mr.process_mqtt_msg(self.mr.command_topic, "")
+        self.assertEqual(self.mqtt.publish.call_count, 1)
+        self.assertEqual(len(self.timer), 0)
+        self.assertTrue(tracemalloc.is_tracing())
+
+    def test_periodic(self):
+        self.mr.interval = 60
+        self.mr.start()
+        self.now = 120
+        self.timer.service()
+        self.assertEqual(self.mqtt.publish.call_count, 2)
+
+    def test_disabled_by_default(self):
+        self.mr.start()
+        self.assertEqual(len(self.timer), 0)
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+Unit tests for the metrics support
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import unittest
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.metrics_support import LatencyHistogram, StartupTimer, FrameLatencyTracer
+
+
+class Test_LatencyHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        h = LatencyHistogram()
+        self.assertIsNone(h.percentile(50))
+        self.assertEqual(h.as_dict(), {"count": 0})
+
+    def test_record(self):
+        h = LatencyHistogram((10, 100))
+        for s in (0.001, 0.002, 0.050, 0.080, 0.500):
+            h.record(s)
+        self.assertEqual(h.count, 5)
+        self.assertEqual(h.buckets, [2, 2, 1])
+        self.assertAlmostEqual(h.min_ms, 1.0)
+        self.assertAlmostEqual(h.max_ms, 500.0)
+        self.assertEqual(h.percentile(40), 10.0)
+        self.assertEqual(h.percentile(80), 100.0)
+        self.assertAlmostEqual(h.percentile(99), 500.0)
+
+        d = h.as_dict()
+        self.assertEqual(d["count"], 5)
+        self.assertEqual(d["buckets"], {"le_10": 2, "le_100": 2, "overflow": 1})
+        self.assertAlmostEqual(d["avg_ms"], 126.6)
+
+    def test_percentile_capped_by_max(self):
+        h = LatencyHistogram((10, 100))
+        h.record(0.020)
+        self.assertAlmostEqual(h.percentile(50), 20.0)
+
+    def test_reset(self):
+        h = LatencyHistogram()
+        h.record(0.1)
+        h.reset()
+        self.assertEqual(h.count, 0)
+        self.assertEqual(sum(h.buckets), 0)
+
+
+class Test_StartupTimer(unittest.TestCase):
+
+    def test_phases_and_milestones(self):
+        now = [10.0]
+        t = StartupTimer(lambda: now[0])
+        with t.phase("rvc_spec"):
+            now[0] += 0.25
+        with t.phase("plugins"):
+            now[0] += 0.05
+        t.mark("main_loop")
+        now[0] += 0.1
+        t.mark("first_frame")
+        now[0] += 1
+        t.mark("first_frame")  # only the first is kept
+        self.assertTrue(t.has_mark("first_frame"))
+        self.assertFalse(t.has_mark("other"))
+        self.assertEqual(t.as_dict(), {"phases_ms": {"rvc_spec": 250.0, "plugins": 50.0},
+                                       "milestones_ms": {"main_loop": 300.0, "first_frame": 400.0}})
+        self.assertIn("rvc_spec 250.0ms", str(t))
+
+    def test_phase_recorded_on_exception(self):
+        t = StartupTimer()
+        with self.assertRaises(ValueError):
+            with t.phase("bad"):
+                raise ValueError()
+        self.assertIn("bad", t.as_dict()["phases_ms"])
+
+
+class Test_FrameLatencyTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.t = FrameLatencyTracer(lambda: self.now, max_dgns=2)
+
+    def _frame(self, dgn: str, publish: bool = True, rx_timestamp: float = None):
+        self.t.begin(self.now - 0.004 if rx_timestamp is None else rx_timestamp)
+        self.now += 0.0001
+        self.t.decoded(dgn)
+        self.now += 0.001
+        if publish:
+            self.t.published()
+            self.t.published()  # only the first counts
+        self.now += 0.001
+        self.t.end()
+
+    def test_stages(self):
+        self._frame("DC_LOAD_STATUS")
+        stages = self.t.get_stats()["stages"]
+        self.assertEqual(stages["queue"]["max_ms"], 4.0)
+        self.assertEqual(stages["decode"]["max_ms"], 0.1)
+        self.assertEqual(stages["publish"]["max_ms"], 5.1)
+        self.assertEqual(stages["publish"]["count"], 1)
+        self.assertEqual(stages["dispatch"]["max_ms"], 2.0)
+        self.assertEqual(stages["total"]["max_ms"], 6.1)
+        self.assertEqual(self.t.get_stats()["dgn_total"]["DC_LOAD_STATUS"]["count"], 1)
+
+    def test_no_publish_or_timestamp(self):
+        self._frame("DC_LOAD_STATUS", publish=False, rx_timestamp=0)
+        stages = self.t.get_stats()["stages"]
+        self.assertEqual(stages["queue"]["count"], 0)
+        self.assertEqual(stages["publish"]["count"], 0)
+        self.assertEqual(stages["total"]["max_ms"], 2.1)
+
+    def test_decode_failed(self):
+        self.t.begin(self.now - 0.001)
+        self.t.published()
+        self.t.end()
+        stages = self.t.get_stats()["stages"]
+        self.assertEqual(stages["queue"]["count"], 1)
+        self.assertEqual(stages["publish"]["count"], 0)
+        self.assertEqual(stages["total"]["count"], 0)
+
+    def test_dgn_count_bounded(self):
+        for name in ["A", "B", "C", "D", "A"]:
+            self._frame(name)
+        dgns = self.t.get_stats()["dgn_total"]
+        self.assertEqual(set(dgns), {"A", "B", FrameLatencyTracer.OTHER_DGN})
+        self.assertEqual(dgns["A"]["count"], 2)
+        self.assertEqual(dgns[FrameLatencyTracer.OTHER_DGN]["count"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
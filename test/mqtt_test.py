@@ -18,9 +18,145 @@ limitations under the License.
 
 """
 import os
+import queue
 import unittest
+from unittest.mock import MagicMock, patch
 import context  # add rvc2mqtt package to the python path using local reference
 from rvc2mqtt.mqtt import *
+from rvc2mqtt.timer_support import TimerSupport
+import paho.mqtt.client as mqc
+
+
+class Test_MQTT_Support_Commands(unittest.TestCase):
+
+    def _msg(self, topic: str, payload: str):
+        msg = MagicMock()
+        msg.topic = topic
+        msg.payload = payload.encode('utf-8')
+        return msg
+
+    def test_on_message_calls_registered(self):
+        m = MQTT_Support("bridge")
+        received = []
+        m.register("a/set", lambda t, p: received.append((t, p)))
+        m.on_message(None, None, self._msg("a/set", "on"))
+        self.assertEqual(received, [("a/set", "on")])
+
+    def test_on_message_queued(self):
+        m = MQTT_Support("bridge")
+        q = queue.Queue()
+        m.set_command_queue(q)
+        received = []
+        func = lambda t, p: received.append((t, p))
+        m.register("a/set", func)
+        m.on_message(None, None, self._msg("a/set", "off"))
+        m.on_message(None, None, self._msg("unknown/set", "off"))
+        # not run on the network thread
+        self.assertEqual(received, [])
+        self.assertEqual(q.get_nowait(), (func, "a/set", "off"))
+        self.assertTrue(q.empty())
+
+class Test_MQTT_Support_Offline(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.timer = TimerSupport(lambda: self.now)
+        self.m = MQTT_Support("bridge")
+        self.m.set_client(MagicMock())
+        self.m.client.publish.return_value.rc = mqc.MQTT_ERR_SUCCESS
+        self.m.set_timer_support(self.timer)
+
+    def _published(self):
+        return [(c.args[0], c.args[1]) for c in self.m.client.publish.call_args_list]
+
+    def _connect(self):
+        self.m.on_connect(None, None, None, mqc.CONNACK_ACCEPTED)
+        self.m.client.publish.reset_mock()
+
+    def test_connected_publish(self):
+        self._connect()
+        self.m.publish("a", "1", retain=True)
+        self.assertEqual(self._published(), [("a", "1")])
+        self.assertEqual(self.m.get_offline_buffer_count(), 0)
+
+    def test_frame_tracer_told_of_publish(self):
+        self.m.frame_tracer = MagicMock()
+        self.m.publish("a", "1")
+        self.m.frame_tracer.published.assert_not_called()  # buffered, not handed to paho
+        self._connect()
+        self.m.publish("a", "2")
+        self.m.frame_tracer.published.assert_called_once()
+
+    def test_latest_value_kept_while_offline(self):
+        for i in range(10):
+            self.m.publish("a", str(i), retain=True)
+        self.m.publish("b", "x", retain=True)
+        self.m.client.publish.assert_not_called()
+        self.assertEqual(self.m.get_offline_buffer_count(), 2)
+
+        self._connect()
+        self.timer.service()
+        self.assertEqual(self._published(), [("a", "9"), ("b", "x")])
+        self.assertEqual(self.m.get_offline_stats()["replaced"], 9)
+
+    def test_bounded(self):
+        for i in range(MQTT_Support.OFFLINE_BUFFER_SIZE + 5):
+            self.m.publish(f"t{i}", "v")
+        self.assertEqual(self.m.get_offline_buffer_count(), MQTT_Support.OFFLINE_BUFFER_SIZE)
+        self.assertEqual(self.m.get_offline_stats()["dropped"], 5)
+
+    def test_paced_flush(self):
+        count = MQTT_Support.FLUSH_BATCH_SIZE * 2 + 1
+        for i in range(count):
+            self.m.publish(f"t{i}", "v")
+        self._connect()
+        self.timer.service()
+        self.assertEqual(len(self._published()), MQTT_Support.FLUSH_BATCH_SIZE)
+
+        # newer value published directly is not overwritten by the flush
+        self.m.publish(f"t{count - 1}", "new")
+        self.now += MQTT_Support.FLUSH_INTERVAL
+        self.timer.service()
+        self.now += MQTT_Support.FLUSH_INTERVAL
+        self.timer.service()
+        published = self._published()
+        self.assertEqual(len(published), count)
+        self.assertEqual([p for p in published if p[0] == f"t{count - 1}"], [(f"t{count - 1}", "new")])
+        self.assertEqual(self.m.get_offline_buffer_count(), 0)
+
+    def test_disconnect_buffers(self):
+        self._connect()
+        self.m.on_disconnect(None, None, None)
+        self.m.publish("a", "1")
+        self.m.client.publish.assert_not_called()
+
+        # paho reports no connection before the disconnect callback
+        self._connect()
+        self.timer.service()
+        self.m.client.publish.return_value.rc = mqc.MQTT_ERR_NO_CONN
+        self.m.publish("b", "2")
+        self.assertEqual(self.m.get_offline_buffer_count(), 1)
+
+
+class Test_MqttInitalize(unittest.TestCase):
+
+    def test_doesnt_wait_for_broker(self):
+        with patch("paho.mqtt.client.Client") as client_class:
+            m = MqttInitalize("broker", "1883", "user", "pass", "bridge")
+            client = client_class.return_value
+            client.connect_async.assert_called_once_with("broker", port=1883)
+            client.connect.assert_not_called()
+            client.reconnect_delay_set.assert_called_once_with(MQTT_Support.RECONNECT_MIN_DELAY,
+                                                               MQTT_Support.RECONNECT_MAX_DELAY)
+            self.assertIs(m.client, client)
+
+    def test_bad_config_still_returns_support(self):
+        with patch("paho.mqtt.client.Client"):
+            m = MqttInitalize("broker", "not a port", "user", "pass", "bridge")
+            self.assertIsInstance(m, MQTT_Support)
+            m.publish("a", "1")
+            self.assertEqual(m.get_offline_buffer_count(), 1)
+
 
 ## can't figure out how to unit test this..probably need to mock...but given this class is tightly coupled with
 ## paho mqtt not sure how useful....anyway..below is hack to test it with real mqtt server
@@ -0,0 +1,95 @@
+"""
+Unit tests for on demand profiling
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import json
+import os
+import pstats
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.profile_support import ProfileSupport
+from rvc2mqtt.timer_support import TimerSupport
+
+
+def busy_work():
+    return sum(i * i for i in range(20000))
+
+
+class Test_ProfileSupport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.now = 0.0
+        self.timer = TimerSupport(lambda: self.now)
+        self.mqtt = MagicMock()
+        self.mqtt.root_topic = "rvc2mqtt/bridge"
+        self.mqtt.bridge_info_topic = "rvc2mqtt/bridge/info"
+        self.ps = ProfileSupport(self.tmp.name, self.timer, self.mqtt)
+
+    def tearDown(self):
+        if self.ps.is_running():
+            self.ps.profiler.disable()
+        self.tmp.cleanup()
+
+    def test_registers_command_topic(self):
+        self.mqtt.register.assert_called_once_with("rvc2mqtt/bridge/profile/set", self.ps.process_mqtt_msg)
+
+    def test_session_from_mqtt(self):
+        self.ps.process_mqtt_msg(self.ps.command_topic, "5")
+        self.assertTrue(self.ps.is_running())
+        busy_work()
+        self.now = 4.9
+        self.timer.service()
+        self.assertTrue(self.ps.is_running())
+        self.now = 5.0
+        self.timer.service()
+        self.assertFalse(self.ps.is_running())
+
+        (topic, payload) = self.mqtt.publish.call_args.args[:2]
+        self.assertEqual(topic, "rvc2mqtt/bridge/info/profile")
+        summary = json.loads(payload)
+        self.assertTrue(os.path.isfile(summary["file"]))
+        self.assertTrue(any("busy_work" in f["function"] or "genexpr" in f["function"] for f in summary["top"]))
+        self.assertLessEqual(len(summary["top"]), ProfileSupport.TOP_COUNT)
+        self.assertGreater(len(pstats.Stats(summary["file"]).stats), 0)
+
+    def test_only_one_session(self):
+        self.assertTrue(self.ps.start(1))
+        self.assertFalse(self.ps.start(1))
+
+    def test_invalid_payload(self):
+        self.ps.process_mqtt_msg(self.ps.command_topic, "soon")
+        self.assertFalse(self.ps.is_running())
+
+    def test_signal_only_sets_flag(self):
+        self.ps._signal_handler(10, None)
+        self.assertTrue(self.ps.start_requested)
+        self.assertFalse(self.ps.is_running())
+        self.ps.start()
+        self.assertFalse(self.ps.start_requested)
+        self.assertTrue(self.ps.is_running())
+
+    def test_stop_when_not_running(self):
+        self.assertIsNone(self.ps.stop())
+
+
+if __name__ == '__main__':
+    unittest.main()
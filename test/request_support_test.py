@@ -0,0 +1,140 @@
+"""
+Unit tests for the DGN request scheduler
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import os
+import unittest
+from unittest.mock import MagicMock
+import queue
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.request_support import DgnRequestScheduler
+from rvc2mqtt.timer_support import TimerSupport
+from rvc2mqtt.tx_support import TxScheduler
+from rvc2mqtt.entity.light_switch import LightSwitch_DC_LOAD_STATUS
+from rvc2mqtt.rvc import RVC_Decoder
+
+rvc_spec_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'rvc2mqtt', 'rvc-spec.yml'))
+
+
+class Test_DgnRequestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.timer = TimerSupport(lambda: self.now)
+        self.sent = []
+        self.scheduler = DgnRequestScheduler(self.timer, self.sent.append, interval=0.1, retry_timeout=5.0,
+                                             max_retries=1, wildcard_dgns={"1FFBD"})
+
+    def _run(self, seconds: float, step: float = 0.01):
+        end = self.now + seconds
+        while self.now < end:
+            self.now += step
+            self.timer.service()
+
+    def _requests(self):
+        return [(m["dgn"], m["data"].hex().upper()) for m in self.sent]
+
+    def test_wildcards_from_spec(self):
+        decoder = RVC_Decoder()
+        decoder.load_rvc_spec(rvc_spec_file_path)
+        scheduler = DgnRequestScheduler(self.timer, self.sent.append, wildcard_dgns=decoder.get_instanced_dgns())
+        self.assertIn("1FFBD", scheduler.wildcard_dgns)
+        self.assertFalse(any(d.startswith("Z") for d in decoder.get_instanced_dgns()))
+
+    def test_invalid_dgn_ignored(self):
+        scheduler = DgnRequestScheduler(self.timer, self.sent.append, wildcard_dgns={"1FFBD", "Z0001"})
+        self.assertEqual(scheduler.wildcard_dgns, {"1FFBD"})
+        scheduler.request("Z0001", 1)
+        self.assertEqual(scheduler.get_pending_count(), 0)
+
+    def test_request_data(self):
+        self.assertEqual(DgnRequestScheduler.make_request_data("1FFBD", 3), bytes.fromhex("BDFF010300000000"))
+
+    def test_held_until_start(self):
+        self.scheduler.request("1FFB7", 1)
+        self._run(1)
+        self.assertEqual(self.sent, [])
+        self.scheduler.start()
+        self._run(1)
+        self.assertEqual(self._requests(), [("EAFF", "B7FF010100000000")])
+
+    def test_dedupe_merge_and_pace(self):
+        for i in (1, 2, 3, 2):
+            self.scheduler.request("1FFBD", i)
+        self.scheduler.request("1FFB7", 5)
+        self.scheduler.request("1FFB7", 6)
+        self.scheduler.start()
+
+        self._run(0.05)
+        # merged into one wildcard request
+        self.assertEqual(self._requests(), [("EAFF", "BDFF01FF00000000")])
+
+        # tank status doesn't allow wildcard.  One request per interval
+        self._run(0.1)
+        self.assertEqual(len(self.sent), 2)
+        self._run(0.1)
+        self.assertEqual(self._requests()[1:], [("EAFF", "B7FF010500000000"), ("EAFF", "B7FF010600000000")])
+        self._run(10)
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(self.scheduler.get_pending_count(), 0)
+        self.assertEqual(self.scheduler.counters["merged"], 2)
+
+    def test_rerequest_unsatisfied(self):
+        known = {1: False, 2: False}
+        self.scheduler.request("1FFBD", 1, lambda: known[1])
+        self.scheduler.request("1FFBD", 2, lambda: known[2])
+        self.scheduler.start()
+        self._run(1)
+        self.assertEqual(len(self.sent), 1)
+
+        known[1] = True
+        self._run(5)
+        # only instance 2 is requested again
+        self.assertEqual(self._requests()[1], ("EAFF", "BDFF010200000000"))
+        self.assertEqual(self.sent[0]["tx_class"], TxScheduler.TX_CLASS_DISCOVERY)
+        self.assertEqual(self.sent[1]["tx_class"], TxScheduler.TX_CLASS_REFRESH)
+
+        # gives up after max_retries
+        self._run(20)
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(self.scheduler.get_stats()["unsatisfied"], 1)
+        self.assertEqual(self.scheduler.get_pending_count(), 0)
+
+    def test_entity_uses_scheduler(self):
+        mock = MagicMock()
+        mock.make_device_topic_string.return_value = 'topic_string'
+        mock.make_ha_auto_discovery_config_topic.return_value = 'config_topic'
+        mock.get_bridge_ha_name.return_value = 'bridge'
+        mock.bridge_state_topic = 'bridge_state'
+        mock.TOPIC_BASE = 'rvc2mqtt'
+        mock.client_id = 'bridge'
+        q = queue.Queue()
+        lights = [LightSwitch_DC_LOAD_STATUS({'instance': i, 'instance_name': f"light {i}"}, mock) for i in (1, 2)]
+        for light in lights:
+            light.set_rvc_send_queue(q)
+            light.set_dgn_request_scheduler(self.scheduler)
+            light.initialize()
+        self.scheduler.start()
+        self._run(1)
+        self.assertTrue(q.empty())
+        self.assertEqual(self._requests(), [("EAFF", "BDFF01FF00000000")])
+
+
+if __name__ == '__main__':
+    unittest.main()
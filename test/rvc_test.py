@@ -66,6 +66,104 @@ class Test_RVC_Decoder(unittest.TestCase):
         self.assertEqual('ACKNOWLEDGMENT', results['name'])
         self.assertEqual('command-specific response', results['acknowledgment_code_definition'])
 
+    def test_decoded_message_record(self):
+        rvc = RVC_Decoder()
+        rvc.load_rvc_spec(rvc_spec_file_path)
+        results = rvc.rvc_decode(int("19ffe259", 16), '0215C84724472400')
+
+        # attribute access and dictionary access are the same
+        self.assertEqual(results.instance, 2)
+        self.assertEqual(results["instance"], 2)
+        self.assertEqual(results.fan_mode_definition, 'on')
+        self.assertEqual(results["fan_mode_definition"], 'on')
+        self.assertEqual(results.name, 'THERMOSTAT_STATUS_1')
+        self.assertEqual(results["dgn"], '1FFE2')
+        self.assertIn("setpoint_temp_cool", results)
+        self.assertNotIn("not_a_field", results)
+        self.assertIsNone(results.get("not_a_field"))
+        with self.assertRaises(KeyError):
+            results["not_a_field"]
+
+        # fixed set of slots.  No per message dictionary
+        self.assertFalse(hasattr(results, "__dict__"))
+
+        d = results.as_dict()
+        self.assertIsInstance(d, dict)
+        self.assertEqual(list(d.keys())[:8], ['arbitration_id', 'data', 'priority', 'dgn_h', 'dgn_l', 'dgn', 'source_id', 'name'])
+        self.assertEqual(d, dict(results))
+        self.assertEqual(str(results), str(d))
+
+    def test_parameter_overrides_header(self):
+        rvc = RVC_Decoder()
+        rvc.load_rvc_spec(rvc_spec_file_path)
+        # DC_LOAD_STATUS has a priority parameter that replaces the header priority
+        results = rvc.rvc_decode(int("19ffbd80", 16), '2200C80000000000')
+        self.assertEqual(results["priority"], '0000')
+        self.assertEqual(results["priority_definition"], 'highest priority')
+        self.assertEqual(results["operating_status"], 100.0)
+
+        # no data.  header priority is used and there is no definition
+        results = rvc.rvc_decode(int("19ffbd80", 16), '')
+        self.assertEqual(results["priority"], '6')
+        self.assertNotIn("priority_definition", results)
+        self.assertEqual(results["decoder_pending"], 1)
+
+    def test_unknown_dgn(self):
+        rvc = RVC_Decoder()
+        rvc.load_rvc_spec(rvc_spec_file_path)
+        results = rvc.rvc_decode(int("19EF0080", 16), '0011223344556677')
+        self.assertEqual(results["name"], 'UNKNOWN-1EF00')
+        self.assertEqual(len(results), 8)
+
+    def test_get_dgn_name(self):
+        rvc = RVC_Decoder()
+        rvc.load_rvc_spec(rvc_spec_file_path)
+        self.assertEqual(rvc.get_dgn_name("1FFF7"), "WATERHEATER_STATUS")
+        self.assertIsNone(rvc.get_dgn_name("1EF00"))
+
+    def test_field_projection(self):
+        rvc = RVC_Decoder()
+        rvc.load_rvc_spec(rvc_spec_file_path)
+        rvc.set_field_projection({"THERMOSTAT_STATUS_1": ["instance", "fan_mode_definition"], "DM_RV": None})
+
+        results = rvc.rvc_decode(int("19ffe259", 16), '0215C84724472400')
+        self.assertEqual(results["instance"], 2)
+        self.assertEqual(results["fan_mode_definition"], 'on')
+        self.assertNotIn("setpoint_temp_cool", results)
+
+        # full decode is still available
+        results = rvc.rvc_decode(int("19ffe259", 16), '0215C84724472400', full=True)
+        self.assertEqual(results["setpoint_temp_cool"], 17.22)
+
+        # DGN without a projection only has the header
+        results = rvc.rvc_decode(int("19fff780", 16), "0100000000000000")
+        self.assertEqual(results["name"], "WATERHEATER_STATUS")
+        self.assertNotIn("instance", results)
+
+        # None means all fields
+        results = rvc.rvc_decode(int("19feca80", 16), '0540FFFFFFFFFFFF')
+        self.assertIn("fmi", results)
+
+        rvc.set_field_projection(None)
+        results = rvc.rvc_decode(int("19fff780", 16), "0100000000000000")
+        self.assertEqual(results["instance"], 1)
+
+    def test_unknown_dgn_counts(self):
+        rvc = RVC_Decoder()
+        rvc.load_rvc_spec(rvc_spec_file_path)
+        with self.assertLogs("rvc2mqtt.rvc", level="WARNING") as cm:
+            for i in range(5):
+                rvc.rvc_decode(int("19EF0080", 16), '0011223344556677')
+            rvc.rvc_decode(int("19EF0081", 16), '0011223344556677')
+            rvc.rvc_decode(int("19EF0180", 16), '0011223344556677')
+        # only the first frame of each dgn is logged
+        self.assertEqual(len(cm.output), 2)
+        self.assertEqual(rvc.get_unknown_dgn_counts(), {"1EF00": 6, "1EF01": 1})
+
+        with self.assertLogs("rvc2mqtt.rvc", level="INFO") as cm:
+            rvc.unknown_dgns.log_summary()
+        self.assertIn("1EF00: 6", cm.output[0])
+
     def test_canbus_to_rvc(self):
         rvc = RVC_Decoder()
         result = rvc._can_frame_to_rvc(int("19FFBC44", 16))
@@ -0,0 +1,150 @@
+"""
+Unit tests for the entity state snapshot
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import unittest
+from unittest.mock import MagicMock, patch
+import os
+import queue
+import tempfile
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.snapshot_support import StateSnapshot
+from rvc2mqtt.timer_support import TimerSupport
+from rvc2mqtt.entity.light_switch import LightSwitch_DC_LOAD_STATUS as Light
+
+
+class Test_StateSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "snapshot.jsonl")
+        self.now = 0.0
+        self.timer = TimerSupport(lambda: self.now)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _make_lights(self):
+        mqtt = MagicMock()
+        mqtt.make_device_topic_string.side_effect = lambda id, field, state: f"d/{id}/{field}/{state}"
+        mqtt.make_ha_auto_discovery_config_topic.return_value = "ha/config"
+        mqtt.get_bridge_ha_name.return_value = "bridge"
+        mqtt.bridge_state_topic = "bridge/state"
+        mqtt.TOPIC_BASE = "rvc2mqtt"
+        mqtt.client_id = "bridge"
+        lights = [Light({'instance': i, 'instance_name': f"light {i}"}, mqtt) for i in (1, 2)]
+        for light in lights:
+            light.set_rvc_send_queue(queue.Queue())
+        return (mqtt, lights)
+
+    def _status(self, light, level: float):
+        light.process_rvc_msg({"name": "DC_LOAD_STATUS", "instance": light.rvc_instance, "operating_status": level})
+
+    def _published(self, mqtt, topic):
+        return [c.args[1] for c in mqtt.publish.call_args_list if c.args[0] == topic]
+
+    def test_save_and_restore(self):
+        (mqtt, lights) = self._make_lights()
+        snapshot = StateSnapshot(self.path, lights, self.timer, interval=10)
+        snapshot.start()
+        self._status(lights[0], 100.0)
+        self.now += 10
+        self.timer.service()
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+        # no change.  Nothing written
+        self._status(lights[0], 100.0)
+        self.now += 10
+        self.timer.service()
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+        # restart
+        (mqtt, lights) = self._make_lights()
+        for light in lights:
+            light.initialize()
+        snapshot = StateSnapshot(self.path, lights, self.timer)
+        self.assertEqual(snapshot.restore(), 1)
+        self.assertEqual(self._published(mqtt, lights[0].status_topic), ["unknown", "on"])
+        self.assertEqual(self._published(mqtt, lights[0].stale_topic), ["true"])
+        self.assertTrue(lights[0].stale)
+        self.assertFalse(lights[1].stale)
+
+        # device reports.  No longer stale
+        self._status(lights[0], 0.0)
+        self.assertEqual(self._published(mqtt, lights[0].status_topic), ["unknown", "on", "off"])
+        self.assertEqual(self._published(mqtt, lights[0].stale_topic), ["true", "false"])
+        self.assertFalse(lights[0].stale)
+
+    def test_compaction_and_bad_lines(self):
+        (mqtt, lights) = self._make_lights()
+        snapshot = StateSnapshot(self.path, lights, self.timer)
+        for i in range(StateSnapshot.COMPACT_LINES + 1):
+            self._status(lights[i % 2], 100.0 if (i // 2) % 2 else 0.0)
+            snapshot.save()
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        with open(self.path, "a") as f:
+            f.write('{"t": 1, "e": {"light-1FF')  # cut short
+
+        saved = StateSnapshot(self.path, lights, self.timer).load()
+        self.assertEqual(saved[lights[0].id][lights[0].status_topic], lights[0].state)
+        self.assertEqual(saved[lights[1].id][lights[1].status_topic], lights[1].state)
+
+    def test_failed_write_saved_later(self):
+        (mqtt, lights) = self._make_lights()
+        self.path = os.path.join(self.dir.name, "missing", "snapshot.jsonl")
+        snapshot = StateSnapshot(self.path, lights, self.timer)
+        self._status(lights[0], 100.0)
+        with self.assertLogs("rvc2mqtt.snapshot_support", level="ERROR"):
+            self.assertFalse(snapshot.save())
+
+        # the states that failed are written with the next save
+        os.mkdir(os.path.dirname(self.path))
+        self.assertTrue(snapshot.save())
+        saved = StateSnapshot(self.path, lights, self.timer).load()
+        self.assertEqual(saved[lights[0].id][lights[0].status_topic], "on")
+
+    def test_failed_compaction_saved_later(self):
+        (mqtt, lights) = self._make_lights()
+        snapshot = StateSnapshot(self.path, lights, self.timer)
+        snapshot._lines = StateSnapshot.COMPACT_LINES
+        self._status(lights[0], 100.0)
+        with patch("os.replace", side_effect=OSError("disk full")):
+            with self.assertLogs("rvc2mqtt.snapshot_support", level="ERROR"):
+                self.assertFalse(snapshot.save())
+        self.assertTrue(snapshot.save())
+        saved = StateSnapshot(self.path, lights, self.timer).load()
+        self.assertEqual(saved[lights[0].id][lights[0].status_topic], "on")
+
+    def test_save_while_entity_lock_held(self):
+        (mqtt, lights) = self._make_lights()
+        snapshot = StateSnapshot(self.path, lights, self.timer)
+        self._status(lights[0], 100.0)
+        with lights[0]._command_lock:
+            self.assertTrue(snapshot.save())
+
+    def test_missing_file(self):
+        (mqtt, lights) = self._make_lights()
+        self.assertEqual(StateSnapshot(self.path, lights, self.timer).restore(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Unit tests for the timer support
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import unittest
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.timer_support import TimerSupport
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class Test_TimerSupport(unittest.TestCase):
+
+    def test_runs_in_time_order(self):
+        clock = FakeClock()
+        t = TimerSupport(clock)
+        ran = []
+        t.call_later(2, ran.append, "b")
+        t.call_later(1, ran.append, "a")
+        t.call_later(3, ran.append, "c")
+        self.assertEqual(t.next_deadline(), 101.0)
+
+        self.assertEqual(t.service(), 0)
+        clock.now = 102.0
+        self.assertEqual(t.service(), 2)
+        self.assertEqual(ran, ["a", "b"])
+        clock.now = 110.0
+        t.service()
+        self.assertEqual(ran, ["a", "b", "c"])
+        self.assertEqual(len(t), 0)
+        self.assertIsNone(t.next_deadline())
+
+    def test_cancel(self):
+        clock = FakeClock()
+        t = TimerSupport(clock)
+        ran = []
+        h = t.call_later(1, ran.append, "a")
+        h.cancel()
+        clock.now = 105.0
+        self.assertEqual(t.service(), 0)
+        self.assertEqual(ran, [])
+        self.assertEqual(len(t), 0)
+
+    def test_callback_exception(self):
+        clock = FakeClock()
+        t = TimerSupport(clock)
+        ran = []
+        t.call_later(1, lambda: 1/0)
+        t.call_later(1, ran.append, "a")
+        clock.now = 101.0
+        self.assertEqual(t.service(), 2)
+        self.assertEqual(ran, ["a"])
+
+    def test_schedule_from_callback(self):
+        clock = FakeClock()
+        t = TimerSupport(clock)
+        ran = []
+        t.call_later(0, lambda: t.call_later(0, ran.append, "later"))
+        t.service()
+        # new callback runs on the next service so a callback can't starve the loop
+        self.assertEqual(ran, [])
+        t.service()
+        self.assertEqual(ran, ["later"])
+
+
+if __name__ == '__main__':
+    unittest.main()
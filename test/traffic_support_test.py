@@ -0,0 +1,96 @@
+"""
+Unit tests for the can bus traffic analyzer
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import unittest
+from unittest.mock import patch
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.traffic_support import BusTrafficAnalyzer
+from rvc2mqtt.tx_support import TxScheduler
+
+WATERHEATER_STATUS = 0x19FFF780
+DC_LOAD_STATUS_SRC_44 = 0x19FFBD44
+
+
+class Test_BusTrafficAnalyzer(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        names = {"1FFF7": "WATERHEATER_STATUS"}
+        self.a = BusTrafficAnalyzer(names.get, clock=lambda: self.now)
+
+    def test_counts_and_rates(self):
+        for _ in range(20):
+            self.a.frame_received(WATERHEATER_STATUS, 8, True)
+        for _ in range(5):
+            self.a.frame_received(DC_LOAD_STATUS_SRC_44, 8, False)
+        self.now = 10.0
+        s = self.a.get_summary()
+        self.assertEqual(s["frames"], 25)
+        self.assertEqual(s["frames_per_s"], 2.5)
+        self.assertEqual(list(s["dgns"]), ["1FFF7/80", "1FFBD/44"])  # busiest first
+        self.assertEqual(s["dgns"]["1FFF7/80"], {"name": "WATERHEATER_STATUS", "rate": 2.0, "count": 20, "handled": 20})
+        self.assertEqual(s["dgns"]["1FFBD/44"], {"name": None, "rate": 0.5, "count": 5, "handled": 0})
+
+        # rates are since the last summary.  counts are totals
+        self.a.frame_received(DC_LOAD_STATUS_SRC_44, 8, True)
+        self.now = 20.0
+        s = self.a.get_summary()
+        self.assertEqual(s["frames"], 1)
+        self.assertEqual(s["dgns"]["1FFF7/80"]["rate"], 0.0)
+        self.assertEqual(s["dgns"]["1FFBD/44"], {"name": None, "rate": 0.1, "count": 6, "handled": 1})
+
+    def test_bus_load(self):
+        # one second of 8 byte frames filling half the bus
+        frames = round(0.5 * TxScheduler.BUS_BITRATE / TxScheduler.frame_bits(8))
+        for _ in range(frames):
+            self.a.frame_received(WATERHEATER_STATUS, 8, False)
+        self.now = 1.0
+        self.assertAlmostEqual(self.a.get_summary()["bus_load_pct"], 50.0, delta=0.1)
+
+    def test_bus_load_includes_tx(self):
+        tx_bits = [1000]
+        a = BusTrafficAnalyzer(clock=lambda: self.now, tx_bits=lambda: tx_bits[0])
+        quarter = round(0.25 * TxScheduler.BUS_BITRATE / TxScheduler.frame_bits(8))
+        for _ in range(quarter):
+            a.frame_received(WATERHEATER_STATUS, 8, False)
+        tx_bits[0] += quarter * TxScheduler.frame_bits(8)
+        self.now = 1.0
+        s = a.get_summary()
+        self.assertAlmostEqual(s["bus_load_pct"], 50.0, delta=0.1)
+        self.assertAlmostEqual(s["tx_load_pct"], 25.0, delta=0.1)
+
+        # only the bits sent since the last summary
+        self.now = 2.0
+        s = a.get_summary()
+        self.assertEqual(s["bus_load_pct"], 0.0)
+        self.assertEqual(s["tx_load_pct"], 0.0)
+
+    def test_entries_bounded(self):
+        with patch.object(BusTrafficAnalyzer, "MAX_ENTRIES", 2):
+            for source in range(5):
+                self.a.frame_received(0x19FFF700 | source, 8, False)
+            self.now = 1.0
+            s = self.a.get_summary()
+        self.assertEqual(set(s["dgns"]), {"1FFF7/00", "1FFF7/01", "OTHER"})
+        self.assertEqual(s["dgns"]["OTHER"]["count"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Unit tests for the transmit scheduler
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import unittest
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.tx_support import TxScheduler
+
+
+class Test_TxScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.tx = TxScheduler(0.3, clock=lambda: self.now)
+
+    def _msg(self, name, priority=6, tx_class=None):
+        m = {"name": name, "arbitration_id": (priority << 26) | (0x1FFBC << 8) | 0x82, "data": bytes(8)}
+        if tx_class is not None:
+            m["tx_class"] = tx_class
+        return m
+
+    def test_class_then_priority_order(self):
+        self.tx.put(self._msg("discovery", 6, TxScheduler.TX_CLASS_DISCOVERY))
+        self.tx.put(self._msg("refresh", 6, TxScheduler.TX_CLASS_REFRESH))
+        self.tx.put(self._msg("user low", 7))
+        self.tx.put(self._msg("user high", 3))
+        self.tx.put(self._msg("user low 2", 7))
+        order = [self.tx.get_next()["name"] for _ in range(5)]
+        self.assertEqual(order, ["user high", "user low", "user low 2", "refresh", "discovery"])
+        self.assertIsNone(self.tx.get_next())
+        self.assertTrue(self.tx.empty())
+        self.assertEqual(self.tx.get_stats()["sent"], {"user": 3, "refresh": 1, "discovery": 1})
+
+    def test_bus_share_limit(self):
+        for i in range(100):
+            self.tx.put(self._msg(str(i)))
+
+        # burst then limited by bus share
+        sent = 0
+        while self.tx.get_next() is not None:
+            sent += 1
+        self.assertEqual(sent, TxScheduler.BURST_FRAMES)
+        self.assertGreater(self.tx.get_wait_time(1), 0)
+
+        # over one second the bridge uses at most its share of the bus
+        for _ in range(1000):
+            self.now += 0.001
+            while self.tx.get_next() is not None:
+                sent += 1
+        bits = sent * TxScheduler.frame_bits(8)
+        self.assertLessEqual(bits, 250000 * 0.3 + TxScheduler.frame_bits(8) * TxScheduler.BURST_FRAMES)
+        self.assertEqual(sent, 100 - self.tx.qsize())
+        self.assertGreater(sent, 50)
+
+    def test_wait_time(self):
+        self.assertEqual(self.tx.get_wait_time(0.25), 0.25)
+        self.tx.put(self._msg("a"))
+        self.assertEqual(self.tx.get_wait_time(0.25), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
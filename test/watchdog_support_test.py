@@ -0,0 +1,87 @@
+"""
+Unit tests for the main loop stall watchdog
+
+Copyright 2022 Sean Brogan
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+import threading
+import unittest
+import context  # add rvc2mqtt package to the python path using local reference
+from rvc2mqtt.watchdog_support import LoopWatchdog
+
+
+class Test_LoopWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.reports = []
+        self.wd = LoopWatchdog(2.0, self.reports.append, lambda: {"rx": 5}, clock=lambda: self.now)
+
+    def test_no_report_while_beating(self):
+        for _ in range(10):
+            self.now += 1.0
+            self.wd.beat()
+            self.assertIsNone(self.wd.check())
+        self.assertEqual(self.reports, [])
+        self.assertEqual(self.wd.get_stats()["stalls"], 0)
+
+    def test_stall_reported_once(self):
+        self.now = 2.5
+        report = self.wd.check()
+        self.assertEqual(report["stalled_s"], 2.5)
+        self.assertEqual(report["queues"], {"rx": 5})
+        self.assertIn("test_stall_reported_once", report["stack"])
+        self.now = 5.0
+        self.assertIsNone(self.wd.check())
+        self.assertEqual(len(self.reports), 1)
+
+        # recovers then stalls again
+        self.wd.beat()
+        self.assertIsNone(self.wd.check())
+        self.now = 8.0
+        self.assertIsNotNone(self.wd.check())
+        self.assertEqual(self.wd.get_stats(), {"stalls": 2, "max_heartbeat_ms": 5000.0})
+
+    def test_stack_of_other_thread(self):
+        blocked = threading.Event()
+        release = threading.Event()
+
+        def stuck_in_plugin():
+            blocked.set()
+            release.wait(5)
+
+        t = threading.Thread(target=stuck_in_plugin)
+        t.start()
+        blocked.wait(5)
+        try:
+            wd = LoopWatchdog(1.0, self.reports.append, clock=lambda: self.now, thread_id=t.ident)
+            self.now += 1.0
+            self.assertIn("stuck_in_plugin", wd.check()["stack"])
+        finally:
+            release.set()
+            t.join()
+
+    def test_report_exception_is_logged(self):
+        def fail(report):
+            raise RuntimeError("broker gone")
+        wd = LoopWatchdog(1.0, fail, clock=lambda: self.now)
+        self.now = 1.0
+        self.assertIsNotNone(wd.check())
+
+
+if __name__ == '__main__':
+    unittest.main()
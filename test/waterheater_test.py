@@ -20,8 +20,11 @@ limitations under the License.
 
 import unittest
 from unittest.mock import MagicMock
+import json
+import queue
 import context  # add rvc2mqtt package to the python path using local reference
 from rvc2mqtt.entity.water_heater import WaterHeaterClass
+from rvc2mqtt.timer_support import TimerSupport
 
 class Test_Waterheater(unittest.TestCase):
 
@@ -33,5 +36,108 @@ class Test_Waterheater(unittest.TestCase):
         l = WaterHeaterClass({'instance': 1, 'instance_name': "test water heater"}, mock)
         self.assertTrue(type(l), WaterHeaterClass)
 
+
+class Test_Waterheater_JsonState(unittest.TestCase):
+
+    STATUS = {"name": "WATERHEATER_STATUS", "instance": 1, "operating_modes": 1,
+              "set_point_temperature": 50.0, "water_temperature": 40.0,
+              "thermostat_status": "00", "burner_status": "01", "ac_element_status": "00",
+              "high_temperature_limit_switch_status": "00", "failure_to_ignite_status": "00",
+              "ac_power_failure_status": "00", "dc_power_failure_status": "00",
+              "dc_power_warning_status": "00"}
+
+    def _make(self, json_state: bool):
+        self.mqtt = MagicMock()
+        self.mqtt.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        self.mqtt.TOPIC_BASE = "rvc2mqtt"
+        self.mqtt.client_id = "bridge"
+        self.mqtt.get_bridge_ha_name.return_value = "bridge"
+        self.mqtt.bridge_state_topic = "bridge/state"
+        self.mqtt.make_ha_auto_discovery_config_topic.side_effect = lambda id, component, sub: f"ha/{sub}/config"
+        return WaterHeaterClass({'instance': 1, 'instance_name': "test water heater", 'json_state': json_state}, self.mqtt)
+
+    def _state_publishes(self, w):
+        return [c for c in self.mqtt.publish.call_args_list if not c.args[0].startswith("ha/")]
+
+    def test_per_topic(self):
+        w = self._make(False)
+        w.process_rvc_msg(dict(Test_Waterheater_JsonState.STATUS))
+        self.assertEqual(len(self._state_publishes(w)), 13)
+
+    def test_json_state(self):
+        w = self._make(True)
+        w.process_rvc_msg(dict(Test_Waterheater_JsonState.STATUS))
+        publishes = self._state_publishes(w)
+        self.assertEqual(len(publishes), 1)
+        self.assertEqual(publishes[0].args[0], w.status_topic)
+        doc = json.loads(publishes[0].args[1])
+        self.assertEqual(doc["gas"], "on")
+        self.assertEqual(doc["ac"], "off")
+        self.assertEqual(doc["water_temperature"], 40.0)
+        self.assertEqual(doc["gas_burner"], "on")
+
+        # same status again doesn't publish
+        w.process_rvc_msg(dict(Test_Waterheater_JsonState.STATUS))
+        self.assertEqual(len(self._state_publishes(w)), 1)
+
+    def test_json_state_discovery(self):
+        w = self._make(True)
+        w.initialize()
+        configs = {c.args[0]: json.loads(c.args[1]) for c in self.mqtt.publish.call_args_list
+                   if c.args[0].startswith("ha/")}
+        gas = configs["ha/gas_mode/config"]
+        self.assertEqual(gas["state_topic"], w.status_topic)
+        self.assertEqual(gas["value_template"], "{{ value_json.gas }}")
+        self.assertEqual(gas["command_topic"], w.command_gas_topic)
+        self.assertEqual(len(self._state_publishes(w)), 1)
+
+class Test_Waterheater_Coalesce(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 10.0
+        self.timer = TimerSupport(lambda: self.now)
+        self.mqtt = MagicMock()
+        self.mqtt.make_device_topic_string.side_effect = lambda id, field, state: f"{id}/{field}/{state}"
+        self.q = queue.Queue()
+        self.w = WaterHeaterClass({'instance': 1, 'instance_name': "test water heater"}, self.mqtt)
+        self.w.set_rvc_send_queue(self.q)
+        self.w.set_timer_support(self.timer)
+        status = dict(Test_Waterheater_JsonState.STATUS)
+        status["operating_modes"] = 0
+        self.w.process_rvc_msg(status)
+
+    def _advance(self, seconds: float):
+        self.now += seconds
+        self.timer.service()
+
+    def _sent_modes(self):
+        modes = []
+        while not self.q.empty():
+            msg = self.q.get()
+            self.assertEqual(msg["dgn"], "1FFF6")
+            modes.append(msg["data"][1])
+        return modes
+
+    def test_gas_and_ac_merged(self):
+        self.w.process_mqtt_msg(self.w.command_gas_topic, "on")
+        self._advance(0.1)
+        self.w.process_mqtt_msg(self.w.command_ac_topic, "on")
+        self.assertEqual(self._sent_modes(), [])
+        self._advance(WaterHeaterClass.COMMAND_COALESCE_WINDOW)
+        self.assertEqual(self._sent_modes(), [3])
+
+    def test_change_undone_in_window(self):
+        self.w.process_mqtt_msg(self.w.command_gas_topic, "on")
+        self.w.process_mqtt_msg(self.w.command_gas_topic, "off")
+        self._advance(WaterHeaterClass.COMMAND_COALESCE_WINDOW)
+        self.assertEqual(self._sent_modes(), [0])
+
+    def test_no_change_not_sent(self):
+        self.w.process_mqtt_msg(self.w.command_ac_topic, "off")
+        self._advance(WaterHeaterClass.COMMAND_COALESCE_WINDOW)
+        self.assertEqual(self._sent_modes(), [])
+        self.assertEqual(len(self.timer), 0)
+
+
 if __name__ == '__main__':
     unittest.main()